@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Measures how many statements per second the parser handles, with and without
+building the `Statement` objects (which compiles a SQLAlchemy `text()` clause
+for each one).
+
+    poetry run python benchmarks/parse.py [statements]
+"""
+import sys
+import time
+
+from pugsql import context, parser
+
+STATEMENT = """-- :name user_%(i)d :many
+-- :doc Finds the users matching a pattern,
+-- :doc ordered by signup date.
+-- :cache ttl=30 tags=users
+select user_id, username, created_at
+  from users
+ where username like :pattern
+   and created_at > :since
+ order by created_at desc
+ limit 100
+"""
+
+
+def measure(fn, chunks):
+    start = time.perf_counter()
+    for i, chunk in enumerate(chunks):
+        fn(chunk, ctx=context.Context("bench.sql", line=i * 10))
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunks = [STATEMENT % {"i": i} for i in range(n)]
+
+    print("%d statements" % n)
+    for label, fn in [
+        ("statement_args", parser.statement_args),
+        ("parse", parser.parse),
+    ]:
+        elapsed = min(measure(fn, chunks) for _ in range(3))
+        print("%-16s %10.0f statements/s" % (label, n / elapsed))
+
+
+if __name__ == "__main__":
+    main()
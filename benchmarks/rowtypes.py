@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Compares the time and peak memory used to fetch a wide result set as dicts
+(`:many`) and as SQLAlchemy rows (`:many tuples`).
+
+    poetry run python benchmarks/rowtypes.py [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pugsql
+
+COLUMNS = 10
+
+SQL = """-- :name as_dicts :many
+select * from wide
+
+-- :name as_tuples :many tuples
+select * from wide
+"""
+
+
+def load(rows):
+    sqldir = tempfile.mkdtemp()
+    with open(os.path.join(sqldir, "wide.sql"), "w") as f:
+        f.write(SQL)
+
+    queries = pugsql.module(sqldir)
+    queries.connect("sqlite://")
+    with queries.engine.begin() as conn:
+        cols = ", ".join("c%d integer" % i for i in range(COLUMNS))
+        conn.exec_driver_sql("create table wide (%s)" % cols)
+        conn.exec_driver_sql(
+            "with recursive n(i) as (select 1 union all select i + 1 "
+            "from n where i < %d) insert into wide select %s from n"
+            % (rows, ", ".join(["i"] * COLUMNS))
+        )
+    return queries
+
+
+def measure(stmt):
+    start = time.perf_counter()
+    result = list(stmt())
+    elapsed = time.perf_counter() - start
+    del result
+
+    tracemalloc.start()
+    result = list(stmt())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    queries = load(rows)
+
+    print("%d rows x %d columns" % (rows, COLUMNS))
+    for stmt in [queries.as_dicts, queries.as_tuples]:
+        elapsed, peak = measure(stmt)
+        print(
+            "%-12s %8.2fs %10.1f MiB peak"
+            % (stmt.result.display_type, elapsed, peak / 2**20)
+        )
+
+
+if __name__ == "__main__":
+    main()
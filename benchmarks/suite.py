@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+Measures the overhead of calling statements compared to raw SQLAlchemy and
+raw sqlite3, the time it takes to load a module of synthetic SQL files, and
+the number of rows per second each result type returns.
+
+    poetry run python benchmarks/suite.py [--group GROUP] [--save [PATH]]
+                                          [--compare [PATH]]
+
+`--save` records the results as a baseline (`benchmarks/baseline.json` by
+default), and `--compare` prints how the results differ from a baseline,
+exiting with a nonzero status if any benchmark is slower than it by more
+than `--threshold`. Baselines are only comparable on the same machine, so
+record one before making a change, and compare against it after.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import timeit
+
+from sqlalchemy import create_engine, text
+
+import pugsql
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TESTS = os.path.join(os.path.dirname(HERE), "tests")
+FIXTURES_DB = os.path.join(TESTS, "data", "fixtures.sqlite3")
+FIXTURES_SQL = os.path.join(TESTS, "sql", "fixtures")
+BASELINE = os.path.join(HERE, "baseline.json")
+
+ROWS_SQL = """-- :name rows_raw
+select * from rows
+
+-- :name rows_many :many
+select * from rows
+
+-- :name rows_many_tuples :many tuples
+select * from rows
+
+-- :name rows_stream :stream
+select * from rows
+
+-- :name rows_stream_tuples :stream tuples
+select * from rows
+
+-- :name insert_scratch :insert
+insert into scratch (name) values (:name)
+"""
+
+SYNTHETIC_SQL = """-- :name q_%(file)d_%(i)d :many
+-- :doc Statement %(i)d in file %(file)d.
+select user_id, username
+  from users
+ where user_id > :min_id
+   and username like :pattern
+ order by user_id
+"""
+
+
+def call_overhead(args):
+    """
+    Calls that return one row from the fixture database, which is opened
+    read only.
+    """
+    url = "sqlite:///file:%s?mode=ro&uri=true" % FIXTURES_DB
+    queries = pugsql.module(FIXTURES_SQL)
+    queries.connect(url)
+
+    engine = create_engine(url)
+    clause = text("select * from users where user_id = :user_id")
+
+    def sqlalchemy_one():
+        with engine.connect() as conn:
+            row = conn.execute(clause, {"user_id": 1}).mappings().first()
+            return dict(row)
+
+    raw = sqlite3.connect("file:%s?mode=ro" % FIXTURES_DB, uri=True)
+
+    def sqlite3_one():
+        cur = raw.execute("select * from users where user_id = ?", (1,))
+        names = [d[0] for d in cur.description]
+        return dict(zip(names, cur.fetchone()))
+
+    yield "sqlite3 :one", sqlite3_one, 1
+    yield "sqlalchemy :one", sqlalchemy_one, 1
+    yield "pugsql :one", lambda: queries.user_for_id(user_id=1), 1
+    yield "pugsql :one tuple", lambda: queries.user_tuple_for_id(
+        user_id=1
+    ), 1
+    yield "pugsql :scalar", lambda: queries.username_for_id(user_id=1), 1
+    yield "pugsql :many in-list", lambda: queries.find_by_usernames(
+        usernames=("mcfunley", "oscar")
+    ), 1
+
+    memory = _rows_module(0)
+    yield "pugsql :insert (memory)", lambda: memory.insert_scratch(
+        name="x"
+    ), 1
+
+
+def module_load(args):
+    """
+    Loads a directory of synthetic SQL files, holding `--statements`
+    statements in files of 100 each.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    sqldir = os.path.join(tmp.name, "sql")
+    os.mkdir(sqldir)
+    files = max(1, args.statements // 100)
+    for f in range(files):
+        with open(os.path.join(sqldir, "q%d.sql" % f), "w") as out:
+            out.write(
+                "\n".join(
+                    SYNTHETIC_SQL % {"file": f, "i": i} for i in range(100)
+                )
+            )
+    n = files * 100
+
+    cache_dir = os.path.join(tmp.name, "cache")
+    pugsql.module(sqldir, cache_dir=cache_dir)
+
+    yield "eager", lambda: pugsql.module(sqldir), n
+    yield "lazy", lambda: pugsql.module(sqldir, lazy=True), n
+    yield "workers=4", lambda: pugsql.module(sqldir, workers=4), n
+    yield "cache_dir (warm)", lambda: pugsql.module(
+        sqldir, cache_dir=cache_dir
+    ), n
+    # keeps the directory alive until the benchmarks above have run.
+    tmp.cleanup()
+
+
+def result_types(args):
+    """
+    Fetches every row of an in-memory table with `--rows` rows.
+    """
+    n = args.rows
+    queries = _rows_module(n)
+    engine = queries.engine
+    clause = text("select * from rows")
+
+    def sqlalchemy_mappings():
+        with engine.connect() as conn:
+            return [dict(r) for r in conn.execute(clause).mappings()]
+
+    def sqlite3_dicts():
+        with engine.connect() as conn:
+            cur = conn.connection.dbapi_connection.cursor()
+            cur.execute("select * from rows")
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, r)) for r in cur.fetchall()]
+
+    yield "sqlite3 dicts", sqlite3_dicts, n
+    yield "sqlalchemy mappings", sqlalchemy_mappings, n
+    yield ":raw", lambda: queries.rows_raw().fetchall(), n
+    yield ":many", queries.rows_many, n
+    yield ":many tuples", queries.rows_many_tuples, n
+    yield ":stream", lambda: list(queries.rows_stream()), n
+    yield ":stream tuples", lambda: list(queries.rows_stream_tuples()), n
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        yield ":columns", queries.rows_many.columns, n
+
+
+GROUPS = [
+    ("call", "calls/s", call_overhead),
+    ("load", "statements/s", module_load),
+    ("rows", "rows/s", result_types),
+]
+
+
+def _rows_module(rows):
+    tmp = tempfile.TemporaryDirectory()
+    with open(os.path.join(tmp.name, "rows.sql"), "w") as f:
+        f.write(ROWS_SQL)
+    queries = pugsql.module(tmp.name)
+    tmp.cleanup()
+
+    queries.connect("sqlite://")
+    with queries.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "create table rows (id integer primary key, name text, "
+            "score real, created text)"
+        )
+        conn.exec_driver_sql(
+            "create table scratch (id integer primary key, name text)"
+        )
+        conn.exec_driver_sql(
+            "with recursive n(i) as (select 1 union all select i + 1 "
+            "from n where i < %d) insert into rows select i, 'name ' || i, "
+            "i / 7.0, '2020-01-01 00:00:00' from n" % rows
+        )
+    return queries
+
+
+def measure(fn, repeat):
+    """
+    Returns the best time for one call of `fn` out of `repeat` runs, each of
+    which calls it enough times to take at least 0.2 seconds.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(args):
+    results = {}
+    for group, unit, benchmarks in GROUPS:
+        if args.group and group not in args.group:
+            continue
+        print("%s (%s)" % (group, unit))
+        for name, fn, units in benchmarks(args):
+            rate = units / measure(fn, args.repeat)
+            results["%s: %s" % (group, name)] = rate
+            print("  %-28s %14.0f" % (name, rate))
+    return results
+
+
+def compare(results, path, threshold):
+    with open(path) as f:
+        baseline = json.load(f)["results"]
+
+    print("\ncompared to %s" % os.path.relpath(path))
+    slower = []
+    for key, rate in results.items():
+        if key not in baseline:
+            print("  %-34s %10s" % (key, "new"))
+            continue
+        change = rate / baseline[key] - 1
+        print("  %-34s %+9.1f%%" % (key, change * 100))
+        if change < -threshold:
+            slower.append(key)
+
+    if slower:
+        print(
+            "\n%d benchmark(s) slower than the baseline by more than %.0f%%."
+            % (len(slower), threshold * 100)
+        )
+    return not slower
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": {k: round(v) for k, v in results.items()},
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
+    print("\nsaved %s" % os.path.relpath(path))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument(
+        "--group",
+        action="append",
+        choices=[g for g, _, _ in GROUPS],
+        help="only run this group of benchmarks (may be repeated)",
+    )
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--statements", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--save", nargs="?", const=BASELINE, metavar="PATH")
+    p.add_argument("--compare", nargs="?", const=BASELINE, metavar="PATH")
+    p.add_argument("--threshold", type=float, default=0.2)
+    args = p.parse_args()
+
+    results = run(args)
+    ok = True
+    if args.compare:
+        ok = compare(results, args.compare, args.threshold)
+    if args.save:
+        save(results, args.save)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,12 +16,23 @@ from . import compiler
 __version__ = "0.3.7"
 
 
-def module(sqlpath, encoding=None) -> compiler.Module:
+def module(
+    sqlpath, encoding=None, cache_dir=None, lazy=False, workers=1
+) -> compiler.Module:
     """
     Compiles a set of SQL files in the directory specified by sqlpath, and
     returns a module. The module contains a function for each named query
     found in the files.
 
+    If `cache_dir` is given, parsed files are cached in that directory, so
+    later processes can skip parsing files that haven't changed.
+
+    If `lazy` is true, each query is parsed the first time it's used, rather
+    than when the module is created.
+
+    If `workers` is more than one, up to that many files are read and parsed
+    concurrently, which helps on slow filesystems.
+
         # create a module from sql files on disk
         queries = pugsql.module('path/to/sql/files')
 
@@ -29,10 +40,42 @@ def module(sqlpath, encoding=None) -> compiler.Module:
         queries.connect(connection_string)
         queries.update_username(user_id=42, username='mcfunley')
     """
-    return compiler.Module(sqlpath, encoding=encoding)
+    return compiler.Module(
+        sqlpath,
+        encoding=encoding,
+        cache_dir=cache_dir,
+        lazy=lazy,
+        workers=workers,
+    )
+
+
+def async_module(
+    sqlpath, encoding=None, cache_dir=None, lazy=False, workers=1
+) -> compiler.AsyncModule:
+    """
+    Compiles a set of SQL files in the directory specified by sqlpath, and
+    returns a module for use with asyncio. The module contains a coroutine
+    function for each named query found in the files. `cache_dir`, `lazy`,
+    and `workers` work as they do for `module`.
+
+        # create a module from sql files on disk
+        queries = pugsql.async_module('path/to/sql/files')
+
+        # connect to the database using an asyncio driver
+        queries.connect('postgresql+asyncpg://localhost/dbname')
+        await queries.update_username(user_id=42, username='mcfunley')
+    """
+    return compiler.AsyncModule(
+        sqlpath,
+        encoding=encoding,
+        cache_dir=cache_dir,
+        lazy=lazy,
+        workers=workers,
+    )
 
 
 __all__ = [
     "__version__",
+    "async_module",
     "module",
 ]
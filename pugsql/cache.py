@@ -0,0 +1,146 @@
+"""
+Caches used by `pugsql.statement.Statement` objects to avoid repeating work
+across calls.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+__pdoc__ = {}
+
+
+CacheInfo = namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "currsize"]
+)
+__pdoc__["CacheInfo"] = "Usage counters for a cache."
+__pdoc__["CacheInfo.hits"] = "The number of lookups that found an entry."
+__pdoc__["CacheInfo.misses"] = "The number of lookups that found nothing."
+__pdoc__["CacheInfo.evictions"] = (
+    "The number of entries discarded to stay within the size limit."
+)
+__pdoc__["CacheInfo.currsize"] = "The number of entries in the cache."
+
+CacheOptions = namedtuple("CacheOptions", ["ttl", "maxsize", "tags"])
+__pdoc__["CacheOptions"] = (
+    "How a statement's results are cached, as given by its `:cache` comment."
+)
+__pdoc__["CacheOptions.ttl"] = (
+    "The number of seconds results are kept, or `None` to keep them until "
+    "they are evicted or invalidated."
+)
+__pdoc__["CacheOptions.maxsize"] = (
+    "The number of distinct sets of parameters to keep results for."
+)
+__pdoc__["CacheOptions.tags"] = (
+    "A tuple of tags, which statements with `:invalidates` comments use to "
+    "clear the cache."
+)
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping holding at most `maxsize` entries, which discards
+    the least recently used entry when it is full. Lookups are counted, and
+    the counts are reported by `info`.
+
+    This implements the subset of the mapping interface that SQLAlchemy uses
+    for its `compiled_cache` execution option.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> CacheInfo:
+        """
+        Returns a `CacheInfo` with the current counters.
+        """
+        return CacheInfo(self.hits, self.misses, self.evictions, len(self))
+
+
+class TTLCache(LRUCache):
+    """
+    An `LRUCache` whose entries also expire `ttl` seconds after they are set.
+    If `ttl` is `None`, entries are kept until they are evicted or the cache
+    is cleared.
+
+    Values are stored with `add`, which takes the `generation` read before
+    the value was computed, and discards the value if the cache was cleared
+    in the meantime. This keeps results read before a write from being
+    cached after the write invalidated them.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl=None, timer=time.monotonic):
+        super(TTLCache, self).__init__(maxsize)
+        self.ttl = ttl
+        self.timer = timer
+        self.generation = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.timer():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        self.add(key, value, self.generation)
+
+    def add(self, key, value, generation: int):
+        """
+        Stores `value` under `key`, unless the cache has been cleared since
+        `generation` was read.
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = self.timer() + self.ttl
+        with self._lock:
+            if generation == self.generation:
+                self._store(key, (expires, value))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
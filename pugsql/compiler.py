@@ -2,22 +2,54 @@
 Code that processes SQL files and returns modules of database functions.
 """
 
+import logging
 import os
 import re
 import threading
-from contextlib import contextmanager, suppress
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import (
+    AsyncExitStack,
+    ExitStack,
+    asynccontextmanager,
+    contextmanager,
+    suppress,
+)
+from contextvars import ContextVar
+from functools import partial
 from glob import glob
-from typing import Optional
+from itertools import repeat
+from typing import Iterable, Optional
 
 from sqlalchemy import create_engine
-from sqlalchemy.exc import ResourceClosedError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import ArgumentError, ResourceClosedError
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, sessionmaker
 
-from . import context, parser
-from .exceptions import NoConnectionError
+from . import (
+    context,
+    events,
+    explain,
+    metrics,
+    parsecache,
+    parser,
+    pgprepare,
+    profiling,
+    replicas,
+    shards,
+    slowlog,
+    statement,
+)
+from .exceptions import InvalidArgumentError, NoConnectionError
 
 __pdoc__ = {}
 
+_name_comment = re.compile(r"^--+[ \t]*:name[ \t]+(\S+)", re.M)
+
 
 class Module(object):
     """
@@ -26,19 +58,59 @@ class Module(object):
 
     sqlpaths: set
     engine = None
+    replicas = None
+    shards = None
+    is_async = False
+    _cache_dir = None
+    _lazy = False
+    _workers = 1
+    _listeners = ()
+    _metrics = None
+    _slow_log = None
+    _plan_capture = None
+    _profiler = None
 
-    def __init__(self, sqlpath: str, encoding: Optional[str] = None):
+    def __init__(
+        self,
+        sqlpath: str,
+        encoding: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        lazy: bool = False,
+        workers: int = 1,
+    ):
         """
         Loads functions found in the *sql files specified by `sqlpath` into
         properties on this object. An `encoding` for the files can optionally
         be provided.
 
+        If a `cache_dir` is given, the parsed contents of each file are cached
+        there, and files that haven't changed are loaded from the cache
+        instead of being parsed again.
+
+        If `lazy` is true, the files are only scanned for the names of their
+        functions, and each function is parsed the first time it is used.
+        Errors in a function's PugSQL comments may then not be raised until
+        that time.
+
+        If `workers` is more than one, up to that many files are read and
+        parsed at once, on a thread pool. This helps when reading files is
+        slow, e.g. on a network filesystem.
+
         The named sql functions in files should be unique.
         """
         self.sqlpaths = set()
+        self._cache_dir = cache_dir
+        self._lazy = lazy
+        self._workers = workers
         self._statements = {}
+        self._names = []
+        self._pending = {}
+        self._load_lock = threading.Lock()
         self._sessionmaker = None
         self._locals = threading.local()
+        self._cache_tags = {}
+        self._prepare = False
+        self._prepared_forms = {}
 
         self.add_queries(sqlpath, encoding=encoding)
 
@@ -49,46 +121,148 @@ class Module(object):
 
         The named sql functions in files should be unique.
         """
+        sqlfiles = []
         for p in paths:
-            self._add_path(p, encoding=encoding)
-        self.sqlpaths |= set(paths)
+            if not os.path.isdir(p):
+                raise ValueError("Directory not found: %s" % p)
+            sqlfiles += sorted(glob(os.path.join(p, "*sql")))
 
-    def _add_path(self, sqlpath: str, encoding: Optional[str] = None):
-        if not os.path.isdir(sqlpath):
-            raise ValueError("Directory not found: %s" % sqlpath)
-
-        for sqlfile in sorted(glob(os.path.join(sqlpath, "*sql"))):
-            with open(sqlfile, "r", encoding=encoding) as f:
-                pugsql = f.read()
-
-            # handle multiple statements per file
-            statements = re.split(r"\n+(?=--+\s*:name)", pugsql)
-            statement_line = 0
-            for statement in statements:
-                s = parser.parse(statement, ctx=context.Context(sqlfile,
-                                 line=statement_line))
-                statement_line += len(statement.splitlines()) + 1
-
-                if hasattr(self, s.name):
-                    if s.name not in self._statements:
-                        raise ValueError(
-                            'Error loading %s - the function name "%s" is '
-                            "reserved. Please choose another name."
-                            % (sqlfile, s.name)
-                        )
-                    raise ValueError(
-                        "Error loading %s - a SQL function named %s was "
-                        "already defined in %s."
-                        % (sqlfile, s.name, self._statements[s.name].filename)
+        load = self._index_file if self._lazy else self._load_file
+        if self._workers <= 1 or len(sqlfiles) <= 1:
+            self._add_files(sqlfiles, map(load, sqlfiles, repeat(encoding)))
+        else:
+            # files are read and parsed concurrently, but added in order, so
+            # that errors are the same as when loading them one at a time.
+            workers = min(self._workers, len(sqlfiles))
+            with ThreadPoolExecutor(workers) as pool:
+                try:
+                    self._add_files(
+                        sqlfiles, pool.map(load, sqlfiles, repeat(encoding))
                     )
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+        self.sqlpaths |= set(paths)
+
+    def _add_files(self, sqlfiles: list, loaded: Iterable):
+        for sqlfile, entries in zip(sqlfiles, loaded):
+            if self._lazy:
+                for name, load in entries:
+                    self._add_name(sqlfile, name)
+                    self._pending[name] = (sqlfile, load)
+                continue
+
+            for args in entries:
+                s = statement.Statement(**args)
+                self._add_name(sqlfile, s.name)
+                self._add_statement(s)
+
+    def _add_name(self, sqlfile: str, name: str):
+        if name in self._pending:
+            defined_in = self._pending[name][0]
+        elif name in self._statements:
+            defined_in = self._statements[name].filename
+        elif hasattr(self, name):
+            raise ValueError(
+                'Error loading %s - the function name "%s" is '
+                "reserved. Please choose another name." % (sqlfile, name)
+            )
+        else:
+            self._names.append(name)
+            return
 
-                s.set_module(self)
+        raise ValueError(
+            "Error loading %s - a SQL function named %s was "
+            "already defined in %s." % (sqlfile, name, defined_in)
+        )
 
-                setattr(self, s.name, s)
-                self._statements[s.name] = s
+    def _add_statement(self, s: statement.Statement):
+        s.set_module(self)
+        if s.cache_options is not None:
+            for tag in s.cache_options.tags:
+                self._cache_tags.setdefault(tag, []).append(s)
+
+        setattr(self, s.name, s)
+        self._statements[s.name] = s
+
+    def _index_file(self, sqlfile: str, encoding: Optional[str]) -> list:
+        """
+        Returns a `(name, load)` pair for each statement in `sqlfile`, where
+        `load` is a function returning the statement's
+        `pugsql.statement.Statement` arguments. Statements are found by
+        scanning for `:name` comments, and aren't parsed until `load` is
+        called. With a parse cache, the file is loaded through the cache
+        instead, since that is cheaper than parsing.
+        """
+        if self._cache_dir is not None:
+            return [
+                (args["name"], partial(dict, args))
+                for args in self._load_file(sqlfile, encoding)
+            ]
+
+        with open(sqlfile, "r", encoding=encoding) as f:
+            pugsql = f.read()
+
+        index = []
+        for chunk, line in _split_file(pugsql):
+            ctx = context.Context(sqlfile, line=line)
+            m = _name_comment.search(chunk)
+            if m is None:
+                # parse it now, which raises the error for a missing name.
+                statement.Statement(**parser.statement_args(chunk, ctx=ctx))
+            index.append(
+                (m.group(1), partial(parser.statement_args, chunk, ctx=ctx))
+            )
+        return index
+
+    def __getattr__(self, name):
+        # only called when normal lookup fails, i.e. for functions that
+        # haven't been loaded yet.
+        pending = self.__dict__.get("_pending")
+        if not pending or name not in pending:
+            raise AttributeError(
+                "'%s' object has no attribute '%s'"
+                % (type(self).__name__, name)
+            )
+
+        with self._load_lock:
+            if name in self._statements:
+                return self._statements[name]
+
+            sqlfile, load = pending[name]
+            s = statement.Statement(**load())
+            if s.name != name:
+                raise ValueError(
+                    "Error loading %s - expected a SQL function named %s, "
+                    "but found %s." % (sqlfile, name, s.name)
+                )
+            self._add_statement(s)
+            del pending[name]
+            return s
+
+    def __dir__(self):
+        return list(super(Module, self).__dir__()) + list(self._pending)
+
+    def _load_file(self, sqlfile: str, encoding: Optional[str]) -> list:
+        """
+        Returns the `pugsql.statement.Statement` arguments for each statement
+        in `sqlfile`, using the parse cache if there is one.
+        """
+        with open(sqlfile, "r", encoding=encoding) as f:
+            pugsql = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime_ns
+
+        if self._cache_dir is None:
+            return _parse_file(sqlfile, pugsql)
+
+        args = parsecache.load(self._cache_dir, sqlfile, mtime, pugsql)
+        if args is None:
+            args = _parse_file(sqlfile, pugsql)
+            parsecache.store(self._cache_dir, sqlfile, mtime, pugsql, args)
+        return args
 
     @contextmanager
-    def transaction(self):
+    def transaction(self, shard=None):
         """
         Returns a session that manages a transaction scope, in which
         many statements can be run. Statements run on this module will
@@ -109,26 +283,47 @@ class Module(object):
         For engines that support SAVEPOINT, calling this method a second time
         begins a nested transaction.
 
+        If `shard` is given, the transaction runs on the shard holding that
+        shard key (see `connect_shards`), and statements on other shards
+        can't be run in it.
+
         For more info, see here:
         https://docs.sqlalchemy.org/en/13/orm/session_transaction.html
         """
         if not getattr(self._locals, "session", None):
-            if not self._sessionmaker:
+            pinned = getattr(self._locals, "connection", None)
+            if shard is not None:
+                index = self._shard_for_key(shard)
+                if pinned is not None:
+                    self._check_shard(pinned, index)
+                    self._locals.session = Session(bind=pinned)
+                else:
+                    self._locals.session = Session(
+                        bind=self.shards.engines[index]
+                    )
+            elif not self._sessionmaker:
                 raise NoConnectionError()
-
-            self._locals.session = self._sessionmaker()
+            elif pinned is not None:
+                self._locals.session = self._sessionmaker(bind=pinned)
+            else:
+                self._locals.session = self._sessionmaker()
 
             session = self._locals.session
-            try:
-                yield session
-                session.commit()
-            except Exception as e:
-                session.rollback()
-                raise e
-            finally:
-                session.close()
-                self._locals.session = None
+            with self._deferred_invalidation():
+                try:
+                    yield session
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    raise e
+                finally:
+                    session.close()
+                    self._locals.session = None
         else:
+            if shard is not None:
+                self._check_shard(
+                    self._locals.session, self._shard_for_key(shard)
+                )
             session = self._locals.session.begin_nested()
             try:
                 yield session
@@ -139,23 +334,478 @@ class Module(object):
                 with suppress(ResourceClosedError):
                     session.commit()
 
-    def _execute(self, clause, *multiparams, **params):
-        if getattr(self._locals, "session", None):
-            if multiparams:
-                return self._locals.session.execute(clause, *multiparams)
-            else:
-                return self._locals.session.execute(clause, params)
+    @contextmanager
+    def connection(self, autocommit: bool = False, shard=None):
+        """
+        Pins a single SQLAlchemy `Connection`, which statements run on this
+        module will use until the block exits. This avoids checking a
+        connection out of the pool and committing for every statement, without
+        the overhead of the session used by `transaction`:
+
+            with foo.connection():
+                x = foo.get_x(x_id=1234)
+                y = foo.get_y(y_id=5678)
+
+        By default the statements' work is committed once when the block
+        exits, and rolled back if an exception occurs. If `autocommit` is
+        true, the connection uses the `AUTOCOMMIT` isolation level, so each
+        statement takes effect immediately.
+
+        The connection is used by statements executed on the current thread
+        only. Calling this method inside a `connection` or `transaction`
+        block reuses the connection that block is using. Transactions begun
+        inside the block run on the pinned connection.
+
+        If `shard` is given, the connection is to the shard holding that shard
+        key, as with `transaction`.
+        """
+        index = None if shard is None else self._shard_for_key(shard)
+        session = getattr(self._locals, "session", None)
+        if session is not None:
+            if index is not None:
+                self._check_shard(session, index)
+            yield session.connection()
+            return
+
+        pinned = getattr(self._locals, "connection", None)
+        if pinned is not None:
+            if index is not None:
+                self._check_shard(pinned, index)
+            yield pinned
+            return
+
+        engine = self._engine_for(index)
+        with engine.connect() as conn, self._deferred_invalidation():
+            if autocommit:
+                conn.execution_options(isolation_level="AUTOCOMMIT")
+            self._locals.connection = conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            finally:
+                self._locals.connection = None
+
+    def add_listener(self, listener: events.Listener):
+        """
+        Registers a `pugsql.events.Listener`, whose `before_execute` and
+        `after_execute` methods are called around each execution of the
+        statements on this module:
+
+            class Timer(pugsql.events.Listener):
+                def after_execute(self, execution):
+                    print(execution.statement.name, execution.elapsed)
+
+            queries.add_listener(Timer())
+
+        Statements check for listeners once per call, so they cost almost
+        nothing when none are registered.
+        """
+        self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener: events.Listener):
+        """
+        Unregisters a listener added with `add_listener`.
+        """
+        self._listeners = tuple(
+            x for x in self._listeners if x is not listener
+        )
+
+    def enable_metrics(
+        self, buckets: tuple = metrics.DEFAULT_BUCKETS
+    ) -> metrics.Registry:
+        """
+        Starts recording metrics for each statement on this module: the
+        number of calls and errors, a histogram of their latency with the
+        given `buckets` (upper bounds in seconds), and the number of rows
+        read and affected. Returns the `pugsql.metrics.Registry` holding
+        them, which is a listener registered with `add_listener`.
+
+        Calling this again returns the same registry.
+        """
+        if self._metrics is None:
+            self._metrics = metrics.Registry(buckets)
+            self.add_listener(self._metrics)
+        return self._metrics
+
+    def stats(self) -> dict:
+        """
+        Returns a dict mapping the name of each statement that has run since
+        `enable_metrics` was called to a `pugsql.metrics.StatementStats`
+        snapshot of its counters. Returns an empty dict if metrics aren't
+        enabled.
+
+        `pugsql.metrics.prometheus` formats the result for Prometheus.
+        """
+        if self._metrics is None:
+            return {}
+        return self._metrics.stats()
+
+    def log_slow_queries(
+        self,
+        threshold: float = 1.0,
+        logger: Optional[logging.Logger] = None,
+        params: bool = False,
+    ) -> slowlog.SlowQueryLog:
+        """
+        Logs a warning for each statement on this module that takes at least
+        `threshold` seconds, to `logger` or else the `pugsql.slow` logger:
+
+            slow query find_users (sql/users.sql:12) took 2.104s (execute
+            2.087s, fetch 0.017s), 20 rows, params {ids=tuple[4812]}
+
+        Parameters are described by their types, and the lengths of IN lists,
+        unless `params` is true, in which case their values are logged.
+
+        Calling this again replaces the previous settings. Returns the
+        `pugsql.slowlog.SlowQueryLog` listener, which is registered with
+        `add_listener`.
+        """
+        if self._slow_log is not None:
+            self.remove_listener(self._slow_log)
+        self._slow_log = slowlog.SlowQueryLog(threshold, logger, params)
+        self.add_listener(self._slow_log)
+        return self._slow_log
+
+    def capture_plans(
+        self,
+        threshold: float = 1.0,
+        logger: Optional[logging.Logger] = None,
+        keep: int = 100,
+    ) -> explain.PlanCapture:
+        """
+        Explains each statement on this module after a call to it takes at
+        least `threshold` seconds, and logs its plan (see
+        `pugsql.statement.Statement.explain`) as a warning to `logger` or else
+        the `pugsql.plans` logger. The last `keep` plans are kept in the
+        returned `pugsql.explain.PlanCapture` listener's `captured` deque.
+
+        Explaining a statement is a round trip to the database, so the
+        threshold should be high enough that this is rare. On an
+        `AsyncModule`, plans are captured in a separate task, outside of any
+        transaction.
+
+        Calling this again replaces the previous settings.
+        """
+        if self._plan_capture is not None:
+            self.remove_listener(self._plan_capture)
+        self._plan_capture = explain.PlanCapture(threshold, logger, keep)
+        self.add_listener(self._plan_capture)
+        return self._plan_capture
+
+    def enable_profiling(
+        self, sample_rate: float = 0.01
+    ) -> profiling.Profiler:
+        """
+        Starts timing each phase (see `pugsql.profiling.PHASES`) of a random
+        sample of calls to the statements on this module, e.g. `0.01` of
+        them. Calls that aren't sampled cost almost nothing extra, so this
+        can be left on in production. Returns the
+        `pugsql.profiling.Profiler`, whose `report` method prints where the
+        time went:
+
+            profiler = queries.enable_profiling(sample_rate=0.01)
+            ...
+            profiler.report()
+
+        Calling this again changes the sample rate of the same profiler.
+        """
+        if self._profiler is None:
+            self._profiler = profiling.Profiler(sample_rate)
+        self._profiler.sample_rate = sample_rate
+        return self._profiler
+
+    def invalidate(self, *tags: str):
+        """
+        Discards the results cached by statements on this module whose
+        `:cache` comment lists any of `tags`. This is done automatically
+        when a statement with an `:invalidates` comment is run.
+
+        Inside a `transaction` or `connection` block, the results are
+        discarded again when the block exits, so that results read before
+        the block's work was committed aren't kept.
+        """
+        pending = self._pending_invalidations()
+        if pending is not None:
+            pending.update(tags)
+        for tag in tags:
+            for s in self._cache_tags.get(tag, ()):
+                s.cache_clear()
+
+    @contextmanager
+    def _deferred_invalidation(self):
+        if self._pending_invalidations() is not None:
+            yield
+            return
+
+        tags = set()
+        self._set_pending_invalidations(tags)
+        try:
+            yield
+        finally:
+            self._set_pending_invalidations(None)
+            self.invalidate(*tags)
+
+    def _pending_invalidations(self) -> Optional[set]:
+        return getattr(self._locals, "invalidated", None)
+
+    def _set_pending_invalidations(self, tags: Optional[set]):
+        self._locals.invalidated = tags
+
+    def _executor(self):
+        """
+        Returns the session of the current transaction or the pinned
+        connection, if either is active on this thread.
+        """
+        session = getattr(self._locals, "session", None)
+        if session is not None:
+            return session
+        return getattr(self._locals, "connection", None)
+
+    def _execute(
+        self,
+        clause,
+        multiparams,
+        params,
+        execution_options,
+        readonly=False,
+        replica=False,
+        shard=None,
+    ):
+        sample = profiling.current_sample()
+        executor = self._executor()
+        if executor is not None:
+            if shard is not None:
+                self._check_shard(executor, shard)
+            if sample is not None:
+                if isinstance(executor, Session):
+                    conn = executor.connection()
+                    sample.mark("checkout")
+                    profiling.watch(conn, sample)
+                else:
+                    profiling.watch(executor, sample)
+            return self._run(
+                executor, clause, multiparams, params, execution_options
+            )
+
+        args = (sample, clause, multiparams, params, execution_options)
+        if shard is not None:
+            engine = self.shards.engines[shard]
+            return self._execute_on(engine, readonly, *args)
 
         if not self.engine:
             raise NoConnectionError()
 
-        with self.engine.connect() as conn:
-            if multiparams:
-                result = conn.execute(clause, *multiparams)
-            else:
-                result = conn.execute(clause, params)
+        if replica and self.replicas is not None:
+            r = self.replicas.choose()
+            if r is not None:
+                try:
+                    with self.replicas.use(r):
+                        return self._execute_on(r.engine, readonly, *args)
+                except Exception as e:
+                    # reads are safe to retry, so the primary answers this
+                    # one while the replica is out of rotation.
+                    if not replicas.is_failure(e):
+                        raise
+        return self._execute_on(self.engine, readonly, *args)
+
+    def _execute_on(
+        self,
+        engine,
+        readonly,
+        sample,
+        clause,
+        multiparams,
+        params,
+        execution_options,
+    ):
+        with engine.connect() as conn:
+            if sample is not None:
+                sample.mark("checkout")
+                profiling.watch(conn, sample)
+            # statements that only read run in AUTOCOMMIT mode, so the driver
+            # doesn't send BEGIN and COMMIT around them.
+            autocommit = readonly and _autocommit(conn)
+            result = self._run(
+                conn, clause, multiparams, params, execution_options
+            )
+            if not autocommit:
+                conn.commit()
+        if sample is not None:
+            sample.mark("commit")
+        return result
+
+    def _run(self, executor, clause, multiparams, params, execution_options):
+        if self._prepare:
+            prepared = self._prepared_form(clause)
+            if prepared is not None:
+                if isinstance(executor, Session):
+                    executor = executor.connection()
+                if pgprepare.prepare(executor, prepared):
+                    clause = prepared.clause
+        return _run(executor, clause, multiparams, params, execution_options)
+
+    def _prepared_form(self, clause) -> Optional[pgprepare.Prepared]:
+        try:
+            return self._prepared_forms[clause]
+        except KeyError:
+            prepared = pgprepare.prepared_form(clause)
+            return self._prepared_forms.setdefault(clause, prepared)
+
+    @contextmanager
+    def _stream(
+        self, clause, params, execution_options, replica=False, shard=None
+    ):
+        """
+        Executes `clause` with a server-side cursor, fetching rows in batches
+        of the `yield_per` execution option. Outside of a transaction or
+        pinned connection, the connection stays checked out until the context
+        manager exits. If `replica` is true, the connection is to a replica,
+        if there are any healthy ones. A replica that can't be reached is
+        retried on the primary, but a stream that fails after it starts
+        isn't, since its rows may already have been used. If `shard` is
+        given, the connection is to that shard.
+        """
+        options = dict(execution_options, stream_results=True)
+
+        executor = self._executor()
+        if executor is not None:
+            if shard is not None:
+                self._check_shard(executor, shard)
+            result = executor.execute(
+                clause, params, execution_options=options
+            )
+            try:
+                yield result
+            finally:
+                result.close()
+            return
+
+        with ExitStack() as stack:
+            result = None
+            if shard is None and replica and self.replicas is not None:
+                result = self._replica_stream(stack, clause, params, options)
+            if result is None:
+                engine = self._engine_for(shard)
+                result = stack.enter_context(
+                    self._stream_on(engine, clause, params, options)
+                )
+            yield result
+
+    def _replica_stream(self, stack, clause, params, execution_options):
+        """
+        Starts streaming `clause` from a replica, and adds its context to
+        `stack`. Returns the result, or `None` if no replica is healthy or
+        the chosen one can't be reached.
+        """
+        r = self.replicas.choose()
+        if r is None:
+            return None
+        try:
+            with ExitStack() as attempt:
+                attempt.enter_context(self.replicas.use(r))
+                stream = self._stream_on(
+                    r.engine, clause, params, execution_options
+                )
+                result = attempt.enter_context(stream)
+                stack.push(attempt.pop_all())
+                return result
+        except Exception as e:
+            if not replicas.is_failure(e):
+                raise
+            return None
+
+    @contextmanager
+    def _stream_on(self, engine, clause, params, execution_options):
+        """
+        Executes `clause` on a new connection to `engine` with a server-side
+        cursor, regardless of any transaction or pinned connection.
+        """
+        options = dict(execution_options, stream_results=True)
+        with engine.connect() as conn:
+            result = conn.execute(clause, params, execution_options=options)
+            try:
+                yield result
+            finally:
+                result.close()
             conn.commit()
-            return result
+
+    def _engine_for(self, shard: Optional[int]):
+        """
+        Returns the engine of the shard with index `shard`, or the primary
+        engine if it's `None`.
+        """
+        if shard is not None:
+            return self.shards.engines[shard]
+        if not self.engine:
+            raise NoConnectionError()
+        return self.engine
+
+    def _shard_for_key(self, key) -> int:
+        if self.shards is None:
+            raise NoConnectionError()
+        return self.shards.index(key)
+
+    def _shard_index(self, s: statement.Statement, paramsets) -> Optional[int]:
+        """
+        Returns the index of the shard that `s` runs on with each of the
+        dicts in `paramsets`, or `None` if the module isn't sharded.
+        """
+        if self.shards is None:
+            return None
+        indexes = set()
+        for params in paramsets:
+            try:
+                key = params[s.shard_key]
+            except (KeyError, TypeError):
+                raise InvalidArgumentError(
+                    "%s must be called with its shard key, %s, as a keyword "
+                    "argument." % (s.name, s.shard_key)
+                )
+            indexes.add(self.shards.index(key))
+        if len(indexes) > 1:
+            raise InvalidArgumentError(
+                "%s was called with rows for more than one shard." % s.name
+            )
+        return indexes.pop()
+
+    def _check_shard(self, executor, index: int):
+        engine = self._executor_engine(executor)
+        if self.shards is None or engine is not self.shards.engines[index]:
+            raise ValueError(
+                "The current transaction or connection isn't on shard %d. "
+                "Pass the shard key to transaction() or connection()." % index
+            )
+
+    def _executor_engine(self, executor):
+        if isinstance(executor, Session):
+            return executor.get_bind().engine
+        return executor.engine
+
+    @contextmanager
+    def _dbapi_connection(self):
+        """
+        Yields the DBAPI connection that statements run on: the one used by
+        the current transaction or pinned connection, or a newly checked out
+        connection whose work is committed when the context manager exits.
+        """
+        session = getattr(self._locals, "session", None)
+        if session is not None:
+            yield session.connection().connection
+            return
+
+        pinned = getattr(self._locals, "connection", None)
+        if pinned is not None:
+            yield pinned.connection
+            return
+
+        if not self.engine:
+            raise NoConnectionError()
+
+        with self.engine.begin() as conn:
+            yield conn.connection
 
     @property
     def _dialect(self):
@@ -166,35 +816,578 @@ class Module(object):
             raise NoConnectionError()
         return self.engine.dialect
 
-    def connect(self, connstr, **kwargs):
+    def connect(
+        self,
+        connstr,
+        prepare: bool = False,
+        replicas: Iterable = (),
+        balance: str = "round_robin",
+        **kwargs,
+    ):
         """
         Sets the connection string for SQL functions on this module.
 
         See https://docs.sqlalchemy.org/en/13/core/engines.html for examples of
         legal connection strings for different databases.
+
+        `replicas` are connection strings for read replicas of the database,
+        which are created with the same `kwargs`. See `setengine` for those
+        and the `prepare` option.
         """
-        self.setengine(create_engine(connstr, **kwargs))
+        self.setengine(
+            create_engine(connstr, **kwargs),
+            prepare=prepare,
+            replicas=[create_engine(r, **kwargs) for r in replicas],
+            balance=balance,
+        )
 
-    def setengine(self, engine):
+    def setengine(
+        self,
+        engine,
+        prepare: bool = False,
+        replicas: Iterable = (),
+        balance: str = "round_robin",
+    ):
         """
         Sets the SQLAlchemy engine for SQL functions on this module. This can
         be used instead of the connect method, when more customization of the
         connection engine is desired.
 
+        If `prepare` is true, the engine must be for PostgreSQL. Statements
+        are then run as server-side prepared statements, which are prepared
+        once on each pooled connection, the first time they're run on it.
+        Streams, and calls with IN list parameters, aren't prepared.
+
+        `replicas` are engines for read replicas of the database. Statements
+        that only read, or that have a `:route replica` comment, are run on
+        them, unless they're in a `transaction` or `connection` block, which
+        always uses `engine`. `balance` is how replicas are chosen:
+        `"round_robin"`, or `"least_connections"`, which picks the one
+        running the fewest statements. A replica that can't be reached is
+        skipped for a while, and the primary runs reads when none are
+        available. See `pugsql.replicas.ReplicaSet`, which is the module's
+        `replicas` attribute.
+
         See also: https://docs.sqlalchemy.org/en/13/core/connections.html
         """
+        replicas = list(replicas)
+        if prepare:
+            for e in [engine] + replicas:
+                if e.dialect.name != "postgresql":
+                    raise ValueError(
+                        "prepare=True is only supported for PostgreSQL (the "
+                        "engine is for %s)." % e.dialect.name
+                    )
+        self._set_replicas(replicas, balance)
         self.engine = engine
         self._sessionmaker = sessionmaker(bind=engine)
+        self._prepare = prepare
+
+    def connect_shards(
+        self, connstrs: Iterable, shard_for=None, **kwargs
+    ):
+        """
+        Connects the statements on this module that have a `:shard` comment
+        to one database per shard, given by connection strings in shard
+        order. The engines are created with `kwargs`. See `setshards`.
+        """
+        self.setshards(
+            [create_engine(c, **kwargs) for c in connstrs], shard_for
+        )
+
+    def setshards(self, engines: Iterable, shard_for=None):
+        """
+        Sets the SQLAlchemy engines of the shards, in shard order, for
+        statements that have a `:shard` comment naming their shard key
+        parameter:
+
+            -- :name get_order :one
+            -- :shard customer_id
+            select * from orders where customer_id = :customer_id and id = :id
+
+        Each call to such a statement runs on the shard with index
+        `shard_for(key, len(engines))`, where `key` is the value of the shard
+        key parameter. If `shard_for` is `None`, `pugsql.shards.hash_key` is
+        used. Statements without a `:shard` comment run on the module's
+        engine, if it has one (see `connect`), and statements with one run
+        there too if the module has no shards.
+
+        Statements are parsed once, and share their compiled SQL across
+        shards. Transactions and pinned connections are on a single shard,
+        which is chosen by passing a shard key to `transaction` or
+        `connection`. The module's `shards` attribute is the
+        `pugsql.shards.ShardSet`.
+        """
+        self.shards = shards.ShardSet(list(engines), shard_for)
+
+    def _set_replicas(self, engines: list, balance: str):
+        if engines:
+            self.replicas = replicas.ReplicaSet(engines, balance)
+        else:
+            self.replicas = None
 
     def disconnect(self):
         """
         Disassociates the module from any connection it was previously given.
         """
         self.engine = None
+        self.replicas = None
+        self.shards = None
         self._sessionmaker = None
+        self._prepare = False
 
     def __iter__(self):
-        return iter(self._statements.values())
+        for name in list(self._pending):
+            getattr(self, name)
+        return iter([self._statements[name] for name in self._names])
+
+
+# the transactions, pinned connections, and deferred invalidations of each
+# AsyncModule in the current context. The dicts are copied when they're
+# changed, so tasks that inherit a context don't share changes.
+_sessions = ContextVar("pugsql_sessions", default={})
+_connections = ContextVar("pugsql_connections", default={})
+_invalidations = ContextVar("pugsql_invalidations", default={})
+
+
+def _get(var: ContextVar, module):
+    return var.get().get(module)
+
+
+def _set(var: ContextVar, module, value):
+    values = dict(var.get())
+    if value is None:
+        values.pop(module, None)
+    else:
+        values[module] = value
+    return var.set(values)
+
+
+class AsyncModule(Module):
+    """
+    Holds a set of SQL functions loaded from files, which are run on a
+    SQLAlchemy `AsyncEngine`. Calling a function returns an awaitable:
+
+        queries = pugsql.async_module('path/to/sql/files')
+        queries.connect('postgresql+asyncpg://localhost/dbname')
+        user = await queries.user_for_id(user_id=42)
+
+    The same SQL files can be loaded by both `Module` and `AsyncModule`.
+    """
+
+    is_async = True
+
+    def __init__(
+        self,
+        sqlpath: str,
+        encoding: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        lazy: bool = False,
+        workers: int = 1,
+    ):
+        """
+        Loads functions found in the *sql files specified by `sqlpath` into
+        properties on this object, like `Module`.
+        """
+        super(AsyncModule, self).__init__(
+            sqlpath,
+            encoding=encoding,
+            cache_dir=cache_dir,
+            lazy=lazy,
+            workers=workers,
+        )
+
+    @asynccontextmanager
+    async def transaction(self, shard=None):
+        """
+        Returns an `AsyncSession` that manages a transaction scope, in which
+        many statements can be run. Statements run on this module will
+        automatically use this transaction:
+
+            async with foo.transaction():
+                x = await foo.get_x(x_id=1234)
+                await foo.update_x(x_id=1234, x+1)
+
+        The transaction is active for statements executed in the current
+        asyncio task only. As with `Module.transaction`, it is committed when
+        the block exits, rolled back if an exception occurs, calling this
+        method again inside the block begins a nested transaction, and
+        `shard` chooses the shard it runs on.
+        """
+        session = _get(_sessions, self)
+        if session is None:
+            pinned = _get(_connections, self)
+            if shard is not None:
+                index = self._shard_for_key(shard)
+                if pinned is not None:
+                    self._check_shard(pinned, index)
+                    session = AsyncSession(bind=pinned)
+                else:
+                    session = AsyncSession(bind=self.shards.engines[index])
+            elif not self._sessionmaker:
+                raise NoConnectionError()
+            elif pinned is not None:
+                session = self._sessionmaker(bind=pinned)
+            else:
+                session = self._sessionmaker()
+            token = _set(_sessions, self, session)
+            with self._deferred_invalidation():
+                try:
+                    yield session
+                    await session.commit()
+                except Exception as e:
+                    await session.rollback()
+                    raise e
+                finally:
+                    await session.close()
+                    _sessions.reset(token)
+        else:
+            if shard is not None:
+                self._check_shard(session, self._shard_for_key(shard))
+            nested = await session.begin_nested()
+            try:
+                yield nested
+            except Exception as e:
+                await nested.rollback()
+                raise e
+            else:
+                if nested.is_active:
+                    await nested.commit()
+
+    @asynccontextmanager
+    async def connection(self, autocommit: bool = False, shard=None):
+        """
+        Pins a single SQLAlchemy `AsyncConnection`, which statements run on
+        this module will use until the block exits:
+
+            async with foo.connection():
+                x = await foo.get_x(x_id=1234)
+                y = await foo.get_y(y_id=5678)
+
+        This works like `Module.connection`, except that the connection is
+        used by statements executed in the current asyncio task only.
+        """
+        index = None if shard is None else self._shard_for_key(shard)
+        session = _get(_sessions, self)
+        if session is not None:
+            if index is not None:
+                self._check_shard(session, index)
+            yield await session.connection()
+            return
+
+        pinned = _get(_connections, self)
+        if pinned is not None:
+            if index is not None:
+                self._check_shard(pinned, index)
+            yield pinned
+            return
+
+        engine = self._engine_for(index)
+        async with engine.connect() as conn:
+            if autocommit:
+                await conn.execution_options(isolation_level="AUTOCOMMIT")
+            token = _set(_connections, self, conn)
+            with self._deferred_invalidation():
+                try:
+                    yield conn
+                    await conn.commit()
+                except Exception as e:
+                    await conn.rollback()
+                    raise e
+                finally:
+                    _connections.reset(token)
+
+    def _pending_invalidations(self) -> Optional[set]:
+        return _get(_invalidations, self)
+
+    def _set_pending_invalidations(self, tags: Optional[set]):
+        _set(_invalidations, self, tags)
+
+    def _detach(self):
+        # used by tasks started by a statement's call, which inherit its
+        # context, so they don't share its transaction or connection.
+        _set(_sessions, self, None)
+        _set(_connections, self, None)
+
+    def _executor_engine(self, executor):
+        if isinstance(executor, AsyncSession):
+            executor = executor.bind
+        if isinstance(executor, AsyncConnection):
+            return executor.engine
+        return executor
+
+    def _executor(self):
+        session = _get(_sessions, self)
+        if session is not None:
+            return session
+        return _get(_connections, self)
+
+    async def _execute(
+        self,
+        clause,
+        multiparams,
+        params,
+        execution_options,
+        readonly=False,
+        replica=False,
+        shard=None,
+    ):
+        sample = profiling.current_sample()
+        executor = self._executor()
+        if executor is not None:
+            if shard is not None:
+                self._check_shard(executor, shard)
+            if sample is not None:
+                if isinstance(executor, AsyncSession):
+                    conn = await executor.connection()
+                    sample.mark("checkout")
+                    profiling.watch(conn.sync_connection, sample)
+                else:
+                    profiling.watch(executor.sync_connection, sample)
+            return await _run(
+                executor, clause, multiparams, params, execution_options
+            )
+
+        args = (sample, clause, multiparams, params, execution_options)
+        if shard is not None:
+            return await self._execute_on(
+                self.shards.engines[shard], readonly, *args
+            )
+
+        if not self.engine:
+            raise NoConnectionError()
+
+        if replica and self.replicas is not None:
+            r = self.replicas.choose()
+            if r is not None:
+                try:
+                    with self.replicas.use(r):
+                        return await self._execute_on(
+                            r.engine, readonly, *args
+                        )
+                except Exception as e:
+                    if not replicas.is_failure(e):
+                        raise
+        return await self._execute_on(self.engine, readonly, *args)
+
+    async def _execute_on(
+        self,
+        engine,
+        readonly,
+        sample,
+        clause,
+        multiparams,
+        params,
+        execution_options,
+    ):
+        async with engine.connect() as conn:
+            if sample is not None:
+                sample.mark("checkout")
+                profiling.watch(conn.sync_connection, sample)
+            autocommit = readonly and await _autocommit_async(conn)
+            result = await _run(
+                conn, clause, multiparams, params, execution_options
+            )
+            if not autocommit:
+                await conn.commit()
+        if sample is not None:
+            sample.mark("commit")
+        return result
+
+    @asynccontextmanager
+    async def _stream(
+        self, clause, params, execution_options, replica=False, shard=None
+    ):
+        executor = self._executor()
+        if executor is not None:
+            if shard is not None:
+                self._check_shard(executor, shard)
+            result = await executor.stream(
+                clause, params, execution_options=execution_options
+            )
+            try:
+                yield result
+            finally:
+                await result.close()
+            return
+
+        async with AsyncExitStack() as stack:
+            result = None
+            if shard is None and replica and self.replicas is not None:
+                result = await self._replica_stream(
+                    stack, clause, params, execution_options
+                )
+            if result is None:
+                engine = self._engine_for(shard)
+                result = await stack.enter_async_context(
+                    self._stream_on(engine, clause, params, execution_options)
+                )
+            yield result
+
+    async def _replica_stream(self, stack, clause, params, execution_options):
+        r = self.replicas.choose()
+        if r is None:
+            return None
+        try:
+            async with AsyncExitStack() as attempt:
+                attempt.enter_context(self.replicas.use(r))
+                stream = self._stream_on(
+                    r.engine, clause, params, execution_options
+                )
+                result = await attempt.enter_async_context(stream)
+                stack.push_async_exit(attempt.pop_all())
+                return result
+        except Exception as e:
+            if not replicas.is_failure(e):
+                raise
+            return None
+
+    @asynccontextmanager
+    async def _stream_on(self, engine, clause, params, execution_options):
+        async with engine.connect() as conn:
+            result = await conn.stream(
+                clause, params, execution_options=execution_options
+            )
+            try:
+                yield result
+            finally:
+                await result.close()
+            await conn.commit()
+
+    def connect(
+        self,
+        connstr,
+        replicas: Iterable = (),
+        balance: str = "round_robin",
+        **kwargs,
+    ):
+        """
+        Sets the connection string for SQL functions on this module. The
+        connection string must name an asyncio driver, e.g.
+        `postgresql+asyncpg://...` or `sqlite+aiosqlite://...`.
+
+        `replicas` and `balance` work as they do for `Module.setengine`.
+
+        See https://docs.sqlalchemy.org/en/20/orm/extensions/asyncio.html for
+        the supported drivers.
+        """
+        self.setengine(
+            create_async_engine(connstr, **kwargs),
+            replicas=[create_async_engine(r, **kwargs) for r in replicas],
+            balance=balance,
+        )
+
+    def connect_shards(
+        self, connstrs: Iterable, shard_for=None, **kwargs
+    ):
+        """
+        Connects the statements on this module that have a `:shard` comment
+        to one database per shard, like `Module.connect_shards`. The
+        connection strings must name an asyncio driver.
+        """
+        self.setshards(
+            [create_async_engine(c, **kwargs) for c in connstrs], shard_for
+        )
+
+    def setengine(
+        self,
+        engine,
+        replicas: Iterable = (),
+        balance: str = "round_robin",
+    ):
+        """
+        Sets the SQLAlchemy `AsyncEngine` for SQL functions on this module.
+        This can be used instead of the connect method, when more
+        customization of the connection engine is desired.
+
+        `replicas` and `balance` work as they do for `Module.setengine`.
+        """
+        self._set_replicas(list(replicas), balance)
+        self.engine = engine
+        self._sessionmaker = async_sessionmaker(bind=engine)
+
+    async def dispose(self):
+        """
+        Closes all of the connections held in the pools of the engine and any
+        replicas or shards. Call this before the event loop that was used to
+        run queries is closed.
+        """
+        if self.engine:
+            await self.engine.dispose()
+        if self.replicas is not None:
+            for engine in self.replicas.engines():
+                await engine.dispose()
+        if self.shards is not None:
+            for engine in self.shards.engines:
+                await engine.dispose()
+
+
+def _parse_file(sqlfile: str, pugsql: str) -> list:
+    return [
+        parser.statement_args(chunk, ctx=context.Context(sqlfile, line=line))
+        for chunk, line in _split_file(pugsql)
+    ]
+
+
+def _split_file(pugsql: str) -> list:
+    # handle multiple statements per file
+    statements = re.split(r"\n+(?=--+\s*:name)", pugsql)
+    statement_line = 0
+    chunks = []
+    for s in statements:
+        chunks.append((s, statement_line))
+        statement_line += len(s.splitlines()) + 1
+    return chunks
+
+
+def _run(executor, clause, multiparams, params, execution_options):
+    if multiparams:
+        return executor.execute(
+            clause, *multiparams, execution_options=execution_options
+        )
+    return executor.execute(
+        clause, params, execution_options=execution_options
+    )
+
+
+def _autocommit(conn) -> bool:
+    """
+    Switches `conn` to the AUTOCOMMIT isolation level until it is returned to
+    the pool, if its driver can do that without sending any statements.
+    """
+    if not _autocommit_helps(conn):
+        return False
+    try:
+        conn.execution_options(isolation_level="AUTOCOMMIT")
+    except ArgumentError:
+        return False
+    return True
+
+
+async def _autocommit_async(conn) -> bool:
+    if not _autocommit_helps(conn):
+        return False
+    try:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+    except ArgumentError:
+        return False
+    return True
+
+
+# drivers that switch to AUTOCOMMIT, and back when the connection is returned
+# to the pool, by setting an attribute of the DBAPI connection. Others, such as
+# pg8000 and the MySQL drivers, send SET and COMMIT statements to change the
+# isolation level, which costs more than the COMMIT it saves, and the SQLite
+# drivers never begin a transaction for a read in the first place.
+_client_side_autocommit = frozenset(["psycopg2", "psycopg", "asyncpg"])
+
+
+def _autocommit_helps(conn) -> bool:
+    dialect = conn.dialect
+    return (
+        dialect.name == "postgresql"
+        and dialect.driver in _client_side_autocommit
+    )
 
 
 __pdoc__["Module.sqlpaths"] = (
@@ -203,3 +1396,14 @@ __pdoc__["Module.sqlpaths"] = (
 __pdoc__["Module.engine"] = (
     "The sqlalchemy engine object being used by the `pugsql.compiler.Module`."
 )
+__pdoc__["Module.replicas"] = (
+    "The `pugsql.replicas.ReplicaSet` of read replicas, or `None` if the "
+    "module has none."
+)
+__pdoc__["Module.shards"] = (
+    "The `pugsql.shards.ShardSet` of engines for statements with a `:shard` "
+    "comment, or `None` if the module isn't sharded."
+)
+__pdoc__["Module.is_async"] = (
+    "Whether the SQL functions on the module return awaitables."
+)
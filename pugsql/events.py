@@ -0,0 +1,164 @@
+"""
+Hooks for observing statements as they run. Objects registered with
+`pugsql.compiler.Module.add_listener` are told about each execution of the
+module's statements before and after it happens.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from .statement import Statement
+
+__pdoc__ = {}
+
+
+class Listener(object):
+    """
+    Base class for objects that observe statement executions. Subclasses
+    override either or both methods. They're called on the thread (or in the
+    task) running the statement, so they should be quick, and they must be
+    thread safe if the module is used from more than one thread.
+    """
+
+    def before_execute(self, execution: "Execution"):
+        """
+        Called before a statement is executed.
+        """
+
+    def after_execute(self, execution: "Execution"):
+        """
+        Called after a statement was executed and its results were read, or
+        after it raised an exception, which is then the execution's `error`.
+        """
+
+
+class Execution(object):
+    """
+    Describes one execution of a `pugsql.statement.Statement`: a call, a
+    stream, a call to `columns`, or one batch of a call to `bulk`.
+
+    Timings are in seconds, and don't include the time taken by listeners.
+    Results that were answered from a statement's `:cache` aren't executions,
+    and listeners aren't told about them.
+    """
+
+    __slots__ = (
+        "statement",
+        "multiparams",
+        "params",
+        "start",
+        "execute_time",
+        "elapsed",
+        "rows",
+        "rowcount",
+        "error",
+        "_listeners",
+    )
+
+    def __init__(
+        self,
+        listeners: tuple,
+        statement: "Statement",
+        multiparams: list,
+        params: dict,
+    ):
+        self.statement = statement
+        self.multiparams = multiparams
+        self.params = params
+        self.execute_time = None
+        self.elapsed = None
+        self.rows = None
+        self.rowcount = None
+        self.error = None
+        self._listeners = listeners
+
+        for listener in listeners:
+            listener.before_execute(self)
+        self.start = time.perf_counter()
+
+    @property
+    def fetch_time(self) -> Optional[float]:
+        """
+        The time spent reading and transforming the statement's results, or
+        `None` if the execution hasn't finished.
+        """
+        if self.elapsed is None or self.execute_time is None:
+            return None
+        return self.elapsed - self.execute_time
+
+    def executed(self, r=None):
+        """
+        Records that the statement was executed. If the SQLAlchemy result `r`
+        is given and doesn't return rows, its rowcount is recorded.
+        """
+        self.execute_time = time.perf_counter() - self.start
+        if r is not None and not r.returns_rows:
+            rowcount = r.rowcount
+            if rowcount is not None and rowcount >= 0:
+                self.rowcount = rowcount
+
+    def finish(self, error: Optional[BaseException] = None):
+        """
+        Records that the execution is over, and tells the listeners.
+        """
+        self.elapsed = time.perf_counter() - self.start
+        self.error = error
+        for listener in self._listeners:
+            listener.after_execute(self)
+
+
+@contextmanager
+def observe(listeners: tuple, statement, multiparams, params):
+    """
+    A context manager that yields an `Execution`, and finishes it when the
+    block exits, or yields `None` if there are no `listeners`. Exceptions
+    raised by the block are recorded as the execution's error, except for
+    `GeneratorExit`, which means a stream was closed before it was read to
+    the end.
+    """
+    if not listeners:
+        yield None
+        return
+
+    execution = Execution(listeners, statement, multiparams, params)
+    try:
+        yield execution
+    except GeneratorExit:
+        execution.finish()
+        raise
+    except BaseException as e:
+        execution.finish(e)
+        raise
+    execution.finish()
+
+
+__pdoc__["Execution.statement"] = (
+    "The `pugsql.statement.Statement` being executed."
+)
+__pdoc__["Execution.multiparams"] = (
+    "A list of dicts of parameters, when the statement is executed once for "
+    "each of them, or an empty list."
+)
+__pdoc__["Execution.params"] = "The dict of keyword parameters."
+__pdoc__["Execution.start"] = (
+    "The value of `time.perf_counter()` when the execution started."
+)
+__pdoc__["Execution.execute_time"] = (
+    "The time it took to execute the statement, not including reading its "
+    "results, or `None` if that didn't finish."
+)
+__pdoc__["Execution.elapsed"] = (
+    "The total time the execution took. This is `None` until "
+    "`pugsql.events.Listener.after_execute` is called."
+)
+__pdoc__["Execution.rows"] = (
+    "The number of rows read from the result, or `None` if that isn't known "
+    "(e.g. for `:raw` results, which the caller reads)."
+)
+__pdoc__["Execution.rowcount"] = (
+    "The number of rows the statement affected, or `None` for statements that "
+    "return rows, or if the driver doesn't report it."
+)
+__pdoc__["Execution.error"] = "The exception the execution raised, if any."
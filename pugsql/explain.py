@@ -0,0 +1,347 @@
+"""
+Query plans for statements, from the database's `EXPLAIN`, and helpers that
+capture them for slow calls and snapshot them so changes can be reviewed.
+"""
+
+import asyncio
+import difflib
+import json
+import logging
+import os
+import re
+from collections import deque, namedtuple
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Optional
+
+from sqlalchemy.engine import Connection
+
+from . import events, slowlog
+
+if TYPE_CHECKING:
+    from .compiler import Module
+
+__pdoc__ = {}
+
+_default_logger = logging.getLogger("pugsql.plans")
+
+# the EXPLAIN form for each dialect, which doesn't run the statement.
+_prefixes = {
+    "sqlite": "EXPLAIN QUERY PLAN",
+    "postgresql": "EXPLAIN (FORMAT JSON)",
+}
+
+_sqlite_scan = re.compile(r"^SCAN (?:TABLE )?(\S+)")
+
+
+def explain_sql(dialect: str, sql: str) -> str:
+    """
+    Returns SQL that explains `sql` using the `EXPLAIN` form of `dialect`
+    (the `name` of a SQLAlchemy dialect). Raises `NotImplementedError` for
+    dialects other than SQLite and PostgreSQL.
+    """
+    prefix = _prefixes.get(dialect)
+    if prefix is None:
+        raise NotImplementedError(
+            "EXPLAIN is not supported for %s databases." % dialect
+        )
+    return prefix + "\n" + sql
+
+
+class Plan(object):
+    """
+    The query plan of a statement, as reported by the database.
+    """
+
+    def __init__(self, dialect: str, raw):
+        self.dialect = dialect
+        """The name of the SQLAlchemy dialect that produced the plan."""
+        self.raw = raw
+        """
+        The plan as the database returned it: a list of dicts with `id`,
+        `parent`, and `detail` keys for SQLite, or the decoded JSON for
+        PostgreSQL.
+        """
+
+    def lines(self) -> list:
+        """
+        Returns a line for each step of the plan, indented to show its
+        structure, without the cost estimates and other numbers that change
+        with the data. These are stable enough to compare between runs.
+        """
+        if self.dialect == "sqlite":
+            return _sqlite_lines(self.raw)
+        return _postgres_lines(self.raw)
+
+    def scans(self) -> list:
+        """
+        Returns the names of the tables (or their aliases, with SQLite) that
+        the plan reads in full, rather than searching with an index. Scans of
+        subqueries and constant rows aren't included.
+        """
+        if self.dialect == "sqlite":
+            return [
+                m.group(1)
+                for m in (_sqlite_scan.match(r["detail"]) for r in self.raw)
+                if m and m.group(1) != "CONSTANT" and m.group(1)[0] != "("
+            ]
+        return [
+            node["Relation Name"]
+            for node, _ in _postgres_nodes(self.raw)
+            if node.get("Node Type") == "Seq Scan"
+        ]
+
+    def __str__(self):
+        return "\n".join(self.lines())
+
+    def __repr__(self):
+        return "<pugsql.explain.Plan (%s)>\n%s" % (self.dialect, self)
+
+
+def _sqlite_lines(rows) -> list:
+    depth = {0: -1}
+    lines = []
+    for row in rows:
+        d = depth.get(row["parent"], -1) + 1
+        depth[row["id"]] = d
+        lines.append("  " * d + row["detail"])
+    return lines
+
+
+def _postgres_nodes(raw, depth=0):
+    if isinstance(raw, list):
+        for item in raw:
+            yield from _postgres_nodes(item, depth)
+        return
+    node = raw.get("Plan", raw)
+    yield node, depth
+    for child in node.get("Plans", ()):
+        yield from _postgres_nodes(child, depth + 1)
+
+
+def _postgres_lines(raw) -> list:
+    lines = []
+    for node, depth in _postgres_nodes(raw):
+        line = node.get("Node Type", "?")
+        if "Index Name" in node:
+            line += " using " + node["Index Name"]
+        if "Relation Name" in node:
+            line += " on " + node["Relation Name"]
+            if node.get("Alias", node["Relation Name"]) != node[
+                "Relation Name"
+            ]:
+                line += " " + node["Alias"]
+        lines.append("  " * depth + line)
+    return lines
+
+
+def plan_from_rows(dialect: str, keys, rows) -> Plan:
+    """
+    Builds a `Plan` from the result of running `explain_sql`.
+    """
+    if dialect == "sqlite":
+        return Plan(dialect, [dict(zip(keys, row)) for row in rows])
+    raw = rows[0][0] if rows else []
+    if isinstance(raw, (str, bytes)):
+        raw = json.loads(raw)
+    return Plan(dialect, raw)
+
+
+CapturedPlan = namedtuple(
+    "CapturedPlan", ["statement", "params", "elapsed", "plan"]
+)
+__pdoc__["CapturedPlan"] = "The plan of a slow call to a statement."
+__pdoc__["CapturedPlan.statement"] = "The `pugsql.statement.Statement`."
+__pdoc__["CapturedPlan.params"] = "The parameters of the call."
+__pdoc__["CapturedPlan.elapsed"] = "The time the call took, in seconds."
+__pdoc__["CapturedPlan.plan"] = "The `Plan`."
+
+
+class PlanCapture(events.Listener):
+    """
+    A `pugsql.events.Listener` that explains statements after calls to them
+    take at least `threshold` seconds, logs their plans to `logger` (or else
+    the `pugsql.plans` logger), and keeps the last `keep` of them in
+    `captured`.
+
+    Plans are captured with the same parameters as the slow call. On a
+    synchronous module, they're captured on the same transaction or pinned
+    connection, if any, in a savepoint so that a failure doesn't affect the
+    transaction, and on an asynchronous one, in a separate task.
+    Calls that failed, and executions with many sets of parameters, aren't
+    explained. Errors explaining a statement are logged rather than raised.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        logger: Optional[logging.Logger] = None,
+        keep: int = 100,
+    ):
+        self.threshold = threshold
+        self.logger = logger or _default_logger
+        self.captured = deque(maxlen=keep)
+        """A `collections.deque` of the most recent `CapturedPlan`s."""
+        # the event loop only holds weak references to tasks, so the ones
+        # explaining plans are kept here until they finish.
+        self._tasks = set()
+
+    def after_execute(self, execution: events.Execution):
+        if (
+            execution.elapsed < self.threshold
+            or execution.error is not None
+            or execution.multiparams
+        ):
+            return
+
+        s = execution.statement
+        if s._module.is_async:
+            task = asyncio.get_running_loop().create_task(
+                _explain_detached(s, execution.params)
+            )
+            self._tasks.add(task)
+            task.add_done_callback(
+                lambda t: self._explained_async(execution, t)
+            )
+            return
+
+        try:
+            with _savepoint(s._module):
+                plan = s.explain(**execution.params)
+        except Exception:
+            self.logger.exception("couldn't explain %s", s.name)
+            return
+        self._explained(execution, plan)
+
+    def _explained_async(self, execution: events.Execution, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            self.logger.error(
+                "couldn't explain %s",
+                execution.statement.name,
+                exc_info=(type(e), e, e.__traceback__),
+            )
+            return
+        self._explained(execution, task.result())
+
+    def _explained(self, execution: events.Execution, plan: Plan):
+        s = execution.statement
+        captured = CapturedPlan(s, execution.params, execution.elapsed, plan)
+        self.captured.append(captured)
+        if self.logger.isEnabledFor(logging.WARNING):
+            location = ""
+            if s.filename:
+                location = " (%s:%s)" % (s.filename, s.line)
+            self.logger.warning(
+                "plan for %s%s, which took %.3fs with params %s:\n%s",
+                s.name,
+                location,
+                execution.elapsed,
+                {k: slowlog.shape(v) for k, v in execution.params.items()},
+                plan,
+                extra={"captured_plan": captured},
+            )
+
+
+def _savepoint(module: "Module"):
+    # on PostgreSQL, a failed EXPLAIN would abort the caller's transaction,
+    # so inside one the plan is explained in a savepoint.
+    executor = module._executor()
+    if executor is None:
+        return nullcontext()
+    if (
+        isinstance(executor, Connection)
+        and executor.get_execution_options().get("isolation_level")
+        == "AUTOCOMMIT"
+    ):
+        return nullcontext()
+    return executor.begin_nested()
+
+
+async def _explain_detached(s, params) -> Plan:
+    s._module._detach()
+    return await s.explain(**params)
+
+
+def snapshot(module: "Module", params: Optional[dict] = None) -> dict:
+    """
+    Explains every statement on the connected, synchronous `module`, and
+    returns a dict mapping each statement's name to its plan's `Plan.lines`.
+
+    `params` can map a statement's name to the parameters to explain it
+    with. Statements that aren't listed are explained with `None` for each
+    of their parameters, which doesn't work for IN list parameters, so those
+    statements should be listed. If a statement can't be explained, its
+    entry is the first line of the error, so that it shows up in a diff.
+    """
+    params = params or {}
+    result = {}
+    for s in module:
+        p = params.get(s.name)
+        if p is None:
+            p = {k: None for k in s._param_names()}
+        try:
+            result[s.name] = s.explain(**p).lines()
+        except Exception as e:
+            message = (str(e).splitlines() or [""])[0]
+            result[s.name] = ["error: %s: %s" % (type(e).__name__, message)]
+    return result
+
+
+def diff(old: dict, new: dict) -> list:
+    """
+    Compares two results of `snapshot`, and returns the differences as the
+    lines of a unified diff, which are empty if the plans are the same.
+    """
+    lines = []
+    for name in sorted(set(old) | set(new)):
+        if old.get(name) != new.get(name):
+            lines.extend(
+                difflib.unified_diff(
+                    old.get(name, []),
+                    new.get(name, []),
+                    "a/" + name,
+                    "b/" + name,
+                    lineterm="",
+                )
+            )
+    return lines
+
+
+def check(
+    module: "Module",
+    path: str,
+    params: Optional[dict] = None,
+    update: bool = False,
+) -> list:
+    """
+    Compares the plans of `module`'s statements (see `snapshot`) with the
+    snapshot saved as JSON at `path`, and returns the differences (see
+    `diff`). The snapshot is written if `update` is true, or if `path`
+    doesn't exist yet. This is meant to run in CI against a database with
+    representative data, so that plan changes such as new full table scans
+    are reviewed before they're deployed:
+
+        def test_plans():
+            differences = pugsql.explain.check(
+                queries,
+                'tests/plans.json',
+                update=os.getenv('UPDATE_PLANS') == '1',
+            )
+            assert not differences, '\\n'.join(differences)
+    """
+    new = snapshot(module, params)
+    old = {}
+    exists = os.path.exists(path)
+    if exists:
+        with open(path) as f:
+            old = json.load(f)
+
+    if update or not exists:
+        with open(path, "w") as f:
+            json.dump(new, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return []
+    return diff(old, new)
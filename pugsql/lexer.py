@@ -21,6 +21,64 @@ __pdoc__["Token.context"] = (
 )
 
 
+_comment_pattern = re.compile(
+    r"(?P<lead>--+\s*)"
+    r"(?P<keyword>\:[^ ]+)"
+    r"(?P<internalws>\s+)?"
+    r"(?P<rest>.*)?"
+)
+_name_pattern = re.compile(
+    r"(?P<name>[^ ]+)"
+    r"(?P<internalws>\s+)?"
+    r"(?P<keyword>\:[^ ]+)?"
+    r"(?P<internalws2>\s+)?"
+    r"(?P<rest>.+)?"
+)
+_result_pattern = re.compile(r"(?P<keyword>\:[^ ]+)" r"(?P<rest>.+)?")
+_line_breaks = re.compile("[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+_line_space = re.compile(r"[^\S\n]*\n[^\S\n]*")
+
+
+def scan(pugsql: str, ctx: context._Context) -> Tuple[list[Token], str]:
+    """
+    Splits the provided multiline PugSQL string into a Token for each line of
+    its leading block of comments and blank lines, and the SQL that follows
+    them. The lines of the SQL are stripped of surrounding whitespace, but
+    aren't otherwise tokenized.
+
+    The Tokens are the same as those `lex` returns for the same lines.
+    """
+    if _line_breaks.search(pugsql):
+        # normalize the other line boundaries that str.splitlines (and so
+        # `lex`) recognizes, so lines can be found by looking for "\n".
+        pugsql = "\n".join(pugsql.splitlines())
+
+    comments = []
+    sqlfile, line = ctx.sqlfile, ctx.line
+    pos, end = 0, len(pugsql)
+    while pos < end:
+        eol = pugsql.find("\n", pos)
+        if eol < 0:
+            eol = end
+        text = pugsql[pos:eol]
+        value = text.strip()
+        if value and not value.startswith("--"):
+            break
+        line += 1
+        col = 1 + len(text) - len(text.lstrip())
+        comments.append(
+            Token(
+                "C" if value else "Q",
+                value,
+                context._Context(sqlfile, line, col),
+            )
+        )
+        pos = eol + 1
+
+    sql = _line_space.sub("\n", pugsql[pos:]).strip()
+    return comments, sql
+
+
 def lex(pugsql: str, ctx: context._Context) -> list[Token]:
     """
     Splits the provided multiline PugSQL string into Tokens.
@@ -43,78 +101,57 @@ def _categorize(line, ctx) -> Token:
 
 
 def lex_comment(token: Token) -> Optional[Dict[str, Token]]:
-    m = re.match(
-        r"(?P<lead>--+\s*)"
-        r"(?P<keyword>\:[^ ]+)"
-        r"(?P<internalws>\s+)?"
-        r"(?P<rest>.*)?",
-        token.value,
-    )
+    m = _comment_pattern.match(token.value)
 
     if not m:
         return None
 
-    d = m.groupdict()
-    restbegin = sum(len(d[k] or "") for k in d.keys() if k != "rest")
-
+    ctx = token.context
     return {
-        "keyword": Token(
-            "K",
-            d["keyword"],
-            context.advance(token.context, cols=len(d["lead"])),
-        ),
-        "rest": Token(
-            "S", d["rest"], context.advance(token.context, cols=restbegin)
-        ),
+        "keyword": Token("K", m["keyword"], _at(ctx, m.start("keyword"))),
+        "rest": Token("S", m["rest"], _at(ctx, m.start("rest"))),
     }
 
 
 def lex_name(token: Token) -> Optional[Dict[str, Token]]:
     line, ctx = _whitespace_advance(token.value, token.context)
 
-    m = re.match(
-        r"(?P<name>[^ ]+)"
-        r"(?P<internalws>\s+)?"
-        r"(?P<keyword>\:[^ ]+)?"
-        r"(?P<internalws2>\s+)?"
-        r"(?P<rest>.+)?",
-        line,
-    )
+    m = _name_pattern.match(line)
 
     if not m:
         return None
 
-    d = m.groupdict()
-
-    kwbegin = len(d["name"]) + len(d["internalws"] or "")
-    kwctx = context.advance(ctx, cols=kwbegin)
-    restbegin = sum(len(d[k] or "") for k in d.keys() if k != "rest")
-    restctx = context.advance(ctx, cols=restbegin)
+    # the groups before rest are adjacent, so the furthest end of those that
+    # matched is where the next one begins.
+    kwbegin = max(m.end("name"), m.end("internalws"))
+    restbegin = max(kwbegin, m.end("keyword"), m.end("internalws2"))
     return {
-        "name": Token("N", d["name"], ctx),
-        "keyword": Token("K", d["keyword"], kwctx),
-        "rest": Token("S", d["rest"], restctx),
+        "name": Token("N", m["name"], ctx),
+        "keyword": Token("K", m["keyword"], _at(ctx, kwbegin)),
+        "rest": Token("S", m["rest"], _at(ctx, restbegin)),
     }
 
 
 def lex_result(token: Token) -> Optional[Dict[str, Token]]:
     line, ctx = _whitespace_advance(token.value, token.context)
-    m = re.match(r"(?P<keyword>\:[^ ]+)" r"(?P<rest>.+)?", line)
+    m = _result_pattern.match(line)
 
     if not m:
         return None
 
-    d = m.groupdict()
-    restctx = context.advance(ctx, cols=len(d["keyword"]))
-
     return {
-        "keyword": Token("K", d["keyword"], ctx),
-        "rest": Token("S", d["rest"], restctx),
+        "keyword": Token("K", m["keyword"], ctx),
+        "rest": Token("S", m["rest"], _at(ctx, m.end("keyword"))),
     }
 
 
+def _at(ctx: context._Context, cols: int) -> context._Context:
+    # the same as context.advance(ctx, cols=cols), without the overhead
+    return context._Context(ctx.sqlfile, ctx.line, ctx.col + cols)
+
+
 def _whitespace_advance(
     line: str, ctx: context._Context
 ) -> Tuple[str, context._Context]:
-    ctx = context.advance(ctx, cols=len(line) - len(line.lstrip()))
+    ctx = _at(ctx, len(line) - len(line.lstrip()))
     return line.strip(), ctx
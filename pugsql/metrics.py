@@ -0,0 +1,206 @@
+"""
+An in-process registry of per-statement metrics, which is enabled with
+`pugsql.compiler.Module.enable_metrics`, and a function that formats them for
+Prometheus.
+"""
+
+import math
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import accumulate
+
+from . import events
+
+__pdoc__ = {}
+
+
+StatementStats = namedtuple(
+    "StatementStats",
+    ["calls", "errors", "time", "histogram", "rows", "rowcount"],
+)
+__pdoc__["StatementStats"] = "Counters for the executions of one statement."
+__pdoc__["StatementStats.calls"] = "The number of executions."
+__pdoc__["StatementStats.errors"] = (
+    "The number of executions that raised an exception."
+)
+__pdoc__["StatementStats.time"] = (
+    "The total time taken by the executions, in seconds."
+)
+__pdoc__["StatementStats.histogram"] = (
+    "A tuple of `(le, count)` pairs, counting the executions that took at "
+    "most `le` seconds. The counts are cumulative, and the last `le` is "
+    "infinity, so its count is the number of executions."
+)
+__pdoc__["StatementStats.rows"] = "The number of rows read from results."
+__pdoc__["StatementStats.rowcount"] = (
+    "The number of rows affected by statements that don't return rows, as "
+    "reported by the driver."
+)
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+"""The default upper bounds, in seconds, of the latency histogram's buckets."""
+
+
+class Registry(events.Listener):
+    """
+    A `pugsql.events.Listener` that counts the executions of each statement by
+    name, along with their errors, latency, and rows.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        `buckets` are the upper bounds, in seconds, of the buckets of the
+        latency histogram.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def after_execute(self, execution: events.Execution):
+        name = execution.statement.name
+        bucket = bisect_left(self.buckets, execution.elapsed)
+        with self._lock:
+            s = self._stats.get(name)
+            if s is None:
+                s = self._stats[name] = _Counters(len(self.buckets) + 1)
+            s.calls += 1
+            if execution.error is not None:
+                s.errors += 1
+            s.time += execution.elapsed
+            s.histogram[bucket] += 1
+            if execution.rows is not None:
+                s.rows += execution.rows
+            if execution.rowcount is not None:
+                s.rowcount += execution.rowcount
+
+    def stats(self) -> dict:
+        """
+        Returns a dict mapping the name of each statement that has run to a
+        `StatementStats` holding its counters at the time of the call.
+        """
+        les = self.buckets + (math.inf,)
+        with self._lock:
+            return {
+                name: StatementStats(
+                    s.calls,
+                    s.errors,
+                    s.time,
+                    tuple(zip(les, accumulate(s.histogram))),
+                    s.rows,
+                    s.rowcount,
+                )
+                for name, s in self._stats.items()
+            }
+
+    def reset(self):
+        """
+        Sets all of the counters back to zero.
+        """
+        with self._lock:
+            self._stats = {}
+
+
+class _Counters(object):
+    __slots__ = ("calls", "errors", "time", "histogram", "rows", "rowcount")
+
+    def __init__(self, buckets: int):
+        self.calls = 0
+        self.errors = 0
+        self.time = 0.0
+        self.histogram = [0] * buckets
+        self.rows = 0
+        self.rowcount = 0
+
+
+def prometheus(stats: dict, prefix: str = "pugsql") -> str:
+    """
+    Formats the `stats` returned by `pugsql.compiler.Module.stats` in the
+    Prometheus text exposition format, with a `statement` label holding each
+    statement's name. Metric names begin with `prefix`. The result can be
+    served from an HTTP endpoint for Prometheus to scrape:
+
+        def metrics_view(request):
+            return Response(
+                pugsql.metrics.prometheus(queries.stats()),
+                content_type='text/plain; version=0.0.4',
+            )
+    """
+    lines = []
+
+    def family(name, kind, doc, samples):
+        name = prefix + "_" + name
+        lines.append("# HELP %s %s" % (name, doc))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for suffix, labels, value in samples:
+            lines.append(
+                "%s%s{%s} %s"
+                % (name, suffix, _labels(labels), _number(value))
+            )
+
+    names = sorted(stats)
+    for field, metric, doc in [
+        ("calls", "calls_total", "Statement executions."),
+        ("errors", "errors_total", "Statement executions that failed."),
+        ("rows", "rows_total", "Rows read from statement results."),
+        (
+            "rowcount",
+            "affected_rows_total",
+            "Rows affected by statements that don't return rows.",
+        ),
+    ]:
+        family(
+            metric,
+            "counter",
+            doc,
+            [("", {"statement": n}, getattr(stats[n], field)) for n in names],
+        )
+
+    samples = []
+    for n in names:
+        s = stats[n]
+        for le, count in s.histogram:
+            samples.append(
+                ("_bucket", {"statement": n, "le": _number(le)}, count)
+            )
+        samples.append(("_sum", {"statement": n}, s.time))
+        samples.append(("_count", {"statement": n}, s.calls))
+    family(
+        "duration_seconds",
+        "histogram",
+        "Time taken to execute statements and read their results.",
+        samples,
+    )
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(
+        '%s="%s"' % (k, _escape(str(v))) for k, v in labels.items()
+    )
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(value)
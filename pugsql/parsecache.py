@@ -0,0 +1,119 @@
+"""
+An on-disk cache of parsed SQL files, which lets modules skip parsing files
+that haven't changed since they were last loaded.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
+
+from . import cache, parser
+
+# increment this when the arguments produced by
+# `pugsql.parser.statement_args` change.
+_format = 3
+
+_result_keywords = {v: k for k, v in parser._results.items()}
+
+
+def load(
+    cache_dir: str, sqlfile: str, mtime: int, pugsql: str
+) -> Optional[list]:
+    """
+    Returns the list of `pugsql.statement.Statement` arguments cached for
+    `sqlfile`, or `None` if there are none or they're out of date. `mtime`
+    and `pugsql` are the file's modification time and contents, which must
+    match those the cached arguments were parsed from.
+
+    Unreadable or corrupt cache files are treated as missing. The files are
+    JSON, so loading them never runs code.
+    """
+    try:
+        with open(_cache_path(cache_dir, sqlfile), encoding="utf-8") as f:
+            entry = json.load(f)
+    except Exception:
+        return None
+
+    if (
+        not isinstance(entry, dict)
+        or entry.get("version") != _version()
+        or entry.get("sqlfile") != sqlfile
+        or entry.get("mtime") != mtime
+        or entry.get("hash") != _hash(pugsql)
+    ):
+        return None
+    try:
+        return [_decode(args) for args in entry["statements"]]
+    except Exception:
+        return None
+
+
+def store(
+    cache_dir: str, sqlfile: str, mtime: int, pugsql: str, statements: list
+):
+    """
+    Caches the list of `pugsql.statement.Statement` arguments parsed from
+    `sqlfile`, which had the modification time `mtime` and contents
+    `pugsql`. The cache file is replaced atomically, so concurrent processes
+    never read a partially written file. Errors writing it are ignored.
+    """
+    entry = {
+        "version": _version(),
+        "sqlfile": sqlfile,
+        "mtime": mtime,
+        "hash": _hash(pugsql),
+        "statements": [_encode(args) for args in statements],
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, _cache_path(cache_dir, sqlfile))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def _cache_path(cache_dir: str, sqlfile: str) -> str:
+    key = hashlib.sha1(os.path.abspath(sqlfile).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".json")
+
+
+def _encode(args: dict) -> dict:
+    # the result type is stored by its keyword, and the cache options as a
+    # list of their fields.
+    args = dict(args)
+    if "result" in args:
+        args["result"] = _result_keywords[args["result"]]
+    if args.get("cache_options") is not None:
+        args["cache_options"] = list(args["cache_options"])
+    return args
+
+
+def _decode(args: dict) -> dict:
+    args = dict(args)
+    if "result" in args:
+        args["result"] = parser._results[args["result"]]
+    options = args.get("cache_options")
+    if options is not None:
+        ttl, maxsize, tags = options
+        args["cache_options"] = cache.CacheOptions(ttl, maxsize, tuple(tags))
+    if "invalidates" in args:
+        args["invalidates"] = tuple(args["invalidates"])
+    return args
+
+
+def _hash(pugsql: str) -> str:
+    return hashlib.sha1(pugsql.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def _version() -> str:
+    from . import __version__
+
+    return "%s-%d" % (__version__, _format)
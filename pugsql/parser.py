@@ -5,19 +5,67 @@ Code that consumes PugSQL-dialect sql strings and returns validated
 
 import re
 import sys
-from itertools import takewhile
 from typing import Optional
 
-from . import context, lexer, statement
+from . import cache, context, lexer, statement
 from .exceptions import ParserError
 
 _one = statement.One()
 _many = statement.Many()
+_stream = statement.Stream()
+_columns = statement.Columns()
+_one_tuple = statement.OneTuple()
+_many_tuples = statement.ManyTuples()
+_stream_tuples = statement.StreamTuples()
 _affected = statement.Affected()
 _scalar = statement.Scalar()
 _insert = statement.Insert()
 _raw = statement.Raw()
 
+# the result types by the keywords that declare them, which is also how
+# `pugsql.parsecache` stores them.
+_results = {
+    ":one": _one,
+    ":many": _many,
+    ":stream": _stream,
+    ":columns": _columns,
+    ":one tuple": _one_tuple,
+    ":many tuples": _many_tuples,
+    ":stream tuples": _stream_tuples,
+    ":affected": _affected,
+    ":scalar": _scalar,
+    ":insert": _insert,
+    ":raw": _raw,
+}
+
+_cacheable_results = {
+    _one,
+    _many,
+    _one_tuple,
+    _many_tuples,
+    _scalar,
+}
+
+# string literals, quoted identifiers, and comments, which are skipped when
+# looking for keywords in the SQL.
+_sql_noise = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.S
+)
+_sql_word = re.compile(r"[a-z_][a-z0-9_$]*")
+_readonly_leading = {"select", "with", "values"}
+_writing_words = {"insert", "update", "delete", "merge", "into"}
+
+_routes = {"primary", "replica"}
+
+_default_cache_size = 128
+
+# statements begin with a comment naming the function, file, and line, which
+# Python 3.10 and later include in tracebacks.
+_header_comment = sys.version_info[:2] > (3, 9)
+_legal_name = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]+$")
+_tag_separator = re.compile(r"[\s,]+")
+_option = re.compile(r"\S+")
+
 
 def parse(
     pugsql: str, ctx: Optional[context._Context] = None
@@ -34,52 +82,70 @@ def parse(
     function, or `None`. If it is `None` a default context is created which
     will indicate that the SQL is being parsed from a literal string.
     """
-    ctx = ctx or context.Context("<literal>")
+    return statement.Statement(**statement_args(pugsql, ctx))
 
-    stream = lexer.lex(pugsql, ctx)
-    leading_comments = _leading_comments(stream)
-    rest = stream[len(leading_comments) :]
 
-    cpr = _parse_comments(leading_comments)
+def statement_args(
+    pugsql: str, ctx: Optional[context._Context] = None
+) -> dict:
+    """
+    Processes the SQL string given in `pugsql` like `parse`, but returns the
+    keyword arguments for the `pugsql.statement.Statement` constructor
+    instead of the statement itself.
+    """
+    ctx = ctx or context.Context("<literal>")
+
+    comments, body = lexer.scan(pugsql, ctx)
+    cpr = _parse_comments(comments)
 
     hdr = []
-    if sys.version_info[:2] > (3, 9):
+    if _header_comment:
         file_name = ctx.sqlfile
         if file_name != "<literal>":
             file_name = "\"" + file_name + "\""
         hdr = ["-- pugsql function %s in file %s at line %d" % (cpr["name"],
                file_name, ctx.line + 1)]
-    sql = "\n".join(hdr + cpr["unconsumed"] + [token.value for token in rest])
+    sql = "\n".join(hdr + cpr["unconsumed"] + [body])
 
-    return statement.Statement(
+    readonly = cpr["readonly"]
+    if readonly is None:
+        readonly = _is_readonly(body)
+    if cpr["cache"] is not None and not readonly:
+        raise ParserError(
+            "cannot cache a statement that writes (mark it :readonly if it "
+            "doesn't).",
+            cpr["cache_keyword"],
+        )
+
+    literal = ctx.sqlfile == "<literal>"
+    return dict(
         name=cpr["name"],
         sql=sql,
         doc=cpr["doc"],
         result=cpr["result"],
-        filename=ctx.sqlfile if ctx.sqlfile != "<literal>" else None,
+        filename=None if literal else ctx.sqlfile,
+        line=None if literal else ctx.line + 1,
+        readonly=readonly,
+        route=cpr["route"],
+        shard_key=cpr["shard"],
+        cache_options=cpr["cache"],
+        invalidates=cpr["invalidates"],
     )
 
 
-def _leading_comments(stream: list[lexer.Token]) -> list[lexer.Token]:
-    def is_comment(t: lexer.Token) -> bool:
-        # allow blank whitespace lines in the leading comment
-        return (
-            t.tag == "C"
-            or t.value == ""
-            or (re.match(r"^\s+$", t.value) is not None)
-        )
-
-    return list(takewhile(is_comment, stream))
-
-
 def _parse_comments(comments: list[lexer.Token]) -> dict:
     cpr = {
         "name": None,
         "result": _raw,
         "doc": None,
+        "readonly": None,
+        "route": None,
+        "shard": None,
+        "cache": None,
+        "cache_keyword": None,
+        "invalidates": (),
         "unconsumed": [],
     }
-
     for comment_token in comments:
         toks = lexer.lex_comment(comment_token)
 
@@ -91,9 +157,31 @@ def _parse_comments(comments: list[lexer.Token]) -> dict:
             _consume_result(cpr, toks["rest"])
         elif toks["keyword"].value == ":doc":
             _consume_doc(cpr, toks["rest"])
+        elif toks["keyword"].value == ":readonly":
+            _consume_flag(cpr, toks["keyword"], toks["rest"], "readonly", True)
+        elif toks["keyword"].value == ":writes":
+            _consume_flag(
+                cpr, toks["keyword"], toks["rest"], "readonly", False
+            )
+        elif toks["keyword"].value == ":shard":
+            _consume_shard(cpr, toks["rest"])
+        elif toks["keyword"].value == ":route":
+            _consume_route(cpr, toks["rest"])
+        elif toks["keyword"].value == ":cache":
+            cpr["cache_keyword"] = toks["keyword"]
+            _consume_cache(cpr, toks["rest"])
+        elif toks["keyword"].value == ":invalidates":
+            _consume_invalidates(cpr, toks["rest"])
         else:
             cpr["unconsumed"].append(comment_token.value)
 
+    cache_keyword = cpr["cache_keyword"]
+    if cache_keyword is not None and cpr["result"] not in _cacheable_results:
+        raise ParserError(
+            "cannot cache '%s' results" % cpr["result"].display_type,
+            cache_keyword,
+        )
+
     return cpr
 
 
@@ -124,13 +212,16 @@ def _consume_name(cpr: dict, rest: lexer.Token):
             )
         return
 
-    if tokens["rest"].value:
-        raise ParserError(
-            "encountered unexpected input after result type.", tokens["rest"]
-        )
-
     _set_result(cpr, tokens["keyword"])
 
+    if tokens["rest"].value:
+        if not _is_row_type(tokens["rest"]):
+            raise ParserError(
+                "encountered unexpected input after result type.",
+                tokens["rest"],
+            )
+        _set_tuples(cpr, tokens["keyword"])
+
 
 def _consume_doc(cpr: dict, rest: lexer.Token):
     if cpr["doc"] is not None:
@@ -139,14 +230,79 @@ def _consume_doc(cpr: dict, rest: lexer.Token):
         cpr["doc"] = rest.value.strip()
 
 
+def _consume_flag(
+    cpr: dict, ktok: lexer.Token, rest: lexer.Token, key: str, value
+):
+    if rest.value.strip():
+        raise ParserError(
+            "encountered unexpected input after %s." % ktok.value, rest
+        )
+    cpr[key] = value
+
+
+def _consume_route(cpr: dict, rest: lexer.Token):
+    route = rest.value.strip()
+    if route not in _routes:
+        raise ParserError("expected 'primary' or 'replica'.", rest)
+    cpr["route"] = route
+
+
+def _consume_shard(cpr: dict, rest: lexer.Token):
+    key = rest.value.strip()
+    if not _is_legal_name(key):
+        raise ParserError("expected the name of a parameter.", rest)
+    cpr["shard"] = key
+
+
+def _consume_cache(cpr: dict, rest: lexer.Token):
+    ttl, maxsize, tags = None, _default_cache_size, ()
+
+    for m in _option.finditer(rest.value):
+        otok = lexer.Token(
+            "S", m.group(), context.advance(rest.context, cols=m.start())
+        )
+        key, _, value = m.group().partition("=")
+        if not value:
+            raise ParserError("expected a cache option like 'ttl=30'.", otok)
+
+        if key == "ttl":
+            ttl = _cache_number(float, value, otok)
+        elif key == "size":
+            maxsize = _cache_number(int, value, otok)
+        elif key == "tags":
+            tags = tuple(t for t in value.split(",") if t)
+        else:
+            raise ParserError("unrecognized cache option '%s'" % key, otok)
+
+    cpr["cache"] = cache.CacheOptions(ttl, maxsize, tags)
+
+
+def _cache_number(convert, value: str, otok: lexer.Token):
+    try:
+        n = convert(value)
+    except ValueError:
+        n = 0
+    if n <= 0:
+        raise ParserError("expected a positive number for cache option.", otok)
+    return n
+
+
+def _consume_invalidates(cpr: dict, rest: lexer.Token):
+    tags = tuple(t for t in _tag_separator.split(rest.value) if t)
+    if not tags:
+        raise ParserError("expected a cache tag.", rest)
+    cpr["invalidates"] += tags
+
+
 def _set_result(cpr: dict, ktok: lexer.Token):
     tokens = lexer.lex_result(ktok)
     if not tokens:
         raise ParserError("expected keyword", ktok)
 
-    if tokens["rest"].value:
+    rest = tokens["rest"]
+    if rest.value and not _is_row_type(rest):
         raise ParserError(
-            "encountered unexpected input after result type", tokens["rest"]
+            "encountered unexpected input after result type", rest
         )
 
     keyword = tokens["keyword"].value
@@ -155,6 +311,10 @@ def _set_result(cpr: dict, ktok: lexer.Token):
         cpr["result"] = _one
     elif keyword == ":many" or keyword == ":*":
         cpr["result"] = _many
+    elif keyword == ":stream":
+        cpr["result"] = _stream
+    elif keyword == ":columns":
+        cpr["result"] = _columns
     elif keyword == ":affected" or keyword == ":n":
         cpr["result"] = _affected
     elif keyword == ":insert":
@@ -164,6 +324,41 @@ def _set_result(cpr: dict, ktok: lexer.Token):
     elif keyword != ":raw":
         raise ParserError("unrecognized keyword '%s'" % keyword, ktok)
 
+    if rest.value:
+        _set_tuples(cpr, tokens["keyword"])
+
+
+def _is_row_type(rest: lexer.Token) -> bool:
+    return rest.value.strip() in ("tuple", "tuples")
+
+
+def _set_tuples(cpr: dict, ktok: lexer.Token):
+    tuple_results = {
+        _one: _one_tuple,
+        _many: _many_tuples,
+        _stream: _stream_tuples,
+    }
+    if cpr["result"] not in tuple_results:
+        raise ParserError(
+            "result type '%s' cannot return tuples" % ktok.value.strip(), ktok
+        )
+    cpr["result"] = tuple_results[cpr["result"]]
+
+
+def _is_readonly(sql: str) -> bool:
+    """
+    Guesses whether `sql` only reads data: it must begin with SELECT, WITH,
+    or VALUES, and not mention INSERT, UPDATE, DELETE, MERGE, or INTO
+    anywhere outside of strings and comments. Statements that write by
+    calling functions can't be detected, and need a `-- :writes` comment.
+    """
+    words = _sql_word.findall(_sql_noise.sub(" ", sql.lower()))
+    return (
+        bool(words)
+        and words[0] in _readonly_leading
+        and _writing_words.isdisjoint(words)
+    )
+
 
 def _is_legal_name(value: str) -> bool:
-    return re.match(r"^[a-zA-Z_][a-zA-Z0-9_]+$", value) is not None
+    return _legal_name.match(value) is not None
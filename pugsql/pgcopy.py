@@ -0,0 +1,141 @@
+"""
+Functions that run PostgreSQL `COPY` statements using the COPY protocol
+support of the DBAPI driver (psycopg2, psycopg, or pg8000).
+"""
+
+import io
+from datetime import date, datetime, time
+from typing import Iterable, Iterator
+
+
+def copy_in(dbapi_connection, sql: str, rows) -> int:
+    """
+    Runs a `COPY ... FROM STDIN` statement on `dbapi_connection`, sending it
+    `rows`. These can be a readable file-like object holding data in the
+    format the statement expects, or an iterable of sequences of column
+    values, which are sent in COPY's default text format as they are read.
+
+    Returns the number of rows copied.
+    """
+    driver = _driver(dbapi_connection)
+    cursor = dbapi_connection.cursor()
+    try:
+        if driver == "psycopg2":
+            cursor.copy_expert(sql, _as_file(rows))
+        elif driver == "psycopg":
+            with cursor.copy(sql) as copy:
+                for data in _as_chunks(rows):
+                    copy.write(data)
+        else:
+            cursor.execute(sql, stream=_as_file(rows))
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def copy_out(dbapi_connection, sql: str, fp) -> int:
+    """
+    Runs a `COPY ... TO STDOUT` statement on `dbapi_connection`, writing the
+    data to the writable file-like object `fp`. Text is written to text
+    files, and bytes to binary files.
+
+    Returns the number of rows copied.
+    """
+    driver = _driver(dbapi_connection)
+    cursor = dbapi_connection.cursor()
+    try:
+        if driver == "psycopg2":
+            cursor.copy_expert(sql, fp)
+        elif driver == "psycopg":
+            encoding = cursor.connection.info.encoding
+            with cursor.copy(sql) as copy:
+                for data in copy:
+                    data = bytes(data)
+                    if isinstance(fp, io.TextIOBase):
+                        data = data.decode(encoding)
+                    fp.write(data)
+        else:
+            cursor.execute(sql, stream=fp)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def format_row(row) -> str:
+    """
+    Formats a sequence of column values as a line of COPY's default text
+    format.
+    """
+    return "\t".join(_format_value(v) for v in row) + "\n"
+
+
+def _driver(dbapi_connection) -> str:
+    conn = getattr(dbapi_connection, "driver_connection", dbapi_connection)
+    driver = type(conn).__module__.split(".")[0]
+    if driver not in ("psycopg2", "psycopg", "pg8000"):
+        raise NotImplementedError(
+            "COPY is not supported with the %s driver. Use psycopg2, "
+            "psycopg, or pg8000." % driver
+        )
+    return driver
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, (datetime, date, time)):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\t", "\\t")
+    )
+
+
+def _as_chunks(rows) -> Iterable:
+    if hasattr(rows, "read"):
+        return iter(lambda: rows.read(8192), rows.read(0))
+    return (format_row(row) for row in rows)
+
+
+def _as_file(rows):
+    if hasattr(rows, "read"):
+        return rows
+    return _LineReader(format_row(row) for row in rows)
+
+
+class _LineReader(io.TextIOBase):
+    """
+    A readable text file over an iterator of lines, which are consumed as
+    the file is read.
+    """
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        n = len(self._buffer)
+        while size is None or size < 0 or n < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            n += len(line)
+
+        data = "".join(chunks)
+        if size is None or size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
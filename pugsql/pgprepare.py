@@ -0,0 +1,94 @@
+"""
+Functions that run statements as PostgreSQL prepared statements, so that each
+one is parsed and planned once per connection instead of on every execution.
+"""
+
+import hashlib
+import re
+from collections import namedtuple
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+
+__pdoc__ = {}
+
+
+Prepared = namedtuple("Prepared", ["name", "sql", "clause"])
+__pdoc__["Prepared"] = "A statement in the form used to prepare and run it."
+__pdoc__["Prepared.name"] = "The name of the prepared statement."
+__pdoc__["Prepared.sql"] = "The statement's SQL, with `$n` placeholders."
+__pdoc__["Prepared.clause"] = (
+    "A SQLAlchemy text clause that runs the prepared statement with `EXECUTE`."
+)
+
+# the statements that PREPARE accepts, after any leading comments. Whitespace
+# is only matched outside of the repeated group, since nesting it there lets
+# the pattern backtrack exponentially on statements that don't match.
+_preparable = re.compile(
+    r"\s*(?:(?:--[^\n]*|/\*.*?\*/)\s*)*\(*\s*"
+    r"(?:select|insert|update|delete|merge|values|with)\b",
+    re.I | re.S,
+)
+
+_dialect = postgresql.dialect(paramstyle="numeric_dollar")
+_info_key = "pugsql_prepared"
+
+
+def prepared_form(clause) -> Optional[Prepared]:
+    """
+    Returns the `Prepared` form of the SQLAlchemy text clause `clause`, or
+    `None` if it can't be prepared. This is the case for clauses with
+    expanding (IN list) parameters, whose SQL changes with the number of
+    values, and for statements that PREPARE doesn't accept.
+    """
+    if any(b.expanding for b in clause._bindparams.values()):
+        return None
+
+    compiled = clause.compile(dialect=_dialect)
+    sql = compiled.string
+    if not _preparable.match(sql):
+        return None
+
+    name = "pugsql_" + hashlib.sha1(sql.encode("utf-8")).hexdigest()[:24]
+    args = ", ".join(":" + p for p in compiled.positiontup)
+    execute = "EXECUTE " + name
+    if args:
+        execute += "(" + args + ")"
+    return Prepared(name, sql, text(execute))
+
+
+def prepare(conn, prepared: Prepared) -> bool:
+    """
+    Prepares `prepared` on the SQLAlchemy `Connection` `conn`, unless that
+    was already done on the same DBAPI connection. Returns `False` if the
+    database couldn't prepare the statement, in which case it should be run
+    normally.
+
+    Prepared statements are tracked in the DBAPI connection's `info` dict,
+    which is emptied when the pool replaces the connection, so statements
+    are prepared again after a reconnect.
+    """
+    statements = conn.connection.info.setdefault(_info_key, {})
+    ok = statements.get(prepared.name)
+    if ok is None:
+        ok = statements[prepared.name] = _prepare(conn, prepared)
+    return ok
+
+
+def _prepare(conn, prepared: Prepared) -> bool:
+    sql = "PREPARE %s AS %s" % (prepared.name, prepared.sql)
+    options = {"no_parameters": True}
+    isolation_level = conn.get_execution_options().get("isolation_level")
+    try:
+        if isolation_level == "AUTOCOMMIT":
+            conn.exec_driver_sql(sql, execution_options=options)
+        else:
+            # a failed PREPARE would abort the transaction, so it's done in a
+            # savepoint.
+            with conn.begin_nested():
+                conn.exec_driver_sql(sql, execution_options=options)
+    except DBAPIError:
+        return False
+    return True
@@ -0,0 +1,217 @@
+"""
+Sampled profiling of where the time goes in calls to statements, enabled with
+`pugsql.compiler.Module.enable_profiling`.
+"""
+
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+__pdoc__ = {}
+
+
+PHASES = (
+    "convert_params",
+    "validate",
+    "checkout",
+    "compile",
+    "execute",
+    "commit",
+    "transform",
+)
+"""
+The phases of a call, in order:
+
+* `convert_params`: converting lists, sets, and `ArrayLiteral` parameters.
+* `validate`: checking the arguments, and looking for cached results.
+* `checkout`: checking a connection out of the engine's pool.
+* `compile`: compiling the SQL and processing the parameters in SQLAlchemy.
+* `execute`: executing the statement in the driver.
+* `commit`: committing, and returning the connection to the pool.
+* `transform`: reading the results and converting them to the statement's
+  result type.
+
+Phases that don't happen during a call, e.g. `checkout` and `commit` in a
+transaction, take no time, and the time spent between phases is added to the
+next phase that does happen.
+"""
+
+PhaseStats = namedtuple("PhaseStats", ["calls", "time", "phases"])
+__pdoc__["PhaseStats"] = "The time spent in the sampled calls to a statement."
+__pdoc__["PhaseStats.calls"] = "The number of sampled calls."
+__pdoc__["PhaseStats.time"] = "The total time of the sampled calls."
+__pdoc__["PhaseStats.phases"] = (
+    "A dict mapping each of `PHASES` to the total time spent in it."
+)
+
+_current = ContextVar("pugsql_profile_sample", default=None)
+
+
+class _Sample(object):
+    __slots__ = ("last", "phases")
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] += now - self.last
+        self.last = now
+
+
+class Profiler(object):
+    """
+    Times the phases (see `PHASES`) of a random sample of calls to
+    statements, and adds them up for each statement.
+    """
+
+    def __init__(self, sample_rate: float = 0.01):
+        """
+        `sample_rate` is the fraction of calls that are timed, e.g. `0.01`
+        to time 1% of them, or `1` to time all of them.
+        """
+        self.sample_rate = sample_rate
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def sample(self) -> Optional[_Sample]:
+        """
+        Returns an object to time a call with, if the call is sampled, or
+        `None`.
+        """
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return _Sample()
+        return None
+
+    def call(self, sample: _Sample, name: str, fn, *args):
+        """
+        Calls `fn` with `args`, timing the phases that happen in SQLAlchemy
+        as part of `sample`, and records the sample for the statement named
+        `name` when it returns.
+        """
+        token = _current.set(sample)
+        try:
+            value = fn(*args)
+        finally:
+            _current.reset(token)
+        self._record(name, sample)
+        return value
+
+    async def call_async(self, sample: _Sample, name: str, fn, *args):
+        """
+        Like `call`, for a coroutine function `fn`.
+        """
+        token = _current.set(sample)
+        try:
+            value = await fn(*args)
+        finally:
+            _current.reset(token)
+        self._record(name, sample)
+        return value
+
+    def _record(self, name: str, sample: _Sample):
+        sample.mark("transform")
+        with self._lock:
+            s = self._stats.get(name)
+            if s is None:
+                s = self._stats[name] = [0, dict.fromkeys(PHASES, 0.0)]
+            s[0] += 1
+            for phase, t in sample.phases.items():
+                s[1][phase] += t
+
+    def stats(self) -> dict:
+        """
+        Returns a dict mapping the name of each statement that has been
+        sampled to its `PhaseStats`.
+        """
+        with self._lock:
+            return {
+                name: PhaseStats(calls, sum(phases.values()), dict(phases))
+                for name, (calls, phases) in self._stats.items()
+            }
+
+    def reset(self):
+        """
+        Discards the timings recorded so far.
+        """
+        with self._lock:
+            self._stats = {}
+
+    def report(self, file=None):
+        """
+        Prints a table to `file` (by default, standard output) showing the
+        mean time of each statement's sampled calls, and the percentage of
+        it spent in each phase. The statements that took the most time in
+        total come first.
+        """
+        print(format_report(self.stats()), file=file or sys.stdout)
+
+
+def format_report(stats: dict) -> str:
+    """
+    Formats the result of `Profiler.stats` as the table printed by
+    `Profiler.report`.
+    """
+    width = max([len("statement")] + [len(name) for name in stats])
+    columns = ["calls", "mean ms"] + list(PHASES)
+    widths = [max(len(c), 7) for c in columns]
+
+    def row(cells):
+        return "  ".join(
+            [cells[0].ljust(width)]
+            + [c.rjust(w) for c, w in zip(cells[1:], widths)]
+        ).rstrip()
+
+    lines = [row(["statement"] + columns)]
+    for name, s in sorted(stats.items(), key=lambda item: -item[1].time):
+        cells = [name, str(s.calls), "%.3f" % (s.time / s.calls * 1000)]
+        for phase in PHASES:
+            pct = 100 * s.phases[phase] / s.time if s.time else 0
+            cells.append("%.1f%%" % pct)
+        lines.append(row(cells))
+    return "\n".join(lines)
+
+
+def current_sample() -> Optional[_Sample]:
+    """
+    Returns the sample timing the current call, if it's sampled.
+    """
+    return _current.get()
+
+
+def watch(conn, sample: _Sample):
+    """
+    Listens for the events of the SQLAlchemy `Connection` `conn` that mark
+    the end of the `compile` and `execute` phases of `sample`. The time this
+    takes isn't counted in any phase.
+
+    This is done for each connection used by a sampled call, rather than for
+    the engine, because listening for these events on an engine makes every
+    statement it runs noticeably slower.
+    """
+    for name, fn in _connection_events:
+        if not event.contains(conn, name, fn):
+            event.listen(conn, name, fn)
+    sample.last = time.perf_counter()
+
+
+def _mark(phase):
+    def listener(*args, **kwargs):
+        sample = _current.get()
+        if sample is not None:
+            sample.mark(phase)
+
+    return listener
+
+
+_connection_events = [
+    ("before_cursor_execute", _mark("compile")),
+    ("after_cursor_execute", _mark("execute")),
+]
@@ -0,0 +1,198 @@
+"""
+Read replicas, which `pugsql.compiler.Module.connect` and
+`pugsql.compiler.Module.setengine` accept alongside the primary engine.
+Statements that only read are run on a replica chosen by a `ReplicaSet`,
+outside of transactions and pinned connections.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import event, exc
+
+__pdoc__ = {}
+
+_logger = logging.getLogger("pugsql.replicas")
+
+ROUND_ROBIN = "round_robin"
+"""Send reads to each healthy replica in turn."""
+
+LEAST_CONNECTIONS = "least_connections"
+"""Send each read to the healthy replica running the fewest statements."""
+
+
+def is_failure(error: BaseException) -> bool:
+    """
+    Whether `error` means a replica can't be used: the connection to it was
+    lost or couldn't be made, so SQLAlchemy invalidated it. Other errors,
+    such as invalid SQL or a statement timeout, are raised without affecting
+    the replica's health.
+    """
+    if isinstance(error, exc.DisconnectionError):
+        return True
+    return isinstance(error, exc.DBAPIError) and error.connection_invalidated
+
+
+def _connect_failed(context):
+    # most dialects only count errors on an open connection as disconnects,
+    # but a replica that can't be connected to at all can't be used either.
+    if context.connection is None:
+        context.is_disconnect = True
+
+
+ReplicaHealth = namedtuple(
+    "ReplicaHealth", ["url", "healthy", "in_use", "failures", "retry_in"]
+)
+__pdoc__["ReplicaHealth"] = "The state of one replica in a `ReplicaSet`."
+__pdoc__["ReplicaHealth.url"] = (
+    "The replica's URL, with any password hidden."
+)
+__pdoc__["ReplicaHealth.healthy"] = (
+    "Whether reads are being sent to the replica."
+)
+__pdoc__["ReplicaHealth.in_use"] = (
+    "The number of statements running on the replica."
+)
+__pdoc__["ReplicaHealth.failures"] = (
+    "The number of consecutive times the replica failed."
+)
+__pdoc__["ReplicaHealth.retry_in"] = (
+    "The number of seconds until an unhealthy replica is tried again, or 0."
+)
+
+
+class Replica(object):
+    """
+    One replica in a `ReplicaSet`.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        """The SQLAlchemy engine for the replica."""
+        self.in_use = 0
+        """The number of statements running on the replica."""
+        self.failures = 0
+        """The number of consecutive times the replica failed."""
+        self.down_until = 0.0
+        """The `time.monotonic()` until which the replica gets no reads."""
+
+    def healthy(self, now: float) -> bool:
+        """
+        Whether the replica is in rotation at `time.monotonic()` `now`.
+        """
+        return self.down_until <= now
+
+
+class ReplicaSet(object):
+    """
+    Chooses which of a list of replica engines runs each read, using the
+    `balance` strategy (`ROUND_ROBIN` or `LEAST_CONNECTIONS`).
+
+    A replica that fails (see `is_failure`) is taken out of rotation for
+    `retry_after` seconds, after which it gets reads again. The read that
+    failed is retried on the primary, as are reads made while every replica
+    is out of rotation.
+    """
+
+    def __init__(
+        self,
+        engines: list,
+        balance: str = ROUND_ROBIN,
+        retry_after: float = 30.0,
+    ):
+        if balance not in (ROUND_ROBIN, LEAST_CONNECTIONS):
+            raise ValueError(
+                "balance must be '%s' or '%s' (got '%s')."
+                % (ROUND_ROBIN, LEAST_CONNECTIONS, balance)
+            )
+        self.replicas = [Replica(e) for e in engines]
+        """The list of `Replica` objects."""
+        for e in engines:
+            target = getattr(e, "sync_engine", e)
+            if not event.contains(target, "handle_error", _connect_failed):
+                event.listen(target, "handle_error", _connect_failed)
+        self.balance = balance
+        self.retry_after = retry_after
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self) -> Optional[Replica]:
+        """
+        Returns the replica that should run the next read, or `None` if none
+        of them are healthy.
+        """
+        now = time.monotonic()
+        healthy = [r for r in self.replicas if r.healthy(now)]
+        if not healthy:
+            return None
+        if self.balance == LEAST_CONNECTIONS:
+            return min(healthy, key=lambda r: r.in_use)
+        return healthy[next(self._next) % len(healthy)]
+
+    @contextmanager
+    def use(self, replica: Replica):
+        """
+        A context manager that counts `replica` as in use until the block
+        exits, and tracks its health from whether the block raises an error
+        for which `is_failure` is true.
+        """
+        with self._lock:
+            replica.in_use += 1
+        try:
+            yield replica
+        except Exception as e:
+            if is_failure(e):
+                self.failed(replica, e)
+            raise
+        else:
+            if replica.failures:
+                with self._lock:
+                    replica.failures = 0
+        finally:
+            with self._lock:
+                replica.in_use -= 1
+
+    def failed(self, replica: Replica, error: Optional[BaseException] = None):
+        """
+        Takes `replica` out of rotation for `retry_after` seconds.
+        """
+        with self._lock:
+            replica.failures += 1
+            replica.down_until = time.monotonic() + self.retry_after
+        _logger.warning(
+            "replica %s failed, retrying in %.0fs: %s",
+            _url(replica.engine),
+            self.retry_after,
+            error,
+        )
+
+    def health(self) -> list:
+        """
+        Returns a `ReplicaHealth` for each replica.
+        """
+        now = time.monotonic()
+        return [
+            ReplicaHealth(
+                _url(r.engine),
+                r.healthy(now),
+                r.in_use,
+                r.failures,
+                max(0.0, r.down_until - now),
+            )
+            for r in self.replicas
+        ]
+
+    def engines(self) -> list:
+        """
+        Returns the replicas' engines.
+        """
+        return [r.engine for r in self.replicas]
+
+
+def _url(engine) -> str:
+    return engine.url.render_as_string(hide_password=True)
@@ -0,0 +1,187 @@
+"""
+Runs a statement on many engines at once, for
+`pugsql.statement.Statement.scatter`.
+"""
+
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter, itemgetter
+from typing import Callable, Optional
+
+# the number of rows a worker hands to the caller at a time, and the number of
+# those chunks each engine can have waiting before its worker blocks.
+_chunk_size = 500
+_chunks_per_engine = 4
+
+# how often, in seconds, a blocked worker checks whether the caller has
+# stopped reading.
+_poll = 0.1
+
+
+class _Done(object):
+    __slots__ = ("error",)
+
+    def __init__(self, error: Optional[BaseException]):
+        self.error = error
+
+
+class Scatter(object):
+    """
+    The rows of a statement that is run on several engines at once. Iterating
+    over this runs the statement on each engine, on up to `workers` threads,
+    and yields the rows as they arrive, or merged in order if `order_by` was
+    given. It can be iterated over once.
+
+    An engine that fails doesn't stop the others. Its exception is recorded
+    in `errors`, and the rows it returned before failing are kept.
+    """
+
+    def __init__(
+        self,
+        engines,
+        fetch: Callable,
+        workers: int = 8,
+        order_by=None,
+        tuples: bool = False,
+    ):
+        if isinstance(engines, dict):
+            self._engines = list(engines.items())
+        else:
+            self._engines = list(enumerate(engines))
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        self._fetch = fetch
+        self._workers = workers
+        self._key = _sort_key(order_by, tuples)
+        self._started = False
+        self._stopped = threading.Event()
+
+        self.errors = {}
+        """
+        A dict mapping the label of each engine that failed to its exception.
+        Engines are labelled by their keys, if they were given as a dict, or
+        else by their indexes. This is complete once every row has been read.
+        """
+        self.counts = {}
+        """
+        A dict mapping the label of each engine that finished, including the
+        ones that failed, to the number of rows it returned.
+        """
+
+    def __iter__(self):
+        if self._started:
+            raise RuntimeError("A scatter can only be iterated over once.")
+        self._started = True
+        if not self._engines:
+            return iter(())
+        if self._key is None:
+            return self._unordered()
+        return self._ordered()
+
+    def _unordered(self):
+        q = queue.Queue(_chunks_per_engine * self._pool_size())
+        with self._pool() as pool:
+            for label, engine in self._engines:
+                pool.submit(self._work, label, engine, q)
+
+            remaining = len(self._engines)
+            while remaining:
+                label, item = q.get()
+                if isinstance(item, _Done):
+                    self._finished(label, item)
+                    remaining -= 1
+                else:
+                    yield from item
+
+    def _ordered(self):
+        # every engine's next row is needed to choose which one comes first,
+        # so the queues can't block engines that are still waiting for a
+        # worker.
+        bounded = self._workers >= len(self._engines)
+        queues = []
+        with self._pool() as pool:
+            for label, engine in self._engines:
+                q = queue.Queue(_chunks_per_engine if bounded else 0)
+                queues.append((label, q))
+                pool.submit(self._work, label, engine, q)
+            yield from heapq.merge(
+                *[self._drain(label, q) for label, q in queues], key=self._key
+            )
+
+    def _drain(self, label, q: queue.Queue):
+        while True:
+            _, item = q.get()
+            if isinstance(item, _Done):
+                self._finished(label, item)
+                return
+            yield from item
+
+    def _pool(self):
+        return _Pool(self._stopped, self._pool_size())
+
+    def _pool_size(self) -> int:
+        return min(self._workers, len(self._engines))
+
+    def _work(self, label, engine, q: queue.Queue):
+        error = None
+        count = 0
+        chunk = []
+        rows = self._fetch(engine)
+        try:
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == _chunk_size:
+                    if not self._put(q, (label, chunk)):
+                        return
+                    count += len(chunk)
+                    chunk = []
+        except Exception as e:
+            error = e
+        finally:
+            rows.close()
+
+        if chunk:
+            if not self._put(q, (label, chunk)):
+                return
+            count += len(chunk)
+        self.counts[label] = count
+        self._put(q, (label, _Done(error)))
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                q.put(item, timeout=_poll)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _finished(self, label, done: _Done):
+        if done.error is not None:
+            self.errors[label] = done.error
+
+
+class _Pool(ThreadPoolExecutor):
+    # tells the workers to stop when the caller stops reading, e.g. by
+    # breaking out of a loop over the rows.
+
+    def __init__(self, stopped: threading.Event, workers: int):
+        super(_Pool, self).__init__(
+            max_workers=workers, thread_name_prefix="pugsql-scatter"
+        )
+        self._stopped_event = stopped
+
+    def __exit__(self, *exc_info):
+        self._stopped_event.set()
+        self.shutdown(wait=True, cancel_futures=True)
+        return False
+
+
+def _sort_key(order_by, tuples: bool) -> Optional[Callable]:
+    if order_by is None or callable(order_by):
+        return order_by
+    if tuples:
+        return attrgetter(order_by)
+    return itemgetter(order_by)
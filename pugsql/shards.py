@@ -0,0 +1,62 @@
+"""
+Sharding, where a module's statements run on one of several databases,
+chosen by the value of a parameter named in the statement's `:shard`
+comment:
+
+    -- :name get_order :one
+    -- :shard customer_id
+    select * from orders where customer_id = :customer_id and id = :id
+
+The engines are given to `pugsql.compiler.Module.connect_shards` or
+`pugsql.compiler.Module.setshards`.
+"""
+
+import zlib
+from typing import Callable, Optional
+
+
+def hash_key(key, count: int) -> int:
+    """
+    The default shard function. Integers are assigned to shards by their
+    remainder, `key % count`, and other values by the CRC-32 of their string
+    form, so the same key maps to the same shard in every process.
+    """
+    if isinstance(key, int) and not isinstance(key, bool):
+        return key % count
+    return zlib.crc32(str(key).encode("utf-8")) % count
+
+
+class ShardSet(object):
+    """
+    A list of engines, one per shard, and the function that maps shard keys
+    to them.
+    """
+
+    def __init__(self, engines: list, shard_for: Optional[Callable] = None):
+        if not engines:
+            raise ValueError("At least one shard engine is required.")
+        self.engines = list(engines)
+        """The engines, in shard order."""
+        self.shard_for = shard_for or hash_key
+        """
+        The function called with a shard key and the number of shards, which
+        returns the index of the key's shard. Defaults to `hash_key`.
+        """
+
+    def index(self, key) -> int:
+        """
+        Returns the index of the shard holding `key`.
+        """
+        if key is None:
+            raise ValueError("The shard key can't be None.")
+        i = self.shard_for(key, len(self.engines))
+        if not isinstance(i, int) or not 0 <= i < len(self.engines):
+            raise ValueError(
+                "The shard function returned %r for key %r, which isn't the "
+                "index of one of the %d shards."
+                % (i, key, len(self.engines))
+            )
+        return i
+
+    def __len__(self):
+        return len(self.engines)
@@ -0,0 +1,104 @@
+"""
+A listener that logs statements that take longer than a threshold, which is
+enabled with `pugsql.compiler.Module.log_slow_queries`.
+"""
+
+import logging
+from typing import Optional
+
+from . import events
+
+_default_logger = logging.getLogger("pugsql.slow")
+
+
+class SlowQueryLog(events.Listener):
+    """
+    A `pugsql.events.Listener` that logs a warning for each execution that
+    takes at least `threshold` seconds, or fails after that long, to `logger`
+    or else the `pugsql.slow` logger.
+
+    The message names the statement and where it's defined, and splits its
+    time into executing the statement and reading its results. Parameters
+    are described by their *shapes*, e.g. `ids=tuple[5000]`, rather than
+    their values, unless `params` is true. The log record's `execution`
+    attribute is the `pugsql.events.Execution`, for handlers that want more
+    detail.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        logger: Optional[logging.Logger] = None,
+        params: bool = False,
+    ):
+        self.threshold = threshold
+        self.logger = logger or _default_logger
+        self.params = params
+
+    def after_execute(self, execution: events.Execution):
+        if execution.elapsed >= self.threshold and self.logger.isEnabledFor(
+            logging.WARNING
+        ):
+            self.logger.warning(
+                "%s", self.format(execution), extra={"execution": execution}
+            )
+
+    def format(self, execution: events.Execution) -> str:
+        """
+        Returns the message logged for `execution`.
+        """
+        s = execution.statement
+        parts = ["slow query %s" % s.name]
+        if s.filename:
+            location = s.filename
+            if s.line is not None:
+                location += ":%d" % s.line
+            parts.append(" (%s)" % location)
+        parts.append(" took %.3fs" % execution.elapsed)
+        if execution.execute_time is not None:
+            parts.append(
+                " (execute %.3fs, fetch %.3fs)"
+                % (execution.execute_time, execution.fetch_time)
+            )
+        if execution.error is not None:
+            error = type(execution.error).__name__
+            parts.append(" and failed with %s" % error)
+        if execution.rows is not None:
+            parts.append(", %d rows" % execution.rows)
+        if execution.rowcount is not None:
+            parts.append(", %d rows affected" % execution.rowcount)
+
+        describe = repr if self.params else shape
+        if execution.multiparams:
+            parts.append(
+                ", %d sets of params like %s"
+                % (
+                    len(execution.multiparams),
+                    _describe(execution.multiparams[0], describe),
+                )
+            )
+        else:
+            parts.append(", params %s" % _describe(execution.params, describe))
+        return "".join(parts)
+
+
+def shape(value) -> str:
+    """
+    Describes a parameter value without revealing it: the name of its type,
+    and for sequences, their length, e.g. `tuple[3]`.
+    """
+    if value is None:
+        return "None"
+    name = type(value).__name__
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return "%s[%d]" % (name, len(value))
+    return name
+
+
+def _describe(params, describe) -> str:
+    if not isinstance(params, dict):
+        # positional values for a multi-row insert
+        return "(%s)" % ", ".join(describe(v) for v in params)
+    return "{%s}" % ", ".join(
+        "%s=%s" % (k, describe(params[k])) for k in sorted(params)
+    )
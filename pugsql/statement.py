@@ -2,17 +2,15 @@
 Compiled SQL function objects.
 """
 
-import threading
-from contextlib import contextmanager
+from collections import namedtuple
+from itertools import islice
 from typing import TYPE_CHECKING, Optional
 
 import sqlalchemy
-from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.sql.expression import BindParameter
+from sqlalchemy.sql.expression import bindparam
 
-from .exceptions import InvalidArgumentError
-
-_locals = threading.local()
+from . import cache, events, explain, pgcopy, scatter
+from .exceptions import InvalidArgumentError, NoConnectionError
 
 if TYPE_CHECKING:
     from .compiler import Module
@@ -23,37 +21,19 @@ class ArrayLiteral(object):
         self.array = list(array)
 
 
-@contextmanager
-def _compile_context(multiparams, params):
-    _locals.compile_context = {
-        "multiparams": multiparams,
-        "params": params,
-    }
-    try:
-        yield
-    finally:
-        _locals.compile_context = None
-
-
-@compiles(BindParameter)
-def _visit_bindparam(element, compiler, **kw):
-    cc = getattr(_locals, "compile_context", None)
-    if cc:
-        if _is_expanding_param(element, cc):
-            element.expanding = True
-    return compiler.visit_bindparam(element)
-
-
-def _is_expanding_param(element, cc):
-    if element.key not in cc["params"]:
-        return False
-    return isinstance(cc["params"][element.key], tuple)
-
-
 class Result(object):
+    tuples = False
+
     def transform(self, r):
         raise NotImplementedError()
 
+    def transform_counted(self, r):
+        """
+        Returns the result of `transform`, and the number of rows read from
+        `r`, or `None` if that isn't known.
+        """
+        return self.transform(r), None
+
     @property
     def display_type(self) -> str:
         raise NotImplementedError()
@@ -66,6 +46,10 @@ class One(Result):
             return {k: v for k, v in zip(r.keys(), row)}
         return None
 
+    def transform_counted(self, r):
+        value = self.transform(r)
+        return value, 0 if value is None else 1
+
     @property
     def display_type(self) -> str:
         return "row"
@@ -73,14 +57,181 @@ class One(Result):
 
 class Many(Result):
     def transform(self, r):
-        ks = r.keys()
-        return ({k: v for k, v in zip(ks, row)} for row in r.fetchall())
+        return self._rows(r.keys(), r.fetchall())
+
+    def transform_counted(self, r):
+        rows = r.fetchall()
+        return self._rows(r.keys(), rows), len(rows)
+
+    def _rows(self, ks, rows):
+        return ({k: v for k, v in zip(ks, row)} for row in rows)
 
     @property
     def display_type(self) -> str:
         return "rows"
 
 
+class Stream(Result):
+    """
+    Yields rows as dicts while they are read from the cursor, instead of
+    fetching the entire result set up front.
+    """
+
+    yield_per = 1000
+
+    def transform(self, r):
+        ks = r.keys()
+        return ({k: v for k, v in zip(ks, row)} for row in r)
+
+    @property
+    def display_type(self) -> str:
+        return "stream"
+
+
+class OneTuple(One):
+    """
+    Returns the first row as a SQLAlchemy `Row`, a named tuple that shares
+    its column metadata with the rest of the result rather than copying the
+    column names into a dict.
+    """
+
+    tuples = True
+
+    def transform(self, r):
+        return r.first()
+
+    @property
+    def display_type(self) -> str:
+        return "tuple"
+
+
+class ManyTuples(Many):
+    """
+    Returns the rows as SQLAlchemy `Row` objects, which are named tuples that
+    share their column metadata rather than each holding a dict.
+    """
+
+    tuples = True
+
+    def _rows(self, ks, rows):
+        return iter(rows)
+
+    @property
+    def display_type(self) -> str:
+        return "tuples"
+
+
+class StreamTuples(Stream):
+    """
+    Yields SQLAlchemy `Row` objects while they are read from the cursor.
+    """
+
+    tuples = True
+
+    def transform(self, r):
+        return iter(r)
+
+    @property
+    def display_type(self) -> str:
+        return "tuple stream"
+
+
+class Columns(Result):
+    """
+    Returns a dict mapping each column name to a NumPy array of the column's
+    values. Numeric and boolean columns get a numeric dtype, and any other
+    column is an array of Python objects. Requires numpy.
+    """
+
+    chunk_size = 10000
+
+    def transform(self, r):
+        builder = _ColumnBuilder(r.keys(), self.chunk_size)
+        while True:
+            rows = r.fetchmany(self.chunk_size)
+            if not rows:
+                return builder.finish()
+            builder.append(rows)
+
+    def transform_counted(self, r):
+        value = self.transform(r)
+        return value, len(next(iter(value.values()), ()))
+
+    @property
+    def display_type(self) -> str:
+        return "columns"
+
+
+class _ColumnBuilder(object):
+    """
+    Copies chunks of rows into growing per-column arrays, promoting a
+    column's dtype when a later chunk doesn't fit it.
+    """
+
+    def __init__(self, keys, capacity):
+        self.np = _numpy()
+        self.keys = list(keys)
+        self.capacity = capacity
+        self.size = 0
+        self.arrays = None
+
+    def append(self, rows):
+        np = self.np
+        n = self.size + len(rows)
+        if self.arrays is None:
+            self.capacity = max(self.capacity, n)
+        elif n > self.capacity:
+            self.capacity = max(self.capacity * 2, n)
+            for a in self.arrays:
+                a.resize(self.capacity, refcheck=False)
+
+        chunks = [self._chunk(values) for values in zip(*rows)]
+        if self.arrays is None:
+            self.arrays = [np.empty(self.capacity, c.dtype) for c in chunks]
+
+        for i, chunk in enumerate(chunks):
+            a = self.arrays[i]
+            if chunk.dtype != a.dtype:
+                dtype = np.promote_types(a.dtype, chunk.dtype)
+                if dtype.kind not in "biuf":
+                    dtype = np.dtype(object)
+                if dtype != a.dtype:
+                    a = self.arrays[i] = a.astype(dtype)
+            a[self.size:n] = chunk
+        self.size = n
+
+    def finish(self):
+        np = self.np
+        if self.arrays is None:
+            return {k: np.empty(0, dtype=object) for k in self.keys}
+        for a in self.arrays:
+            a.resize(self.size, refcheck=False)
+        return dict(zip(self.keys, self.arrays))
+
+    def _chunk(self, values):
+        np = self.np
+        try:
+            chunk = np.asarray(values)
+        except ValueError:
+            chunk = None
+        if chunk is None or chunk.ndim != 1 or chunk.dtype.kind not in "biuf":
+            chunk = np.empty(len(values), dtype=object)
+            for i, v in enumerate(values):
+                chunk[i] = v
+        return chunk
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "The :columns result type requires numpy. Install it with "
+            "`pip install pugsql[numpy]`."
+        )
+    return numpy
+
+
 class Affected(Result):
     def transform(self, r):
         return r.rowcount
@@ -92,10 +243,13 @@ class Affected(Result):
 
 class Scalar(Result):
     def transform(self, r):
+        return self.transform_counted(r)[0]
+
+    def transform_counted(self, r):
         row = r.first()
         if not row:
-            return None
-        return row[0]
+            return None, 0
+        return row[0], 1
 
     @property
     def display_type(self) -> str:
@@ -104,9 +258,12 @@ class Scalar(Result):
 
 class Insert(Scalar):
     def transform(self, r):
+        return self.transform_counted(r)[0]
+
+    def transform_counted(self, r):
         if hasattr(r, "lastrowid"):
-            return r.lastrowid
-        return super(Insert, self).transform(r)
+            return r.lastrowid, None
+        return super(Insert, self).transform_counted(r)
 
     @property
     def display_type(self) -> str:
@@ -122,6 +279,94 @@ class Raw(Result):
         return "raw"
 
 
+_many = Many()
+_many_tuples = ManyTuples()
+_stream = Stream()
+_stream_tuples = StreamTuples()
+_columns = Columns()
+
+# the number of compiled forms of a statement kept per combination of IN list
+# parameters. Entries are keyed by dialect, the names of the parameters passed,
+# and whether many rows of parameters were passed.
+_compiled_cache_size = 16
+
+_Shape = namedtuple("_Shape", ["clause", "options"])
+
+
+async def _resolved(value):
+    return value
+
+
+def _add_rowcount(total, rowcount):
+    if total < 0 or rowcount < 0:
+        return -1
+    return total + rowcount
+
+
+def _typed(value):
+    if isinstance(value, tuple):
+        return tuple(_typed(v) for v in value)
+    return type(value), value
+
+
+def _without_end(sql):
+    # removes the semicolon ending a statement, along with any comments and
+    # whitespace after it, which would otherwise end up in the subquery.
+    while True:
+        sql = sql.rstrip()
+        if sql.endswith(";"):
+            sql = sql[:-1]
+        elif sql.endswith("*/") and "/*" in sql:
+            sql = sql[: sql.rindex("/*")]
+        else:
+            line = sql.rfind("\n") + 1
+            comment = _comment_start(sql[line:])
+            if comment is None:
+                return sql
+            sql = sql[: line + comment]
+
+
+def _comment_start(line):
+    quote = None
+    for i, c in enumerate(line):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif line.startswith("--", i):
+            return i
+    return None
+
+
+def _keyset_sql(sql, columns, after):
+    # the statement runs as a subquery, so the key condition and the ORDER BY
+    # and LIMIT can be added without parsing it. Databases push the condition
+    # down into simple subqueries, where it can use an index on the key.
+    where = ""
+    if after:
+        if len(columns) == 1:
+            where = "where %s > :pugsql_after0\n" % columns[0]
+        else:
+            where = "where (%s) > (%s)\n" % (
+                ", ".join(columns),
+                ", ".join(":pugsql_after%d" % i for i in range(len(columns))),
+            )
+    return "select * from (\n%s\n) as pugsql_page\n%sorder by %s\n" % (
+        _without_end(sql),
+        where,
+        ", ".join(columns),
+    ) + "limit :pugsql_page_size"
+
+
+def _expanded(clause, expanding):
+    if not expanding:
+        return clause
+    return clause.bindparams(
+        *[bindparam(k, expanding=True) for k in sorted(expanding)]
+    )
+
+
 class Statement(object):
     def __init__(
         self,
@@ -130,6 +375,12 @@ class Statement(object):
         doc: str,
         result: Result,
         filename: Optional[str] = None,
+        line: Optional[int] = None,
+        readonly: bool = False,
+        route: Optional[str] = None,
+        shard_key: Optional[str] = None,
+        cache_options: Optional[cache.CacheOptions] = None,
+        invalidates: tuple = (),
     ):
         self.filename = filename
 
@@ -150,8 +401,27 @@ class Statement(object):
         self.__doc__ = doc
         self.result = result
         self.filename = filename
+        self.line = line
+        self.readonly = readonly
+        self.route = route
+        self._replica = route == "replica" or (route is None and readonly)
+        self.cache_options = cache_options
+        self.invalidates = tuple(invalidates)
         self._module = None
         self._text = sqlalchemy.sql.text(self.sql)
+        self.shard_key = shard_key
+        if shard_key is not None and shard_key not in self._text._bindparams:
+            self._value_err(
+                "Shard key %s is not a parameter of %s." % (shard_key, name)
+            )
+        self._shapes = {}
+        self._explains = {}
+        self._keysets = {}
+        self._result_cache = None
+        if cache_options is not None:
+            self._result_cache = cache.TTLCache(
+                cache_options.maxsize, cache_options.ttl
+            )
 
     def _value_err(self, msg):
         if self.filename:
@@ -169,17 +439,685 @@ class Statement(object):
         return self._module
 
     def __call__(self, *multiparams, **params):
+        if isinstance(self.result, Stream):
+            if multiparams:
+                self._positionalArgError()
+            return self.stream(**params)
+        if isinstance(self.result, Columns):
+            if multiparams:
+                self._positionalArgError()
+            return self.columns(**params)
+
         module = self._assert_module()
+        sample = module._profiler and module._profiler.sample()
         multiparams, params = self._convert_params(multiparams, params)
+        if sample:
+            sample.mark("convert_params")
         self._validateMultiparams(params, multiparams)
-        with _compile_context(multiparams, params):
+        key = self._cache_key(module, multiparams, params)
+        generation = None
+        if key is not None:
+            frozen = self._result_cache.get(key)
+            if frozen is not None:
+                return self._transform_cached(module, frozen)
+            generation = self._result_cache.generation
+        args = (module, multiparams, params, key, generation)
+        if sample:
+            sample.mark("validate")
+            profiler = module._profiler
+            if module.is_async:
+                return profiler.call_async(
+                    sample, self.name, self._call_async, *args
+                )
+            return profiler.call(sample, self.name, self._call_sync, *args)
+        if module.is_async:
+            return self._call_async(*args)
+        return self._call_sync(*args)
+
+    def _call_sync(self, module, multiparams, params, key, generation):
+        if module._listeners:
+            return self._call_observed(
+                module, multiparams, params, key, generation
+            )
+
+        r = self._execute(module, multiparams, params)
+        if key is not None:
+            r = self._cache_result(key, generation, r)
+        return self.result.transform(r)
+
+    def _call_observed(self, module, multiparams, params, key, generation):
+        with events.observe(
+            module._listeners, self, multiparams, params
+        ) as execution:
+            r = self._execute(module, multiparams, params)
+            execution.executed(r)
+            if key is not None:
+                r = self._cache_result(key, generation, r)
+            value, execution.rows = self.result.transform_counted(r)
+        return value
+
+    def _execute(self, module, multiparams, params):
+        shape = self._shape(params)
+        shard = self._shard(module, multiparams or (params,))
+        try:
+            r = module._execute(
+                shape.clause,
+                multiparams,
+                params,
+                shape.options,
+                readonly=self.readonly,
+                replica=self._replica,
+                shard=shard,
+            )
+        except AttributeError as e:
+            self._reraise(e)
+        self._invalidate(module)
+        return r
+
+    async def _call_async(self, module, multiparams, params, key, generation):
+        with events.observe(
+            module._listeners, self, multiparams, params
+        ) as execution:
+            shape = self._shape(params)
+            shard = self._shard(module, multiparams or (params,))
             try:
-                r = module._execute(self._text, *multiparams, **params)
+                r = await module._execute(
+                    shape.clause,
+                    multiparams,
+                    params,
+                    shape.options,
+                    readonly=self.readonly,
+                    replica=self._replica,
+                    shard=shard,
+                )
             except AttributeError as e:
-                if str(e) == "'tuple' object has no attribute 'keys'":
-                    self._positionalArgError()
-                raise
-        return self.result.transform(r)
+                self._reraise(e)
+            self._invalidate(module)
+            if execution is None:
+                if key is not None:
+                    r = self._cache_result(key, generation, r)
+                return self.result.transform(r)
+
+            execution.executed(r)
+            if key is not None:
+                r = self._cache_result(key, generation, r)
+            value, execution.rows = self.result.transform_counted(r)
+        return value
+
+    def _cache_key(self, module, multiparams, params):
+        # results are only cached outside of transactions and pinned
+        # connections, so uncommitted data never ends up in the cache.
+        if (
+            self._result_cache is None
+            or multiparams
+            or module._executor() is not None
+        ):
+            return None
+        # 1, 1.0, and True are equal as dict keys, but can give different
+        # results, so values are keyed along with their types.
+        try:
+            return frozenset((k, _typed(v)) for k, v in params.items())
+        except TypeError:
+            return None
+
+    def _cache_result(self, key, generation, r):
+        # the cache holds a frozen copy of the rows, which is replayed into a
+        # new result for each call so callers never share the dicts built by
+        # the result type.
+        frozen = r.freeze()
+        self._result_cache.add(key, frozen, generation)
+        return frozen()
+
+    def _transform_cached(self, module, frozen):
+        value = self.result.transform(frozen())
+        if module.is_async:
+            return _resolved(value)
+        return value
+
+    def _shard(self, module, paramsets) -> Optional[int]:
+        if self.shard_key is None:
+            return None
+        return module._shard_index(self, paramsets)
+
+    def _invalidate(self, module):
+        if self.invalidates:
+            module.invalidate(*self.invalidates)
+
+    def cache_info(self) -> Optional[cache.CacheInfo]:
+        """
+        Returns a `pugsql.cache.CacheInfo` describing how often calls to this
+        statement were answered from its `:cache`, or `None` if the statement
+        isn't cached.
+        """
+        if self._result_cache is None:
+            return None
+        return self._result_cache.info()
+
+    def cache_clear(self):
+        """
+        Discards all of the results cached for this statement.
+        """
+        if self._result_cache is not None:
+            self._result_cache.clear()
+
+    def _reraise(self, e):
+        if str(e) == "'tuple' object has no attribute 'keys'":
+            self._positionalArgError()
+        raise e
+
+    def _shape(self, params) -> _Shape:
+        # Each combination of expanding (IN list) parameters is compiled to
+        # different SQL, but SQLAlchemy's cache key for a text clause doesn't
+        # reflect that. So every combination gets its own copy of the clause
+        # with those parameters bound as expanding, and its own compiled
+        # cache, which SQLAlchemy keys by dialect. The shared clause is never
+        # modified, so concurrent calls with different shapes don't interact.
+        expanding = self._expanding(params)
+        shape = self._shapes.get(expanding)
+        if shape is None:
+            clause = _expanded(self._text, expanding)
+            compiled_cache = cache.LRUCache(_compiled_cache_size)
+            shape = self._shapes.setdefault(
+                expanding,
+                _Shape(clause, {"compiled_cache": compiled_cache}),
+            )
+        return shape
+
+    def _expanding(self, params) -> frozenset:
+        return frozenset(
+            k
+            for k, v in params.items()
+            if isinstance(v, tuple) and k in self._text._bindparams
+        )
+
+    def compiled_cache_info(self) -> cache.CacheInfo:
+        """
+        Returns a `pugsql.cache.CacheInfo` describing how often calls to this
+        statement reused previously compiled SQL, across all of the
+        combinations of IN list parameters it has been called with.
+        """
+        infos = [
+            shape.options["compiled_cache"].info()
+            for shape in list(self._shapes.values())
+        ]
+        return cache.CacheInfo(
+            *map(sum, zip(cache.CacheInfo(0, 0, 0, 0), *infos))
+        )
+
+    def explain(self, **params) -> explain.Plan:
+        """
+        Returns the `pugsql.explain.Plan` the database would use to run the
+        statement with `params`, which are converted as they are for a call,
+        so IN lists and arrays are explained as they'd be run. The statement
+        itself isn't executed. Uses `EXPLAIN QUERY PLAN` on SQLite and
+        `EXPLAIN (FORMAT JSON)` on PostgreSQL, and raises
+        `NotImplementedError` on other databases.
+
+        On a `pugsql.compiler.AsyncModule`, this returns an awaitable.
+        """
+        module = self._assert_module()
+        _, params = self._convert_params((), params)
+        shard = self._shard(module, (params,))
+        dialect = module._engine_for(shard).dialect.name
+        clause = self._explain_clause(dialect, params)
+        args = (clause, [], params, {})
+        if module.is_async:
+            return self._explain_async(module, dialect, shard, args)
+        r = module._execute(*args, readonly=True, shard=shard)
+        return explain.plan_from_rows(dialect, r.keys(), r.fetchall())
+
+    async def _explain_async(self, module, dialect, shard, args):
+        r = await module._execute(*args, readonly=True, shard=shard)
+        return explain.plan_from_rows(dialect, r.keys(), r.fetchall())
+
+    def _explain_clause(self, dialect, params):
+        # kept per dialect and combination of IN list parameters, like the
+        # statement's own shapes.
+        expanding = self._expanding(params)
+        clause = self._explains.get((dialect, expanding))
+        if clause is None:
+            clause = _expanded(
+                sqlalchemy.sql.text(explain.explain_sql(dialect, self.sql)),
+                expanding,
+            )
+            clause = self._explains.setdefault((dialect, expanding), clause)
+        return clause
+
+    def stream(self, **params):
+        """
+        Executes the statement using a server-side cursor where the database
+        supports one, and returns a generator yielding each row as a dict, or
+        as a SQLAlchemy `Row` if the statement's result type uses tuples.
+
+        Rows are fetched from the database in batches as the generator is
+        consumed. Outside of a transaction, the connection is checked out
+        until the generator is exhausted or closed, so it should be iterated
+        to completion or closed explicitly.
+
+        On a `pugsql.compiler.AsyncModule`, this returns an asynchronous
+        generator instead.
+        """
+        module = self._assert_module()
+        _, params = self._convert_params((), params)
+        shard = self._shard(module, (params,))
+        if module.is_async:
+            return self._stream_async(module, params, shard)
+        return self._stream_sync(module, params, shard)
+
+    def scatter(self, engines=None, order_by=None, workers=8, **params):
+        """
+        Runs the statement on each of `engines` at once, on up to `workers`
+        threads, and returns a `pugsql.scatter.Scatter` that yields the rows
+        of all of them as dicts (or SQLAlchemy `Row`s, if the statement's
+        result type uses tuples) while they're being read. `engines` is a
+        list or dict of SQLAlchemy engines, and defaults to the module's
+        shards (see `pugsql.compiler.Module.connect_shards`).
+
+        Rows are yielded in the order they arrive, unless `order_by` is given,
+        in which case each engine's rows are merged by that column (or by a
+        function of the row). The statement must return its rows sorted the
+        same way, e.g. with an ORDER BY clause.
+
+        An engine that fails doesn't stop the others. Its exception is put in
+        the `errors` of the returned object, which is complete once every row
+        has been read:
+
+            rows = queries.find_orders.scatter(status='open')
+            for row in rows:
+                ...
+            for shard, error in rows.errors.items():
+                ...
+
+        Each engine is read on its own connection, outside of any transaction
+        or pinned connection. `engines`, `order_by`, and `workers` can't be
+        used as parameter names by statements called this way. Not supported
+        by `pugsql.compiler.AsyncModule`.
+        """
+        module = self._assert_sync_module("scatter")
+        if engines is None:
+            if module.shards is None:
+                raise NoConnectionError()
+            engines = module.shards.engines
+        _, params = self._convert_params((), params)
+        return scatter.Scatter(
+            engines,
+            lambda engine: self._stream_sync(module, params, None, engine),
+            workers,
+            order_by,
+            self._stream_result().tuples,
+        )
+
+    def paginate(self, key="id", page_size=10000, **params):
+        """
+        Reads the statement's rows in pages of `page_size`, ordered by the
+        `key` column, and returns a generator yielding each row as a dict (or
+        a SQLAlchemy `Row`, if the statement's result type uses tuples).
+        Only one page is held in memory at a time.
+
+        This is keyset pagination: after the first page, the statement is
+        run with a condition that the key is greater than the last key seen,
+        which an index on the key can answer directly, unlike an OFFSET that
+        rereads every earlier row. The statement is run as a subquery:
+
+            -- :name active_users :many
+            select * from users where active = :active
+
+            for user in queries.active_users.paginate('user_id', active=True):
+                ...
+
+        `key` must be a column of the result whose values are unique and not
+        null, or a tuple of columns that together are. The statement itself
+        shouldn't have an ORDER BY or LIMIT clause. `key` and `page_size`
+        can't be used as parameter names by statements called this way.
+
+        Each page is executed separately, so rows written while the pages are
+        read may or may not be included, unless the generator is used inside
+        `pugsql.compiler.Module.transaction`. On a
+        `pugsql.compiler.AsyncModule`, this returns an asynchronous generator
+        instead.
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1.")
+        module = self._assert_module()
+        columns = (key,) if isinstance(key, str) else tuple(key)
+        if not columns:
+            raise ValueError("paginate needs at least one key column.")
+        _, params = self._convert_params((), params)
+        shard = self._shard(module, (params,))
+        if module.is_async:
+            return self._paginate_async(
+                module, columns, page_size, params, shard
+            )
+        return self._paginate_sync(module, columns, page_size, params, shard)
+
+    def _paginate_sync(self, module, columns, page_size, params, shard):
+        dialect = module._engine_for(shard).dialect
+        result = _many_tuples if self.result.tuples else _many
+        after = None
+        while True:
+            shape, page_params = self._keyset_page(
+                dialect, columns, page_size, params, after
+            )
+            with events.observe(
+                module._listeners, self, [], page_params
+            ) as execution:
+                r = module._execute(
+                    shape.clause,
+                    [],
+                    page_params,
+                    shape.options,
+                    readonly=self.readonly,
+                    replica=self._replica,
+                    shard=shard,
+                )
+                if execution is not None:
+                    execution.executed(r)
+                ks, rows = r.keys(), r.fetchall()
+                if execution is not None:
+                    execution.rows = len(rows)
+            yield from result._rows(ks, rows)
+            if len(rows) < page_size:
+                return
+            after = self._last_key(ks, rows, columns)
+
+    async def _paginate_async(self, module, columns, page_size, params, shard):
+        dialect = module._engine_for(shard).dialect
+        result = _many_tuples if self.result.tuples else _many
+        after = None
+        while True:
+            shape, page_params = self._keyset_page(
+                dialect, columns, page_size, params, after
+            )
+            with events.observe(
+                module._listeners, self, [], page_params
+            ) as execution:
+                r = await module._execute(
+                    shape.clause,
+                    [],
+                    page_params,
+                    shape.options,
+                    readonly=self.readonly,
+                    replica=self._replica,
+                    shard=shard,
+                )
+                if execution is not None:
+                    execution.executed(r)
+                ks, rows = r.keys(), r.fetchall()
+                if execution is not None:
+                    execution.rows = len(rows)
+            for row in result._rows(ks, rows):
+                yield row
+            if len(rows) < page_size:
+                return
+            after = self._last_key(ks, rows, columns)
+
+    def _keyset_page(self, dialect, columns, page_size, params, after):
+        # the first page and the later ones are different SQL, and each is
+        # kept per dialect and combination of IN list parameters.
+        expanding = self._expanding(params)
+        k = (dialect.name, columns, after is not None, expanding)
+        shape = self._keysets.get(k)
+        if shape is None:
+            quote = dialect.identifier_preparer.quote
+            clause = sqlalchemy.sql.text(
+                _keyset_sql(
+                    self.sql, [quote(c) for c in columns], after is not None
+                )
+            )
+            compiled_cache = cache.LRUCache(_compiled_cache_size)
+            shape = self._keysets.setdefault(
+                k,
+                _Shape(
+                    _expanded(clause, expanding),
+                    {"compiled_cache": compiled_cache},
+                ),
+            )
+
+        page_params = dict(params, pugsql_page_size=page_size)
+        for i, value in enumerate(after or ()):
+            page_params["pugsql_after%d" % i] = value
+        return shape, page_params
+
+    def _last_key(self, ks, rows, columns) -> tuple:
+        ks = list(ks)
+        missing = [c for c in columns if c not in ks]
+        if missing:
+            raise InvalidArgumentError(
+                "The key column %s isn't in the results of %s."
+                % (", ".join(missing), self.name)
+            )
+        last = rows[-1]
+        return tuple(last[ks.index(c)] for c in columns)
+
+    def columns(self, **params):
+        """
+        Executes the statement and returns a dict mapping each column name to
+        a NumPy array holding that column's values, regardless of the
+        statement's result type. Rows are read from the cursor in chunks and
+        copied directly into the arrays, without building a dict per row.
+
+        Numeric and boolean columns get a numeric dtype, and other columns are
+        arrays of Python objects. Requires numpy.
+
+        On a `pugsql.compiler.AsyncModule`, this returns an awaitable.
+        """
+        module = self._assert_module()
+        _, params = self._convert_params((), params)
+        shape = self._shape(params)
+        options = dict(shape.options, yield_per=Columns.chunk_size)
+        shard = self._shard(module, (params,))
+        if module.is_async:
+            return self._columns_async(module, shape, params, options, shard)
+        with events.observe(module._listeners, self, [], params) as execution:
+            with module._stream(
+                shape.clause, params, options, self._replica, shard
+            ) as r:
+                if execution is None:
+                    return _columns.transform(r)
+                execution.executed()
+                value, execution.rows = _columns.transform_counted(r)
+        return value
+
+    async def _columns_async(self, module, shape, params, options, shard):
+        with events.observe(module._listeners, self, [], params) as execution:
+            async with module._stream(
+                shape.clause, params, options, self._replica, shard
+            ) as r:
+                if execution is not None:
+                    execution.executed()
+                builder = _ColumnBuilder(r.keys(), Columns.chunk_size)
+                while True:
+                    rows = await r.fetchmany(Columns.chunk_size)
+                    if not rows:
+                        break
+                    builder.append(rows)
+            if execution is not None:
+                execution.rows = builder.size
+        return builder.finish()
+
+    def bulk(self, rows, batch_size=5000, transaction=False):
+        """
+        Executes the statement once for each dict of parameters in `rows`,
+        which can be any iterable, including a generator. Rows are consumed
+        lazily and sent to the database in batches of at most `batch_size`
+        with `executemany`, so memory use doesn't grow with the number of
+        rows:
+
+            def users():
+                for line in open('users.csv'):
+                    yield {'username': line.strip()}
+
+            queries.insert_user.bulk(users(), batch_size=10000)
+
+        Outside of a transaction, each batch is committed as it is executed.
+        Pass `transaction=True` to run all of the batches in one transaction
+        instead. Inside `pugsql.compiler.Module.transaction`, the batches use
+        the current transaction. If the statement has a `:shard` key, each
+        batch is split by shard, and a transaction can only hold rows for its
+        own shard.
+
+        Returns the total number of rows affected, or -1 if the driver
+        doesn't report it. On a `pugsql.compiler.AsyncModule`, this returns
+        an awaitable.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+
+        module = self._assert_module()
+        if module.is_async:
+            return self._bulk_async(module, rows, batch_size, transaction)
+
+        if transaction:
+            with module.transaction():
+                return self._bulk(module, rows, batch_size)
+        return self._bulk(module, rows, batch_size)
+
+    def _bulk(self, module, rows, batch_size):
+        shape = self._shape({})
+        total = 0
+        for batch, shard in self._batches(module, rows, batch_size):
+            with events.observe(
+                module._listeners, self, batch, {}
+            ) as execution:
+                r = module._execute(
+                    shape.clause, [batch], {}, shape.options, shard=shard
+                )
+                if execution is not None:
+                    execution.executed(r)
+            self._invalidate(module)
+            total = _add_rowcount(total, r.rowcount)
+        return total
+
+    async def _bulk_async(self, module, rows, batch_size, transaction):
+        if transaction:
+            async with module.transaction():
+                return await self._bulk_async(module, rows, batch_size, False)
+
+        shape = self._shape({})
+        total = 0
+        for batch, shard in self._batches(module, rows, batch_size):
+            with events.observe(
+                module._listeners, self, batch, {}
+            ) as execution:
+                r = await module._execute(
+                    shape.clause, [batch], {}, shape.options, shard=shard
+                )
+                if execution is not None:
+                    execution.executed(r)
+            self._invalidate(module)
+            total = _add_rowcount(total, r.rowcount)
+        return total
+
+    def _batches(self, module, rows, batch_size):
+        # yields (batch, shard) pairs. On a sharded module, each batch is
+        # split into one per shard.
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            self._validateMultiparams({}, batch)
+            if self.shard_key is None or module.shards is None:
+                yield batch, None
+                continue
+            by_shard = {}
+            for row in batch:
+                shard = module._shard_index(self, (row,))
+                by_shard.setdefault(shard, []).append(row)
+            for shard, part in by_shard.items():
+                yield part, shard
+
+    def copy_in(self, rows) -> int:
+        """
+        Runs the statement, which should be a PostgreSQL
+        `COPY ... FROM STDIN` statement, using the driver's support for the
+        COPY protocol. This is much faster than inserting rows one by one.
+
+        `rows` can be an iterable of sequences of column values, which are
+        consumed lazily and sent in COPY's default text format, or a readable
+        file-like object with data in the format the statement expects:
+
+            -- :name load_users
+            copy users (user_id, username) from stdin
+
+            queries.load_users.copy_in((u.id, u.name) for u in users)
+
+        Inside `pugsql.compiler.Module.transaction`, the copy uses the current
+        transaction. Otherwise it is committed when it finishes. Returns the
+        number of rows copied.
+        """
+        module = self._assert_sync_module("COPY")
+        with module._dbapi_connection() as conn:
+            count = pgcopy.copy_in(conn, self.sql, rows)
+        self._invalidate(module)
+        return count
+
+    def copy_out(self, fp) -> int:
+        """
+        Runs the statement, which should be a PostgreSQL `COPY ... TO STDOUT`
+        statement, using the driver's support for the COPY protocol, and
+        writes the data to the writable file-like object `fp`.
+
+        Inside `pugsql.compiler.Module.transaction`, the copy uses the current
+        transaction. Returns the number of rows copied.
+        """
+        module = self._assert_sync_module("COPY")
+        with module._dbapi_connection() as conn:
+            return pgcopy.copy_out(conn, self.sql, fp)
+
+    def _assert_sync_module(self, feature: str) -> "Module":
+        module = self._assert_module()
+        if module.is_async:
+            raise NotImplementedError(
+                "%s is not supported by AsyncModule." % feature
+            )
+        return module
+
+    def _stream_options(self, shape):
+        return dict(shape.options, yield_per=Stream.yield_per)
+
+    def _stream_result(self) -> Stream:
+        if isinstance(self.result, Stream):
+            return self.result
+        return _stream_tuples if self.result.tuples else _stream
+
+    def _stream_sync(self, module, params, shard, engine=None):
+        shape = self._shape(params)
+        options = self._stream_options(shape)
+        result = self._stream_result()
+        if engine is None:
+            stream = module._stream(
+                shape.clause, params, options, self._replica, shard
+            )
+        else:
+            stream = module._stream_on(engine, shape.clause, params, options)
+        with events.observe(module._listeners, self, [], params) as execution:
+            with stream as r:
+                if execution is None:
+                    yield from result.transform(r)
+                    return
+                execution.executed()
+                execution.rows = 0
+                for row in result.transform(r):
+                    execution.rows += 1
+                    yield row
+
+    async def _stream_async(self, module, params, shard):
+        shape = self._shape(params)
+        options = self._stream_options(shape)
+        tuples = self._stream_result().tuples
+        with events.observe(module._listeners, self, [], params) as execution:
+            async with module._stream(
+                shape.clause, params, options, self._replica, shard
+            ) as r:
+                if execution is not None:
+                    execution.executed()
+                    execution.rows = 0
+                ks = r.keys()
+                async for row in r:
+                    if execution is not None:
+                        execution.rows += 1
+                    yield row if tuples else {k: v for k, v in zip(ks, row)}
 
     def _validateMultiparams(self, params, multiparams):
         # try to catch some common usage mistakes
@@ -0,0 +1,14 @@
+-- :name cached_username :scalar
+-- :cache ttl=60 tags=users
+select username from users where user_id = :user_id
+
+-- :name cached_users :many
+-- :cache tags=users,all
+select * from users order by user_id
+
+-- :name rename_user :affected
+-- :invalidates users
+update users set username = :username where user_id = :user_id
+
+-- :name add_user :insert
+insert into users (username) values (:username)
@@ -0,0 +1,5 @@
+-- :name user_tuple_for_id :one tuple
+select * from users where user_id = :user_id
+
+-- :name user_tuples :many tuples
+select * from users where user_id < :max_id order by user_id asc
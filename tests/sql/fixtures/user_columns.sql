@@ -0,0 +1,2 @@
+-- :name user_columns :columns
+select * from users where user_id < :max_id order by user_id asc
@@ -0,0 +1,3 @@
+-- :name stream_usernames
+-- :result :stream
+select * from users where username = :username
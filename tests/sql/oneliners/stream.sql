@@ -0,0 +1,2 @@
+-- :name stream_usernames :stream
+select * from users where username = :username
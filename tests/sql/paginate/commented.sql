@@ -0,0 +1,5 @@
+-- :name commented_users :many
+select user_id, '--' as dashes
+from users
+where user_id <= :max_id; -- every user up to max_id
+/* the page's conditions are added around this */
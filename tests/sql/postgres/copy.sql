@@ -0,0 +1,5 @@
+-- :name copy_in_test
+copy test.test (id, foo) from stdin
+
+-- :name copy_out_test
+copy test.test (id, foo) to stdout
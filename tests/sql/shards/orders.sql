@@ -0,0 +1,17 @@
+-- :name add_order :insert
+-- :shard customer_id
+insert into orders (customer_id, item) values (:customer_id, :item)
+
+-- :name orders_for_customer :many
+-- :shard customer_id
+select * from orders where customer_id = :customer_id order by order_id
+
+-- :name stream_orders :stream
+-- :shard customer_id
+select * from orders where customer_id = :customer_id order by order_id
+
+-- :name all_orders :many
+select * from orders order by order_id
+
+-- :name orders_since :many
+select * from orders where item >= :since order by item
@@ -0,0 +1,8 @@
+-- :name cache_dir :scalar
+select 1
+
+-- :name lazy :scalar
+select 2
+
+-- :name workers :scalar
+select 3
@@ -0,0 +1,286 @@
+import asyncio
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+import pytest
+
+import pugsql
+from pugsql import compiler, exceptions
+
+pytest.importorskip("aiosqlite")
+
+
+def test_async_module():
+    m = pugsql.async_module("tests/sql/fixtures")
+    assert isinstance(m, compiler.AsyncModule)
+    assert m.is_async
+
+
+class AsyncPugsqlTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fixtures = pugsql.async_module("tests/sql/fixtures")
+        self.fixtures.connect(
+            "sqlite+aiosqlite:///./tests/data/fixtures.sqlite3"
+        )
+
+    async def asyncTearDown(self):
+        await self.fixtures.dispose()
+
+    async def test_get_one(self):
+        self.assertEqual(
+            {"username": "mcfunley", "user_id": 1},
+            await self.fixtures.user_for_id(user_id=1),
+        )
+
+    async def test_many(self):
+        self.assertEqual(
+            [{"username": "oscar", "user_id": 2}],
+            list(await self.fixtures.search_users(username="oscar")),
+        )
+
+    async def test_scalar(self):
+        self.assertEqual(
+            "mcfunley", await self.fixtures.username_for_id(user_id=1)
+        )
+
+    async def test_where_in(self):
+        result = await self.fixtures.find_by_usernames(
+            usernames=["oscar", "dottie"]
+        )
+        self.assertEqual(
+            [
+                {"user_id": 2, "username": "oscar"},
+                {"user_id": 3, "username": "dottie"},
+            ],
+            list(result),
+        )
+
+    async def test_metrics(self):
+        self.fixtures.enable_metrics()
+        await self.fixtures.username_for_id(user_id=1)
+        rows = [r async for r in self.fixtures.stream_users(max_id=10)]
+        self.assertEqual(3, len(rows))
+
+        stats = self.fixtures.stats()
+        self.assertEqual(1, stats["username_for_id"].calls)
+        self.assertEqual(1, stats["username_for_id"].rows)
+        self.assertEqual(3, stats["stream_users"].rows)
+
+    async def test_explain(self):
+        plan = await self.fixtures.user_for_id.explain(user_id=1)
+        self.assertEqual([], plan.scans())
+
+    async def test_capture_plans(self):
+        capture = self.fixtures.capture_plans(threshold=0)
+        async with self.fixtures.transaction():
+            await self.fixtures.user_for_id(user_id=1)
+        # plans are captured in a separate task
+        for _ in range(100):
+            if capture.captured:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual("user_for_id", capture.captured[0].statement.name)
+        self.assertEqual(set(), capture._tasks)
+
+    async def test_replicas(self):
+        self.fixtures.connect(
+            "sqlite+aiosqlite:///./tests/data/fixtures.sqlite3",
+            replicas=[
+                "sqlite+aiosqlite:///./tests/missing/replica.db",
+                "sqlite+aiosqlite:///./tests/data/fixtures.sqlite3",
+            ],
+        )
+        with self.assertLogs("pugsql.replicas"):
+            for _ in range(2):
+                self.assertEqual(
+                    "mcfunley", await self.fixtures.username_for_id(user_id=1)
+                )
+        rows = [r async for r in self.fixtures.stream_users(max_id=10)]
+        self.assertEqual(3, len(rows))
+        health = self.fixtures.replicas.health()
+        self.assertEqual([False, True], [h.healthy for h in health])
+
+    async def test_failed_replica_stream(self):
+        self.fixtures.connect(
+            "sqlite+aiosqlite:///./tests/data/fixtures.sqlite3",
+            replicas=["sqlite+aiosqlite:///./tests/missing/replica.db"],
+        )
+        with self.assertLogs("pugsql.replicas"):
+            rows = [r async for r in self.fixtures.stream_users(max_id=10)]
+        self.assertEqual(3, len(rows))
+        health = self.fixtures.replicas.health()
+        self.assertEqual([(False, 0)], [(h.healthy, h.in_use) for h in health])
+
+    async def test_shards(self):
+        m = pugsql.async_module("tests/sql/shards")
+        with tempfile.TemporaryDirectory() as tmp:
+            url = "sqlite+aiosqlite:///%s/shard%%d.db" % tmp
+            m.connect_shards([url % i for i in (0, 1)])
+            for engine in m.shards.engines:
+                async with engine.begin() as conn:
+                    await conn.exec_driver_sql(
+                        "create table orders (order_id integer primary key, "
+                        "customer_id integer, item text)"
+                    )
+            try:
+                await m.add_order(customer_id=1, item="a")
+                async with m.transaction(shard=2):
+                    await m.add_order(customer_id=2, item="b")
+                    with self.assertRaises(ValueError):
+                        await m.add_order(customer_id=3, item="c")
+                orders = await m.orders_for_customer(customer_id=2)
+                self.assertEqual(["b"], [o["item"] for o in orders])
+                rows = [r async for r in m.stream_orders(customer_id=1)]
+                self.assertEqual(["a"], [r["item"] for r in rows])
+            finally:
+                await m.dispose()
+
+    async def test_profiling(self):
+        profiler = self.fixtures.enable_profiling(sample_rate=1)
+        self.assertEqual(
+            "mcfunley", await self.fixtures.username_for_id(user_id=1)
+        )
+        phases = profiler.stats()["username_for_id"].phases
+        self.assertGreater(phases["checkout"], 0)
+        self.assertGreater(phases["execute"], 0)
+
+    async def test_stream(self):
+        rows = [r async for r in self.fixtures.stream_users(max_id=10)]
+        self.assertEqual(
+            ["mcfunley", "oscar", "dottie"], [r["username"] for r in rows]
+        )
+
+    async def test_paginate(self):
+        rows = self.fixtures.stream_users.paginate("user_id", 2, max_id=10)
+        self.assertEqual(
+            ["mcfunley", "oscar", "dottie"],
+            [r["username"] async for r in rows],
+        )
+
+    async def test_stream_many_statement(self):
+        rows = self.fixtures.find_by_usernames.stream(usernames=("oscar",))
+        self.assertEqual(
+            [{"user_id": 2, "username": "oscar"}], [r async for r in rows]
+        )
+
+    async def test_columns(self):
+        pytest.importorskip("numpy")
+        cols = await self.fixtures.user_columns(max_id=10)
+        self.assertEqual([1, 2, 3], cols["user_id"].tolist())
+
+    async def test_transaction(self):
+        async with self.fixtures.transaction() as t:
+            pk = await self.fixtures.insert_user(username="async_pug")
+            self.assertEqual(
+                {"username": "async_pug", "user_id": pk},
+                await self.fixtures.user_for_id(user_id=pk),
+            )
+            rows = self.fixtures.stream_users(max_id=pk + 1)
+            self.assertIn("async_pug", [r["username"] async for r in rows])
+            await t.rollback()
+
+        self.assertIsNone(await self.fixtures.user_for_id(user_id=pk))
+
+    async def test_rolling_back_transaction(self):
+        class FooException(RuntimeError):
+            pass
+
+        with pytest.raises(FooException):
+            async with self.fixtures.transaction():
+                await self.fixtures.update_username(user_id=1, username="foo")
+                raise FooException()
+
+        self.assertEqual(
+            "mcfunley", await self.fixtures.username_for_id(user_id=1)
+        )
+
+    async def test_nesting_transactions_rollback_inner(self):
+        async with self.fixtures.transaction() as outer:
+            await self.fixtures.insert_user(username="scratch1")
+            async with self.fixtures.transaction() as inner:
+                await self.fixtures.insert_user(username="scratch2")
+                await inner.rollback()
+
+            users = {
+                u["username"]
+                for u in await self.fixtures.find_by_usernames(
+                    usernames={"scratch1", "scratch2"}
+                )
+            }
+            self.assertEqual(users, {"scratch1"})
+            await outer.rollback()
+
+    async def test_copy_not_supported(self):
+        with pytest.raises(NotImplementedError, match="AsyncModule"):
+            self.fixtures.insert_user.copy_in([("x",)])
+
+    async def test_connection(self):
+        async with self.fixtures.connection() as conn:
+            self.assertEqual(
+                "mcfunley", await self.fixtures.username_for_id(user_id=1)
+            )
+            rows = self.fixtures.stream_users(max_id=3)
+            self.assertEqual(2, len([r async for r in rows]))
+            async with self.fixtures.transaction() as t:
+                self.assertIs(conn, await t.connection())
+        self.assertIsNone(self.fixtures._executor())
+
+    async def test_connection_per_module(self):
+        other = pugsql.async_module("tests/sql/fixtures")
+        other.connect("sqlite+aiosqlite:///./tests/data/fixtures.sqlite3")
+        try:
+            async with self.fixtures.connection() as conn:
+                self.assertIs(conn, self.fixtures._executor())
+                self.assertIsNone(other._executor())
+        finally:
+            await other.dispose()
+
+    async def test_connection_rollback(self):
+        with pytest.raises(RuntimeError):
+            async with self.fixtures.connection():
+                await self.fixtures.update_username(user_id=1, username="foo")
+                raise RuntimeError()
+
+        self.assertEqual(
+            "mcfunley", await self.fixtures.username_for_id(user_id=1)
+        )
+
+    async def test_not_connected(self):
+        fixtures = pugsql.async_module("tests/sql/fixtures")
+        with pytest.raises(exceptions.NoConnectionError):
+            await fixtures.user_for_id(user_id=1)
+
+    async def test_positional_args_mistake(self):
+        with pytest.raises(
+            exceptions.InvalidArgumentError,
+            match="Pass keyword arguments to statements",
+        ):
+            await self.fixtures.find_by_username_or_id(
+                1, usernames=("oscar", "dottie")
+            )
+
+
+class AsyncResultCacheTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.m = pugsql.async_module("tests/sql/cache")
+        self.m.connect("sqlite+aiosqlite:///%s/cache.sqlite3" % self.tmp.name)
+        async with self.m.engine.begin() as conn:
+            await conn.exec_driver_sql(
+                "create table users (user_id integer primary key "
+                "autoincrement, username text)"
+            )
+        await self.m.add_user(username="oscar")
+
+    async def asyncTearDown(self):
+        await self.m.dispose()
+        self.tmp.cleanup()
+
+    async def test_cache(self):
+        self.assertEqual("oscar", await self.m.cached_username(user_id=1))
+        self.assertEqual("oscar", await self.m.cached_username(user_id=1))
+        self.assertEqual(1, self.m.cached_username.cache_info().hits)
+
+        async with self.m.transaction():
+            await self.m.rename_user(user_id=1, username="ozzy")
+        self.assertEqual("ozzy", await self.m.cached_username(user_id=1))
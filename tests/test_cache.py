@@ -0,0 +1,92 @@
+from unittest import TestCase, mock
+
+from pugsql import cache, parser
+
+
+class LRUCacheTest(TestCase):
+    def test_miss(self):
+        c = cache.LRUCache()
+        self.assertIsNone(c.get("x"))
+        self.assertEqual(cache.CacheInfo(0, 1, 0, 0), c.info())
+
+    def test_hit(self):
+        c = cache.LRUCache()
+        c["x"] = 1
+        self.assertEqual(1, c.get("x"))
+        self.assertEqual(cache.CacheInfo(1, 0, 0, 1), c.info())
+
+    def test_evicts_least_recently_used(self):
+        c = cache.LRUCache(maxsize=2)
+        c["x"] = 1
+        c["y"] = 2
+        c.get("x")
+        c["z"] = 3
+        self.assertIsNone(c.get("y"))
+        self.assertEqual(1, c.get("x"))
+        self.assertEqual(3, c.get("z"))
+        self.assertEqual(1, c.info().evictions)
+        self.assertEqual(2, len(c))
+
+    def test_clear(self):
+        c = cache.LRUCache()
+        c["x"] = 1
+        c.clear()
+        self.assertEqual(0, len(c))
+
+
+class TTLCacheTest(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.c = cache.TTLCache(ttl=10, timer=lambda: self.now)
+
+    def test_hit(self):
+        self.c["x"] = 1
+        self.now = 9
+        self.assertEqual(1, self.c.get("x"))
+
+    def test_expires(self):
+        self.c["x"] = 1
+        self.now = 10
+        self.assertIsNone(self.c.get("x"))
+        self.assertEqual(cache.CacheInfo(0, 1, 0, 0), self.c.info())
+
+    def test_no_ttl(self):
+        c = cache.TTLCache(timer=lambda: self.now)
+        c["x"] = 1
+        self.now = 1e9
+        self.assertEqual(1, c.get("x"))
+
+    def test_add_after_clear(self):
+        generation = self.c.generation
+        self.c.clear()
+        self.c.add("x", 1, generation)
+        self.assertIsNone(self.c.get("x"))
+        self.c.add("x", 1, self.c.generation)
+        self.assertEqual(1, self.c.get("x"))
+
+
+class CacheKeyTest(TestCase):
+    def setUp(self):
+        self.s = parser.parse(
+            "-- :name get_flag :one\n-- :cache\nselect :v as v"
+        )
+        self.module = mock.Mock()
+        self.module._executor.return_value = None
+
+    def key(self, **params):
+        return self.s._cache_key(self.module, [], params)
+
+    def test_types_are_distinct(self):
+        self.assertNotEqual(self.key(v=1), self.key(v=True))
+        self.assertNotEqual(self.key(v=1), self.key(v=1.0))
+        self.assertNotEqual(self.key(v=(1, 2)), self.key(v=(True, 2)))
+        self.assertEqual(self.key(v=(1, 2)), self.key(v=(1, 2)))
+
+    def test_separate_entries(self):
+        generation = self.s._result_cache.generation
+        self.s._result_cache.add(self.key(v=1), "one", generation)
+        self.assertEqual("one", self.s._result_cache.get(self.key(v=1)))
+        self.assertIsNone(self.s._result_cache.get(self.key(v=True)))
+
+    def test_unhashable(self):
+        self.assertIsNone(self.key(v=[1]))
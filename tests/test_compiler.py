@@ -1,4 +1,6 @@
+import os
 import sys
+import tempfile
 from unittest import TestCase
 
 import pytest
@@ -37,6 +39,12 @@ class BasicCompilerTest(TestCase):
         with pytest.raises(ValueError, match=msg):
             compiler.Module("tests/sql/reserved")
 
+    def test_option_names_not_reserved(self):
+        m = compiler.Module("tests/sql/unreserved", cache_dir=None)
+        self.assertEqual("cache_dir", m.cache_dir.name)
+        self.assertEqual("lazy", m.lazy.name)
+        self.assertEqual("workers", m.workers.name)
+
     @pytest.mark.skipif(
         sys.version_info[:2] < (3, 10), reason="requires Python 3.10"
     )
@@ -82,3 +90,92 @@ class ModuleTest(TestCase):
         self.assertEqual({"tests/sql/mod1", "tests/sql/mod2"}, m.sqlpaths)
         self.assertIsInstance(m.scalar, statement.Statement)
         self.assertIsInstance(m.insert, statement.Statement)
+
+
+class LazyModuleTest(TestCase):
+    def test_parses_on_access(self):
+        m = compiler.Module("tests/sql", lazy=True)
+        self.assertEqual({}, m._statements)
+        self.assertIn("username_for_id", dir(m))
+
+        s = m.username_for_id
+        self.assertIs(s, m.username_for_id)
+        self.assertEqual(
+            compiler.Module("tests/sql").username_for_id.sql, s.sql
+        )
+        self.assertEqual(["username_for_id"], list(m._statements))
+
+    def test_iter_loads_all(self):
+        eager = compiler.Module("tests/sql")
+        m = compiler.Module("tests/sql", lazy=True)
+        self.assertEqual([s.name for s in eager], [s.name for s in m])
+        self.assertEqual({}, m._pending)
+
+    def test_missing_attribute(self):
+        m = compiler.Module("tests/sql", lazy=True)
+        with pytest.raises(AttributeError, match="no attribute 'nope'"):
+            m.nope
+
+    def test_function_redefinition(self):
+        msg = (
+            "Error loading tests/sql/duplicate-name/foo2.sql - a SQL function "
+            "named foo was already defined in "
+            "tests/sql/duplicate-name/foo.sql."
+        )
+        with pytest.raises(ValueError, match=msg):
+            compiler.Module("tests/sql/duplicate-name", lazy=True)
+
+    def test_reserved_function_name(self):
+        msg = (
+            "Error loading tests/sql/reserved/disconnect.sql - the function "
+            'name "disconnect" is reserved. Please choose another name.'
+        )
+        with pytest.raises(ValueError, match=msg):
+            compiler.Module("tests/sql/reserved", lazy=True)
+
+    def test_missing_name(self):
+        with pytest.raises(exceptions.ParserError, match="expected a query"):
+            compiler.Module("tests/sql/errors", lazy=True)
+
+    def test_parser_error_on_access(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "foo.sql"), "w") as f:
+                f.write("-- :name foo :wrong\nselect 1\n")
+            m = compiler.Module(d, lazy=True)
+            with pytest.raises(exceptions.ParserError, match="unrecognized"):
+                m.foo
+
+
+class WorkersTest(TestCase):
+    def test_same_as_sequential(self):
+        eager = compiler.Module("tests/sql/fixtures")
+        m = compiler.Module("tests/sql/fixtures", workers=4)
+        self.assertEqual(
+            [(s.name, s.sql, s.line) for s in eager],
+            [(s.name, s.sql, s.line) for s in m],
+        )
+
+    def test_multiple_paths(self):
+        m = compiler.Module("tests/sql/mod1", workers=4)
+        m.add_queries("tests/sql/mod2", "tests/sql/fixtures")
+        self.assertIsInstance(m.insert, statement.Statement)
+        self.assertIsInstance(m.user_for_id, statement.Statement)
+
+    def test_lazy(self):
+        m = compiler.Module("tests/sql", lazy=True, workers=4)
+        self.assertEqual({}, m._statements)
+        self.assertEqual("username_for_id", m.username_for_id.name)
+
+    def test_function_redefinition(self):
+        msg = (
+            "Error loading tests/sql/duplicate-name/foo2.sql - a SQL function "
+            "named foo was already defined in "
+            "tests/sql/duplicate-name/foo.sql."
+        )
+        for _ in range(10):
+            with pytest.raises(ValueError, match=msg):
+                compiler.Module("tests/sql/duplicate-name", workers=4)
+
+    def test_directory_not_found(self):
+        with pytest.raises(ValueError, match="Directory not found"):
+            compiler.Module("tests/sql/nope", workers=4)
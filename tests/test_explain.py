@@ -0,0 +1,139 @@
+from unittest import TestCase
+
+import pytest
+
+from pugsql import explain
+
+
+def sqlite_plan(*rows):
+    return explain.Plan(
+        "sqlite",
+        [
+            {"id": i, "parent": parent, "notused": 0, "detail": detail}
+            for i, parent, detail in rows
+        ],
+    )
+
+
+POSTGRES_PLAN = [
+    {
+        "Plan": {
+            "Node Type": "Hash Join",
+            "Total Cost": 35.5,
+            "Plans": [
+                {
+                    "Node Type": "Seq Scan",
+                    "Relation Name": "orders",
+                    "Alias": "o",
+                    "Total Cost": 20.1,
+                },
+                {
+                    "Node Type": "Hash",
+                    "Plans": [
+                        {
+                            "Node Type": "Index Scan",
+                            "Index Name": "users_pkey",
+                            "Relation Name": "users",
+                            "Alias": "users",
+                        }
+                    ],
+                },
+            ],
+        }
+    }
+]
+
+
+class ExplainSqlTest(TestCase):
+    def test_sqlite(self):
+        self.assertEqual(
+            "EXPLAIN QUERY PLAN\nselect 1",
+            explain.explain_sql("sqlite", "select 1"),
+        )
+
+    def test_postgres(self):
+        self.assertEqual(
+            "EXPLAIN (FORMAT JSON)\nselect 1",
+            explain.explain_sql("postgresql", "select 1"),
+        )
+
+    def test_unsupported(self):
+        with pytest.raises(NotImplementedError):
+            explain.explain_sql("mysql", "select 1")
+
+
+class PlanTest(TestCase):
+    def test_sqlite_lines(self):
+        plan = sqlite_plan(
+            (2, 0, "SCAN u"),
+            (7, 0, "LIST SUBQUERY 1"),
+            (9, 7, "SEARCH v USING COVERING INDEX ix (username=?)"),
+        )
+        self.assertEqual(
+            [
+                "SCAN u",
+                "LIST SUBQUERY 1",
+                "  SEARCH v USING COVERING INDEX ix (username=?)",
+            ],
+            plan.lines(),
+        )
+
+    def test_sqlite_scans(self):
+        plan = sqlite_plan(
+            (2, 0, "SCAN users"),
+            (3, 0, "SCAN TABLE orders"),
+            (4, 0, "SCAN CONSTANT ROW"),
+            (5, 0, "SCAN (subquery-1)"),
+            (6, 0, "SEARCH dates USING INTEGER PRIMARY KEY (rowid=?)"),
+        )
+        self.assertEqual(["users", "orders"], plan.scans())
+
+    def test_postgres_lines(self):
+        plan = explain.Plan("postgresql", POSTGRES_PLAN)
+        self.assertEqual(
+            [
+                "Hash Join",
+                "  Seq Scan on orders o",
+                "  Hash",
+                "    Index Scan using users_pkey on users",
+            ],
+            plan.lines(),
+        )
+        self.assertEqual(["orders"], plan.scans())
+
+    def test_postgres_from_text(self):
+        plan = explain.plan_from_rows(
+            "postgresql",
+            ["QUERY PLAN"],
+            [('[{"Plan": {"Node Type": "Result"}}]',)],
+        )
+        self.assertEqual("Result", str(plan))
+
+    def test_empty(self):
+        self.assertEqual([], sqlite_plan().lines())
+        self.assertEqual("", str(sqlite_plan()))
+
+
+class DiffTest(TestCase):
+    def test_same(self):
+        plans = {"find": ["SCAN users"]}
+        self.assertEqual([], explain.diff(plans, dict(plans)))
+
+    def test_changed(self):
+        self.assertEqual(
+            [
+                "--- a/find",
+                "+++ b/find",
+                "@@ -1 +1 @@",
+                "-SEARCH users USING INDEX ix (username=?)",
+                "+SCAN users",
+            ],
+            explain.diff(
+                {"find": ["SEARCH users USING INDEX ix (username=?)"]},
+                {"find": ["SCAN users"]},
+            ),
+        )
+
+    def test_added(self):
+        lines = explain.diff({}, {"find": ["SCAN users"]})
+        self.assertEqual("+SCAN users", lines[-1])
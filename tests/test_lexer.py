@@ -72,6 +72,45 @@ class LexTest(TestCase):
         )
 
 
+class ScanTest(TestCase):
+    samples = [
+        open("tests/sql/basic.sql", "r").read(),
+        open("tests/sql/multi-statement.sql", "r").read(),
+        "-- :name foo :1\nselect 1",
+        "   -- :name foo\n\n  --  :result :many  \n  select *\n\tfrom x  \n",
+        "-- :name foo\r\n-- :doc bar\r\nselect 1\r\n\r\nfrom y\r\n",
+        "-- :name foo\rselect 1\x0bfrom y\u2028where z",
+        "-- :name foo\n-- only comments\n",
+        "select 1",
+        "",
+    ]
+
+    def test_same_as_lex(self):
+        for sample in self.samples:
+            tokens = lexer.lex(sample, ctx)
+            n = 0
+            while n < len(tokens) and (
+                tokens[n].tag == "C" or not tokens[n].value
+            ):
+                n += 1
+            sql = "\n".join(t.value for t in tokens[n:]).strip()
+            self.assertEqual((tokens[:n], sql), lexer.scan(sample, ctx))
+
+    def test_context(self):
+        comments, sql = lexer.scan(
+            "-- :name foo\n  -- :doc bar\nselect 1",
+            context.Context("foo.sql", line=10),
+        )
+        self.assertEqual(
+            [
+                lexer.Token("C", "-- :name foo", ("foo.sql", 11, 1)),
+                lexer.Token("C", "-- :doc bar", ("foo.sql", 12, 3)),
+            ],
+            comments,
+        )
+        self.assertEqual("select 1", sql)
+
+
 class LexCommentTest(TestCase):
     def tok(self, comment):
         return lexer.Token("C", comment, at(1, 1))
@@ -0,0 +1,71 @@
+import math
+from types import SimpleNamespace
+from unittest import TestCase
+
+from pugsql import metrics
+
+
+def execution(name, elapsed, rows=None, rowcount=None, error=None):
+    return SimpleNamespace(
+        statement=SimpleNamespace(name=name),
+        elapsed=elapsed,
+        rows=rows,
+        rowcount=rowcount,
+        error=error,
+    )
+
+
+class RegistryTest(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry(buckets=(0.1, 0.01, 1))
+        for e in [
+            execution("a", 0.005, rows=2),
+            execution("a", 0.5, rows=3),
+            execution("a", 0.01, error=ValueError()),
+            execution("b", 2, rowcount=4),
+        ]:
+            self.registry.after_execute(e)
+
+    def test_stats(self):
+        stats = self.registry.stats()
+        self.assertEqual(
+            metrics.StatementStats(
+                calls=3,
+                errors=1,
+                time=0.515,
+                histogram=((0.01, 2), (0.1, 2), (1, 3), (math.inf, 3)),
+                rows=5,
+                rowcount=0,
+            ),
+            stats["a"],
+        )
+        self.assertEqual(
+            ((0.01, 0), (0.1, 0), (1, 0), (math.inf, 1)), stats["b"].histogram
+        )
+        self.assertEqual(4, stats["b"].rowcount)
+
+    def test_reset(self):
+        self.registry.reset()
+        self.assertEqual({}, self.registry.stats())
+
+    def test_prometheus(self):
+        text = metrics.prometheus(self.registry.stats(), prefix="app")
+        lines = text.splitlines()
+        self.assertIn("# TYPE app_calls_total counter", lines)
+        self.assertIn('app_calls_total{statement="a"} 3', lines)
+        self.assertIn('app_errors_total{statement="a"} 1', lines)
+        self.assertIn('app_rows_total{statement="a"} 5', lines)
+        self.assertIn('app_affected_rows_total{statement="b"} 4', lines)
+        self.assertIn("# TYPE app_duration_seconds histogram", lines)
+        self.assertIn(
+            'app_duration_seconds_bucket{statement="a",le="0.1"} 2', lines
+        )
+        self.assertIn(
+            'app_duration_seconds_bucket{statement="b",le="+Inf"} 1', lines
+        )
+        self.assertIn('app_duration_seconds_count{statement="a"} 3', lines)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_prometheus_empty(self):
+        text = metrics.prometheus({})
+        self.assertIn("# TYPE pugsql_calls_total counter", text)
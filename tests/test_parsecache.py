@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from pugsql import parsecache, parser
+
+
+class ParseCacheTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.args = [{"name": "foo", "sql": "select 1"}]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_miss(self):
+        self.assertIsNone(parsecache.load(self.dir, "a.sql", 1, "x"))
+
+    def test_hit(self):
+        parsecache.store(self.dir, "a.sql", 1, "x", self.args)
+        self.assertEqual(self.args, parsecache.load(self.dir, "a.sql", 1, "x"))
+
+    def test_changed_mtime(self):
+        parsecache.store(self.dir, "a.sql", 1, "x", self.args)
+        self.assertIsNone(parsecache.load(self.dir, "a.sql", 2, "x"))
+
+    def test_changed_contents(self):
+        parsecache.store(self.dir, "a.sql", 1, "x", self.args)
+        self.assertIsNone(parsecache.load(self.dir, "a.sql", 1, "y"))
+
+    def test_other_path(self):
+        parsecache.store(self.dir, "a.sql", 1, "x", self.args)
+        self.assertIsNone(parsecache.load(self.dir, "./a.sql", 1, "x"))
+
+    def test_other_version(self):
+        parsecache.store(self.dir, "a.sql", 1, "x", self.args)
+        format = parsecache._format
+        parsecache._format += 1
+        try:
+            self.assertIsNone(parsecache.load(self.dir, "a.sql", 1, "x"))
+        finally:
+            parsecache._format = format
+
+    def test_corrupt(self):
+        parsecache.store(self.dir, "a.sql", 1, "x", self.args)
+        with open(parsecache._cache_path(self.dir, "a.sql"), "wb") as f:
+            f.write(b"not json")
+        self.assertIsNone(parsecache.load(self.dir, "a.sql", 1, "x"))
+
+    def test_creates_directory(self):
+        d = os.path.join(self.dir, "sub")
+        parsecache.store(d, "a.sql", 1, "x", self.args)
+        self.assertEqual(self.args, parsecache.load(d, "a.sql", 1, "x"))
+        self.assertEqual(1, len(os.listdir(d)))
+
+    def test_statement_args(self):
+        args = [
+            parser.statement_args(
+                "-- :name foo :many tuples\n"
+                "-- :cache ttl=30 tags=a,b\n"
+                "select 1"
+            ),
+            parser.statement_args(
+                "-- :name bar :affected\n"
+                "-- :invalidates a\n"
+                "update foo set x = 1"
+            ),
+        ]
+        parsecache.store(self.dir, "a.sql", 1, "x", args)
+        self.assertEqual(args, parsecache.load(self.dir, "a.sql", 1, "x"))
+
+        with open(parsecache._cache_path(self.dir, "a.sql")) as f:
+            stored = json.load(f)["statements"]
+        self.assertEqual(":many tuples", stored[0]["result"])
+
+    def test_unknown_result(self):
+        args = [parser.statement_args("-- :name foo :one\nselect 1")]
+        parsecache.store(self.dir, "a.sql", 1, "x", args)
+        path = parsecache._cache_path(self.dir, "a.sql")
+        with open(path) as f:
+            entry = json.load(f)
+        entry["statements"][0]["result"] = ":bogus"
+        with open(path, "w") as f:
+            json.dump(entry, f)
+        self.assertIsNone(parsecache.load(self.dir, "a.sql", 1, "x"))
@@ -3,7 +3,7 @@ from unittest import TestCase
 
 import pytest
 
-from pugsql import parser, statement
+from pugsql import cache, parser, statement
 from pugsql.exceptions import ParserError
 
 
@@ -77,6 +77,9 @@ class OneLinerTest(TestCase):
     def test_long_many(self):
         self.assertIsInstance(self.parse("long-many").result, statement.Many)
 
+    def test_stream(self):
+        self.assertIsInstance(self.parse("stream").result, statement.Stream)
+
     def test_long_raw(self):
         self.assertIsInstance(self.parse("long-raw").result, statement.Raw)
 
@@ -113,6 +116,9 @@ class MultilineTest(TestCase):
     def test_long_many(self):
         self.assertIsInstance(self.parse("long-many").result, statement.Many)
 
+    def test_stream(self):
+        self.assertIsInstance(self.parse("stream").result, statement.Stream)
+
     def test_long_raw(self):
         self.assertIsInstance(self.parse("raw").result, statement.Raw)
 
@@ -214,6 +220,211 @@ class ResultLineWhitespaceTest(TestCase):
         self.assertIsInstance(s.result, statement.One)
 
 
+class ColumnsTest(TestCase):
+    def test_columns(self):
+        s = parser.parse("-- :name foo :columns\nselect 1")
+        self.assertIsInstance(s.result, statement.Columns)
+
+
+class TuplesTest(TestCase):
+    def test_one_tuple(self):
+        s = parser.parse("-- :name foo :one tuple\nselect 1")
+        self.assertIsInstance(s.result, statement.OneTuple)
+
+    def test_many_tuples(self):
+        s = parser.parse("-- :name foo :many tuples\nselect 1")
+        self.assertIsInstance(s.result, statement.ManyTuples)
+
+    def test_stream_tuples_result_line(self):
+        s = parser.parse(
+            "-- :name foo\n" "-- :result :stream tuples\n" "select 1"
+        )
+        self.assertIsInstance(s.result, statement.StreamTuples)
+
+    def test_unsupported_result_type(self):
+        msg = "Error in <literal>:1:14 - result type ':scalar' cannot return"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo :scalar tuples\n" "select 1")
+
+    def test_unsupported_result_type_result_line(self):
+        msg = "Error in <literal>:2:12 - result type ':n' cannot return"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo\n" "-- :result :n tuples\n" "select 1")
+
+
+class ReadonlyTest(TestCase):
+    def readonly(self, sql):
+        return parser.parse("-- :name foo :many\n" + sql).readonly
+
+    def test_select(self):
+        self.assertTrue(self.readonly("select * from users"))
+
+    def test_with_select(self):
+        self.assertTrue(
+            self.readonly("with u as (select 1)\n(select * from u)")
+        )
+
+    def test_values(self):
+        self.assertTrue(self.readonly("values (1), (2)"))
+
+    def test_leading_comment(self):
+        self.assertTrue(
+            self.readonly("/* update nothing */ select 1 -- or delete")
+        )
+
+    def test_strings_and_identifiers(self):
+        self.assertTrue(
+            self.readonly("select 'insert', \"delete\" from users")
+        )
+
+    def test_writes(self):
+        self.assertFalse(self.readonly("update users set username = 'x'"))
+        self.assertFalse(self.readonly("insert into users values (1)"))
+        self.assertFalse(self.readonly("delete from users"))
+
+    def test_with_dml(self):
+        self.assertFalse(
+            self.readonly(
+                "with d as (delete from users returning *)\nselect * from d"
+            )
+        )
+
+    def test_select_into(self):
+        self.assertFalse(self.readonly("select * into other from users"))
+
+    def test_select_for_update(self):
+        self.assertFalse(self.readonly("select * from users for update"))
+
+    def test_readonly_annotation(self):
+        s = parser.parse(
+            "-- :name foo :scalar\n-- :readonly\nexplain select 1"
+        )
+        self.assertTrue(s.readonly)
+
+    def test_writes_annotation(self):
+        s = parser.parse("-- :name foo :scalar\n-- :writes\nselect f()")
+        self.assertFalse(s.readonly)
+
+    def test_route(self):
+        s = parser.parse("-- :name foo :many\n-- :route replica\nselect f()")
+        self.assertEqual("replica", s.route)
+        self.assertTrue(s._replica)
+
+    def test_route_primary(self):
+        s = parser.parse("-- :name foo :many\n-- :route primary\nselect 1")
+        self.assertTrue(s.readonly)
+        self.assertFalse(s._replica)
+
+    def test_route_default(self):
+        self.assertTrue(parser.parse("-- :name foo\nselect 1")._replica)
+        self.assertFalse(parser.parse("-- :name foo\ndelete from x")._replica)
+
+    def test_route_invalid(self):
+        msg = "Error in <literal>:2:11 - expected 'primary' or 'replica'."
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo\n-- :route nowhere\nselect 1")
+
+    def test_shard(self):
+        s = parser.parse(
+            "-- :name foo :one\n-- :shard customer_id\n"
+            "select * from orders where customer_id = :customer_id"
+        )
+        self.assertEqual("customer_id", s.shard_key)
+
+    def test_shard_not_a_parameter(self):
+        with pytest.raises(ValueError, match="Shard key id is not a param"):
+            parser.parse("-- :name foo :one\n-- :shard id\nselect 1")
+
+    def test_shard_invalid(self):
+        msg = "Error in <literal>:2:11 - expected the name of a parameter."
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo\n-- :shard :id\nselect :id")
+
+    def test_annotation_unexpected_input(self):
+        msg = (
+            "Error in <literal>:2:14 - encountered unexpected input after "
+            ":readonly."
+        )
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo\n-- :readonly yes\nselect 1")
+
+
+class CacheTest(TestCase):
+    def test_cache(self):
+        s = parser.parse(
+            "-- :name foo :one\n-- :cache ttl=2.5 size=10 tags=a,b\nselect 1"
+        )
+        self.assertEqual(
+            cache.CacheOptions(2.5, 10, ("a", "b")), s.cache_options
+        )
+
+    def test_cache_defaults(self):
+        s = parser.parse("-- :name foo :scalar\n-- :cache\nselect 1")
+        self.assertEqual(cache.CacheOptions(None, 128, ()), s.cache_options)
+
+    def test_not_cached(self):
+        s = parser.parse("-- :name foo :scalar\nselect 1")
+        self.assertIsNone(s.cache_options)
+        self.assertEqual((), s.invalidates)
+
+    def test_invalidates(self):
+        s = parser.parse(
+            "-- :name foo :affected\n"
+            "-- :invalidates a, b\n"
+            "-- :invalidates c\n"
+            "delete from foo"
+        )
+        self.assertEqual(("a", "b", "c"), s.invalidates)
+
+    def test_unrecognized_option(self):
+        msg = "Error in <literal>:2:17 - unrecognized cache option 'tll'"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo :one\n-- :cache ttl=1 tll=2\nselect 1")
+
+    def test_bad_ttl(self):
+        msg = "Error in <literal>:2:11 - expected a positive number"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo :one\n-- :cache ttl=soon\nselect 1")
+
+    def test_option_without_value(self):
+        msg = "Error in <literal>:2:11 - expected a cache option"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo :one\n-- :cache users\nselect 1")
+
+    def test_uncacheable_result(self):
+        msg = "Error in <literal>:1:4 - cannot cache 'stream' results"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :cache ttl=1\n-- :name foo :stream\nselect 1")
+
+    def test_uncacheable_raw_result(self):
+        msg = "Error in <literal>:2:4 - cannot cache 'raw' results"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo\n-- :cache ttl=1\nselect 1")
+
+    def test_uncacheable_write(self):
+        msg = "Error in <literal>:2:4 - cannot cache a statement that writes"
+        with pytest.raises(ParserError, match=msg):
+            parser.parse(
+                "-- :name foo :scalar\n-- :cache\n"
+                "update foo set x = 1 returning x"
+            )
+        with pytest.raises(ParserError, match=msg):
+            parser.parse(
+                "-- :name foo :one\n-- :cache\n-- :writes\nselect f()"
+            )
+
+    def test_cache_readonly_override(self):
+        s = parser.parse(
+            "-- :name foo :one\n-- :cache\n-- :readonly\nexec report"
+        )
+        self.assertIsNotNone(s.cache_options)
+
+    def test_invalidates_without_tag(self):
+        msg = "Error in <literal>:2:16 - expected a cache tag."
+        with pytest.raises(ParserError, match=msg):
+            parser.parse("-- :name foo :n\n-- :invalidates\ndelete from foo")
+
+
 class LegalFunctionNameTest(TestCase):
     def errmsg(self, name):
         return (
@@ -0,0 +1,93 @@
+import io
+from datetime import date
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import pytest
+
+from pugsql import pgcopy
+
+
+def fake_connection(module):
+    cls = type("Connection", (object,), {"__module__": module})
+    conn = MagicMock()
+    conn.driver_connection = cls()
+    conn.cursor.return_value.rowcount = 2
+    return conn
+
+
+class FormatRowTest(TestCase):
+    def test_values(self):
+        self.assertEqual(
+            "1\tfoo\t\\N\tt\t2020-01-02\n",
+            pgcopy.format_row((1, "foo", None, True, date(2020, 1, 2))),
+        )
+
+    def test_escapes(self):
+        self.assertEqual(
+            "a\\tb\\nc\\rd\\\\e\n", pgcopy.format_row(("a\tb\nc\rd\\e",))
+        )
+
+    def test_bytes(self):
+        self.assertEqual("\\\\x00ff\n", pgcopy.format_row((b"\x00\xff",)))
+
+
+class LineReaderTest(TestCase):
+    def test_read_all(self):
+        r = pgcopy._LineReader(iter(["ab\n", "cd\n"]))
+        self.assertEqual("ab\ncd\n", r.read())
+        self.assertEqual("", r.read())
+
+    def test_read_size(self):
+        r = pgcopy._LineReader(iter(["ab\n", "cd\n"]))
+        self.assertEqual("ab\nc", r.read(4))
+        self.assertEqual("d\n", r.read(4))
+        self.assertEqual("", r.read(4))
+
+    def test_lazy(self):
+        def lines():
+            yield "ab\n"
+            raise AssertionError("read too far")
+
+        r = pgcopy._LineReader(lines())
+        self.assertEqual("a", r.read(1))
+
+
+class DriverTest(TestCase):
+    def test_psycopg2(self):
+        conn = fake_connection("psycopg2.extensions")
+        n = pgcopy.copy_in(conn, "copy t from stdin", [(1, "a"), (2, "b")])
+        self.assertEqual(2, n)
+        cursor = conn.cursor.return_value
+        sql, f = cursor.copy_expert.call_args[0]
+        self.assertEqual("copy t from stdin", sql)
+        self.assertEqual("1\ta\n2\tb\n", f.read())
+        cursor.close.assert_called_once_with()
+
+    def test_psycopg(self):
+        conn = fake_connection("psycopg")
+        pgcopy.copy_in(conn, "copy t from stdin", [(1, "a"), (2, "b")])
+        copy = conn.cursor.return_value.copy.return_value.__enter__()
+        self.assertEqual(
+            ["1\ta\n", "2\tb\n"],
+            [c[0][0] for c in copy.write.call_args_list],
+        )
+
+    def test_pg8000(self):
+        conn = fake_connection("pg8000.dbapi")
+        pgcopy.copy_in(conn, "copy t from stdin", io.StringIO("1\ta\n"))
+        stream = conn.cursor.return_value.execute.call_args[1]["stream"]
+        self.assertEqual("1\ta\n", stream.read())
+
+    def test_copy_out(self):
+        conn = fake_connection("pg8000.dbapi")
+        fp = io.StringIO()
+        pgcopy.copy_out(conn, "copy t to stdout", fp)
+        conn.cursor.return_value.execute.assert_called_once_with(
+            "copy t to stdout", stream=fp
+        )
+
+    def test_unsupported(self):
+        conn = fake_connection("sqlite3")
+        with pytest.raises(NotImplementedError, match="sqlite3 driver"):
+            pgcopy.copy_in(conn, "copy t from stdin", [])
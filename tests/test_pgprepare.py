@@ -0,0 +1,100 @@
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DBAPIError
+
+from pugsql import pgprepare
+
+
+def fake_connection(isolation_level=None):
+    conn = MagicMock()
+    conn.connection.info = {}
+    conn.get_execution_options.return_value = {
+        "isolation_level": isolation_level
+    }
+    return conn
+
+
+class PreparedFormTest(TestCase):
+    def test_prepared_form(self):
+        p = pgprepare.prepared_form(
+            text("select * from foo where a = :a and b = :b or c = :a")
+        )
+        self.assertEqual(
+            "select * from foo where a = $1 and b = $2 or c = $1", p.sql
+        )
+        self.assertTrue(p.name.startswith("pugsql_"))
+        self.assertEqual("EXECUTE %s(:a, :b)" % p.name, p.clause.text)
+
+    def test_no_params(self):
+        p = pgprepare.prepared_form(text("-- comment\nselect 1"))
+        self.assertEqual("EXECUTE %s" % p.name, p.clause.text)
+
+    def test_same_sql_same_name(self):
+        a = pgprepare.prepared_form(text("select :x"))
+        b = pgprepare.prepared_form(text("select :x"))
+        c = pgprepare.prepared_form(text("select :y + 1"))
+        self.assertEqual(a.name, b.name)
+        self.assertNotEqual(a.name, c.name)
+
+    def test_expanding(self):
+        clause = text("select * from foo where a in :a").bindparams(
+            bindparam("a", expanding=True)
+        )
+        self.assertIsNone(pgprepare.prepared_form(clause))
+
+    def test_not_preparable(self):
+        self.assertIsNone(
+            pgprepare.prepared_form(text("create table foo (a int)"))
+        )
+        self.assertIsNone(
+            pgprepare.prepared_form(text("-- a\n/* b */\ncall f(:a)"))
+        )
+
+    def test_leading_comments(self):
+        p = pgprepare.prepared_form(
+            text("-- a\n\n/* b\n */ -- c\n  (select :x)")
+        )
+        self.assertIsNotNone(p)
+
+    def test_many_blank_lines(self):
+        sql = "-- pugsql function f\n" + "\n" * 40 + "-- c\ncall f(:a)"
+        start = time.perf_counter()
+        self.assertIsNone(pgprepare.prepared_form(text(sql)))
+        self.assertLess(time.perf_counter() - start, 1)
+
+
+class PrepareTest(TestCase):
+    def setUp(self):
+        self.prepared = pgprepare.prepared_form(text("select :x"))
+
+    def test_prepares_once(self):
+        conn = fake_connection()
+        self.assertTrue(pgprepare.prepare(conn, self.prepared))
+        self.assertTrue(pgprepare.prepare(conn, self.prepared))
+        conn.exec_driver_sql.assert_called_once_with(
+            "PREPARE %s AS select $1" % self.prepared.name,
+            execution_options={"no_parameters": True},
+        )
+        conn.begin_nested.assert_called_once()
+
+    def test_new_connection(self):
+        conn = fake_connection()
+        pgprepare.prepare(conn, self.prepared)
+        conn.connection.info = {}
+        pgprepare.prepare(conn, self.prepared)
+        self.assertEqual(2, conn.exec_driver_sql.call_count)
+
+    def test_autocommit(self):
+        conn = fake_connection("AUTOCOMMIT")
+        self.assertTrue(pgprepare.prepare(conn, self.prepared))
+        conn.begin_nested.assert_not_called()
+
+    def test_failure(self):
+        conn = fake_connection()
+        conn.exec_driver_sql.side_effect = DBAPIError("", {}, Exception())
+        self.assertFalse(pgprepare.prepare(conn, self.prepared))
+        self.assertFalse(pgprepare.prepare(conn, self.prepared))
+        conn.exec_driver_sql.assert_called_once()
@@ -1,6 +1,9 @@
+import io
 import os
 from getpass import getuser
-from unittest import TestCase
+from unittest import TestCase, mock
+
+from pg8000.core import CoreConnection
 
 import pugsql
 
@@ -22,6 +25,39 @@ class PostgresqlTest(TestCase):
 
             self.assertEqual("yyy", self.fixtures.get_foo(id=65))
 
+    def test_readonly_statements(self):
+        # pg8000 sends SET and COMMIT statements to switch to AUTOCOMMIT and
+        # back, so read-only statements should run in a transaction, like any
+        # other statement. These are counted where the driver runs them.
+        statements = []
+
+        def counting(method):
+            def run(conn, sql, *args, **kwargs):
+                statements.append(sql)
+                return method(conn, sql, *args, **kwargs)
+
+            return run
+
+        with mock.patch.object(
+            CoreConnection,
+            "execute_unnamed",
+            counting(CoreConnection.execute_unnamed),
+        ), mock.patch.object(
+            CoreConnection,
+            "execute_simple",
+            counting(CoreConnection.execute_simple),
+        ):
+            self.assertTrue(self.fixtures.get_foo.readonly)
+            self.fixtures.get_foo(id=1)
+
+        self.assertFalse([s for s in statements if "isolation" in s.lower()])
+        self.assertLessEqual(len(statements), 3)
+
+    def test_explain(self):
+        plan = self.fixtures.get_foo.explain(id=1)
+        self.assertEqual("postgresql", plan.dialect)
+        self.assertIn("on test", str(plan))
+
     def test_multi_upsert(self):
         self.fixtures.multi_upsert(
             [
@@ -88,3 +124,42 @@ class PostgresqlTest(TestCase):
                 t.rollback()
 
         self.assertEqual("abcd", self.fixtures.get_foo(id=1))
+
+    def test_copy_in(self):
+        n = self.fixtures.copy_in_test.copy_in(
+            (i, "foo%d" % i) for i in range(1000)
+        )
+        self.assertEqual(1000, n)
+        self.assertEqual("foo999", self.fixtures.get_foo(id=999))
+
+    def test_copy_in_transaction(self):
+        with self.fixtures.transaction() as t:
+            self.fixtures.copy_in_test.copy_in([(1, "a\tb"), (2, None)])
+            self.assertEqual("a\tb", self.fixtures.get_foo(id=1))
+            t.rollback()
+        self.assertIsNone(self.fixtures.get_foo(id=1))
+
+    def test_copy_out(self):
+        self.fixtures.upsert_foo(id=1, foo="abcd")
+        fp = io.StringIO()
+        self.assertEqual(1, self.fixtures.copy_out_test.copy_out(fp))
+        self.assertEqual("1\tabcd\n", fp.getvalue())
+
+    def test_prepare(self):
+        self.fixtures.setengine(self.fixtures.engine, prepare=True)
+        self.fixtures.upsert_foo(id=1, foo="abcd")
+        self.assertEqual("abcd", self.fixtures.get_foo(id=1))
+        self.assertEqual("abcd", self.fixtures.get_foo(id=1))
+        self.assertEqual(
+            [{"id": 1, "foo": "abcd"}],
+            list(self.fixtures.where_in(foo=("abcd", "efgh"))),
+        )
+
+        with self.fixtures.connection() as conn:
+            self.fixtures.get_foo(id=1)
+            prepared = conn.connection.info["pugsql_prepared"]
+            self.assertIn(True, prepared.values())
+
+        # new connections prepare the statement again
+        self.fixtures.engine.dispose()
+        self.assertEqual("abcd", self.fixtures.get_foo(id=1))
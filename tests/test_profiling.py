@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+from pugsql import profiling
+
+
+class ProfilerTest(TestCase):
+    def test_sample_rate(self):
+        self.assertIsNone(profiling.Profiler(0).sample())
+        self.assertIsNotNone(profiling.Profiler(1).sample())
+
+    def test_call(self):
+        profiler = profiling.Profiler(1)
+        sample = profiler.sample()
+        sample.mark("convert_params")
+
+        def fn(x):
+            profiling._current.get().mark("execute")
+            return x * 2
+
+        self.assertEqual(4, profiler.call(sample, "foo", fn, 2))
+        self.assertIsNone(profiling._current.get())
+
+        stats = profiler.stats()["foo"]
+        self.assertEqual(1, stats.calls)
+        self.assertEqual(set(profiling.PHASES), set(stats.phases))
+        self.assertEqual(0, stats.phases["checkout"])
+        self.assertAlmostEqual(sum(stats.phases.values()), stats.time)
+
+    def test_call_error(self):
+        profiler = profiling.Profiler(1)
+
+        def fn():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            profiler.call(profiler.sample(), "foo", fn)
+        self.assertEqual({}, profiler.stats())
+
+    def test_format_report(self):
+        phases = dict.fromkeys(profiling.PHASES, 0.0)
+        phases.update(execute=0.003, transform=0.001)
+        report = profiling.format_report(
+            {
+                "slow": profiling.PhaseStats(2, 0.004, phases),
+                "fast": profiling.PhaseStats(1, 0.0, dict(phases)),
+            }
+        )
+        lines = report.splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(
+            ["statement", "calls", "mean", "ms"] + list(profiling.PHASES),
+            lines[0].split(),
+        )
+        self.assertEqual(
+            ["slow", "2", "2.000"] + ["0.0%"] * 4 + ["75.0%", "0.0%", "25.0%"],
+            lines[1].split(),
+        )
+        self.assertTrue(lines[2].startswith("fast"))
@@ -1,10 +1,13 @@
+import io
+import tempfile
 import threading
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import pytest
+from sqlalchemy import create_engine, event, exc, text
 
 import pugsql
-from pugsql import exceptions
+from pugsql import cache, compiler, events, exceptions
 
 
 def test_module():
@@ -32,6 +35,87 @@ class PugsqlTest(TestCase):
             list(self.fixtures.search_users(username="oscar")),
         )
 
+    def test_stream(self):
+        rows = self.fixtures.stream_users(max_id=10)
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(
+            [
+                {"user_id": 1, "username": "mcfunley"},
+                {"user_id": 2, "username": "oscar"},
+                {"user_id": 3, "username": "dottie"},
+            ],
+            list(rows),
+        )
+
+    def test_stream_releases_connection(self):
+        pool = self.fixtures.engine.pool
+        rows = self.fixtures.stream_users(max_id=10)
+        self.assertEqual({"user_id": 1, "username": "mcfunley"}, next(rows))
+        self.assertEqual(1, pool.checkedout())
+        rows.close()
+        self.assertEqual(0, pool.checkedout())
+
+    def test_stream_many_statement(self):
+        self.assertEqual(
+            [{"user_id": 2, "username": "oscar"}],
+            list(self.fixtures.search_users.stream(username="oscar")),
+        )
+
+    def test_stream_in_transaction(self):
+        with self.fixtures.transaction() as t:
+            self.fixtures.insert_user(username="streamed")
+            rows = list(self.fixtures.stream_users(max_id=100))
+            self.assertIn("streamed", {r["username"] for r in rows})
+            t.rollback()
+
+    def test_stream_positional_args_mistake(self):
+        with pytest.raises(
+            exceptions.InvalidArgumentError,
+            match="Pass keyword arguments to statements",
+        ):
+            self.fixtures.stream_users(10)
+
+    def test_one_tuple(self):
+        row = self.fixtures.user_tuple_for_id(user_id=1)
+        self.assertEqual((1, "mcfunley"), tuple(row))
+        self.assertEqual("mcfunley", row.username)
+
+    def test_one_tuple_null(self):
+        self.assertIsNone(self.fixtures.user_tuple_for_id(user_id=4123423))
+
+    def test_many_tuples(self):
+        rows = list(self.fixtures.user_tuples(max_id=10))
+        self.assertEqual(
+            [(1, "mcfunley"), (2, "oscar"), (3, "dottie")],
+            [tuple(r) for r in rows],
+        )
+        self.assertEqual("oscar", rows[1].username)
+
+    def test_stream_tuples(self):
+        rows = list(self.fixtures.user_tuples.stream(max_id=3))
+        self.assertEqual([(1, "mcfunley"), (2, "oscar")], rows)
+
+    def test_columns(self):
+        np = pytest.importorskip("numpy")
+        cols = self.fixtures.user_columns(max_id=10)
+        self.assertEqual(["user_id", "username"], list(cols))
+        self.assertEqual(np.int64, cols["user_id"].dtype)
+        self.assertEqual([1, 2, 3], cols["user_id"].tolist())
+        self.assertEqual(object, cols["username"].dtype)
+        self.assertEqual(
+            ["mcfunley", "oscar", "dottie"], cols["username"].tolist()
+        )
+
+    def test_columns_method(self):
+        pytest.importorskip("numpy")
+        cols = self.fixtures.search_users.columns(username="oscar")
+        self.assertEqual([2], cols["user_id"].tolist())
+
+    def test_columns_empty(self):
+        pytest.importorskip("numpy")
+        cols = self.fixtures.user_columns(max_id=0)
+        self.assertEqual([], cols["user_id"].tolist())
+
     def test_update(self):
         self.assertEqual(
             1, self.fixtures.update_username(user_id=3, username="dottie")
@@ -67,6 +151,51 @@ class PugsqlTest(TestCase):
             list(result),
         )
 
+    def test_compiled_cache(self):
+        stmt = self.fixtures.find_by_usernames
+        stmt(usernames=("oscar",))
+        stmt(usernames=("oscar", "dottie"))
+        info = stmt.compiled_cache_info()
+        self.assertEqual(1, info.misses)
+        self.assertEqual(1, info.hits)
+        self.assertEqual(1, info.currsize)
+
+    def test_compiled_cache_per_shape(self):
+        stmt = self.fixtures.find_by_username_or_id
+        self.assertEqual(
+            [{"user_id": 1, "username": "mcfunley"}],
+            list(stmt(user_id=1, usernames=("nobody",))),
+        )
+        self.assertEqual(
+            [{"user_id": 1, "username": "mcfunley"}],
+            list(stmt(user_id=(1,), usernames=("nobody",))),
+        )
+        self.assertEqual(2, stmt.compiled_cache_info().misses)
+        self.assertFalse(stmt._text._bindparams["usernames"].expanding)
+
+    def test_where_in_concurrent_shapes(self):
+        stmt = self.fixtures.find_by_username_or_id
+        errors = []
+
+        def call(user_id):
+            try:
+                for _ in range(20):
+                    rows = list(stmt(user_id=user_id, usernames=("nobody",)))
+                    assert [1] == [r["user_id"] for r in rows]
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=call, args=(arg,))
+            for arg in [1, (1,), 1, (1,)]
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([], errors)
+
     def test_where_in_multiple_parameters(self):
         result = self.fixtures.find_by_username_or_id(
             user_id=1, usernames=("oscar", "dottie")
@@ -95,6 +224,41 @@ class PugsqlTest(TestCase):
             self.assertEqual("topper", sr[0]["username"])
             t.rollback()
 
+    def test_bulk(self):
+        def users():
+            for i in range(5):
+                yield {"username": "bulk%d" % i}
+
+        with self.fixtures.transaction() as t:
+            n = self.fixtures.insert_user.bulk(users(), batch_size=2)
+            self.assertEqual(5, n)
+            rows = self.fixtures.find_by_usernames(
+                usernames=["bulk%d" % i for i in range(5)]
+            )
+            self.assertEqual(5, len(list(rows)))
+            t.rollback()
+
+    def test_bulk_transaction(self):
+        m = self.memory_module()
+        n = m.insert_user.bulk(
+            ({"username": "bulk%d" % i} for i in range(3)),
+            batch_size=2,
+            transaction=True,
+        )
+        self.assertEqual(3, n)
+        self.assertEqual(
+            ["bulk0", "bulk1", "bulk2"],
+            [r["username"] for r in m.stream_users(max_id=100)],
+        )
+
+    def test_bulk_batch_size(self):
+        with pytest.raises(ValueError, match="batch_size must be at least"):
+            self.fixtures.insert_user.bulk([], batch_size=0)
+
+    def test_copy_not_postgres(self):
+        with pytest.raises(NotImplementedError, match="sqlite3 driver"):
+            self.fixtures.insert_user.copy_in([("x",)])
+
     def test_insert(self):
         with self.fixtures.transaction() as t:
             pk = self.fixtures.insert_user(username="little_pug")
@@ -124,6 +288,115 @@ class PugsqlTest(TestCase):
     def test_null_one(self):
         self.assertIsNone(self.fixtures.user_for_id(user_id=4123423))
 
+    def memory_module(self):
+        m = pugsql.module("tests/sql/fixtures")
+        m.connect("sqlite://")
+        with m.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "create table users (user_id integer primary key "
+                "autoincrement, username text)"
+            )
+        return m
+
+    def test_connection(self):
+        checkouts = []
+        event.listen(
+            self.fixtures.engine, "checkout", lambda *a: checkouts.append(1)
+        )
+        with self.fixtures.connection() as conn:
+            self.assertEqual(
+                "mcfunley", self.fixtures.username_for_id(user_id=1)
+            )
+            self.assertEqual(
+                [{"user_id": 2, "username": "oscar"}],
+                list(self.fixtures.search_users(username="oscar")),
+            )
+            self.assertEqual(
+                ["mcfunley"],
+                [r["username"] for r in self.fixtures.stream_users(max_id=2)],
+            )
+            self.assertIs(conn, self.fixtures._locals.connection)
+        self.assertEqual(1, len(checkouts))
+        self.assertIsNone(self.fixtures._locals.connection)
+
+    def test_connection_commits(self):
+        m = self.memory_module()
+        with m.connection():
+            m.insert_user(username="pinned")
+        self.assertEqual(1, len(list(m.stream_users(max_id=100))))
+
+    def test_connection_rollback(self):
+        class FooException(RuntimeError):
+            pass
+
+        with pytest.raises(FooException):
+            with self.fixtures.connection():
+                self.fixtures.update_username(user_id=1, username="foo")
+                raise FooException()
+
+        self.assertEqual("mcfunley", self.fixtures.username_for_id(user_id=1))
+
+    def test_connection_autocommit(self):
+        m = self.memory_module()
+        with pytest.raises(RuntimeError):
+            with m.connection(autocommit=True):
+                m.insert_user(username="pinned")
+                raise RuntimeError()
+        self.assertEqual(1, len(list(m.stream_users(max_id=100))))
+
+    def test_connection_nested(self):
+        with self.fixtures.connection() as outer:
+            with self.fixtures.connection() as inner:
+                self.assertIs(outer, inner)
+
+    def test_transaction_in_connection(self):
+        m = self.memory_module()
+        with m.connection() as conn:
+            with m.transaction() as t:
+                m.insert_user(username="pinned")
+                self.assertIs(conn, t.connection())
+        self.assertEqual(1, len(list(m.stream_users(max_id=100))))
+
+    def test_readonly_sqlite_keeps_isolation_level(self):
+        m = self.memory_module()
+        m.insert_user(username="oscar")
+        dialect = m.engine.dialect
+
+        with mock.patch.object(
+            dialect,
+            "set_isolation_level",
+            wraps=dialect.set_isolation_level,
+        ) as set_isolation_level:
+            self.assertTrue(m.username_for_id.readonly)
+            self.assertEqual("oscar", m.username_for_id(user_id=1))
+
+        set_isolation_level.assert_not_called()
+
+    def test_autocommit_drivers(self):
+        def helps(url):
+            dialect = create_engine(url).dialect
+            return compiler._autocommit_helps(mock.Mock(dialect=dialect))
+
+        self.assertTrue(helps("postgresql+psycopg2://localhost/db"))
+        self.assertTrue(helps("postgresql+psycopg://localhost/db"))
+        self.assertFalse(helps("postgresql+pg8000://localhost/db"))
+        self.assertFalse(helps("sqlite://"))
+
+    def test_lazy_module(self):
+        m = pugsql.module("tests/sql/fixtures", lazy=True)
+        m.connect("sqlite:///./tests/data/fixtures.sqlite3")
+        self.assertEqual("mcfunley", m.username_for_id(user_id=1))
+
+    def test_prepare_requires_postgres(self):
+        with pytest.raises(ValueError, match="only supported for PostgreSQL"):
+            self.fixtures.setengine(self.fixtures.engine, prepare=True)
+
+    def test_connection_not_connected(self):
+        fixtures = pugsql.module("tests/sql/fixtures")
+        with pytest.raises(exceptions.NoConnectionError):
+            with fixtures.connection():
+                pass
+
     def test_rolling_back_transaction(self):
         class FooException(RuntimeError):
             pass
@@ -194,6 +467,10 @@ class PugsqlTest(TestCase):
                 self.fixtures.username_for_id,
                 self.fixtures.find_date,
                 self.fixtures.delete_by_usernames,
+                self.fixtures.stream_users,
+                self.fixtures.user_tuple_for_id,
+                self.fixtures.user_tuples,
+                self.fixtures.user_columns,
             },
             set(q for q in self.fixtures),
         )
@@ -276,3 +553,649 @@ class PugsqlTest(TestCase):
             }
             self.assertEqual(users, {"scratch1"})
             outer.rollback()
+
+
+class ResultCacheTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.m = pugsql.module("tests/sql/cache")
+        self.m.connect("sqlite:///%s/cache.sqlite3" % self.tmp.name)
+        with self.m.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "create table users (user_id integer primary key "
+                "autoincrement, username text)"
+            )
+        self.m.add_user(username="mcfunley")
+        self.m.add_user(username="oscar")
+
+        self.executed = []
+        event.listen(
+            self.m.engine,
+            "before_cursor_execute",
+            lambda conn, cursor, sql, *a: self.executed.append(sql),
+        )
+
+    def tearDown(self):
+        self.m.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_hit(self):
+        self.assertEqual("oscar", self.m.cached_username(user_id=2))
+        self.assertEqual("oscar", self.m.cached_username(user_id=2))
+        self.assertEqual(1, len(self.executed))
+        self.assertEqual(
+            cache.CacheInfo(1, 1, 0, 1), self.m.cached_username.cache_info()
+        )
+
+    def test_keyed_by_params(self):
+        self.assertEqual("mcfunley", self.m.cached_username(user_id=1))
+        self.assertEqual("oscar", self.m.cached_username(user_id=2))
+        self.assertEqual(2, len(self.executed))
+
+    def test_rows_not_shared(self):
+        rows = list(self.m.cached_users())
+        rows[0]["username"] = "changed"
+        self.assertEqual(
+            ["mcfunley", "oscar"],
+            [r["username"] for r in self.m.cached_users()],
+        )
+        self.assertEqual(1, len(self.executed))
+
+    def test_invalidates(self):
+        self.m.cached_username(user_id=2)
+        self.m.cached_users()
+        self.m.rename_user(user_id=2, username="ozzy")
+        self.assertEqual("ozzy", self.m.cached_username(user_id=2))
+        self.assertEqual(0, self.m.cached_users.cache_info().currsize)
+
+    def test_invalidate(self):
+        self.assertEqual(2, len(list(self.m.cached_users())))
+        self.m.add_user(username="dottie")
+        self.assertEqual(2, len(list(self.m.cached_users())))
+        self.m.invalidate("all")
+        self.assertEqual(3, len(list(self.m.cached_users())))
+
+    def test_bypassed_in_transaction(self):
+        with self.m.transaction():
+            self.m.cached_username(user_id=2)
+            self.m.cached_username(user_id=2)
+        self.assertEqual(2, len(self.executed))
+        self.assertEqual(0, self.m.cached_username.cache_info().currsize)
+
+    def test_invalidates_after_commit(self):
+        def read():
+            self.m.cached_username(user_id=2)
+
+        with self.m.transaction():
+            self.m.rename_user(user_id=2, username="ozzy")
+            t = threading.Thread(target=read)
+            t.start()
+            t.join()
+            self.assertEqual(1, self.m.cached_username.cache_info().currsize)
+
+        self.assertEqual("ozzy", self.m.cached_username(user_id=2))
+
+    def test_uncached(self):
+        self.assertIsNone(self.m.add_user.cache_info())
+
+
+class ParseCacheTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_loads_from_cache(self):
+        first = pugsql.module("tests/sql/fixtures", cache_dir=self.tmp.name)
+        with mock.patch(
+            "pugsql.parser.statement_args", side_effect=AssertionError
+        ):
+            second = pugsql.module(
+                "tests/sql/fixtures", cache_dir=self.tmp.name
+            )
+
+        self.assertEqual(
+            [(s.name, s.sql, s.result.display_type) for s in first],
+            [(s.name, s.sql, s.result.display_type) for s in second],
+        )
+        self.assertEqual(first.user_tuples.line, second.user_tuples.line)
+        second.connect("sqlite:///./tests/data/fixtures.sqlite3")
+        self.assertEqual("mcfunley", second.username_for_id(user_id=1))
+
+
+class Recorder(events.Listener):
+    def __init__(self):
+        self.before = []
+        self.after = []
+
+    def before_execute(self, execution):
+        self.before.append(execution.statement.name)
+
+    def after_execute(self, execution):
+        self.after.append(execution)
+
+
+class ListenerTest(TestCase):
+    def setUp(self):
+        self.m = pugsql.module("tests/sql/fixtures")
+        self.m.connect("sqlite://")
+        with self.m.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "create table users (user_id integer primary key "
+                "autoincrement, username text)"
+            )
+        self.recorder = Recorder()
+        self.m.add_listener(self.recorder)
+
+    def test_call(self):
+        self.m.insert_user(username="oscar")
+        self.m.insert_user(username="dottie")
+        self.assertEqual(2, len(list(self.m.user_tuples(max_id=10))))
+
+        self.assertEqual(
+            ["insert_user", "insert_user", "user_tuples"], self.recorder.before
+        )
+        execution = self.recorder.after[2]
+        self.assertIs(self.m.user_tuples, execution.statement)
+        self.assertEqual({"max_id": 10}, execution.params)
+        self.assertEqual(2, execution.rows)
+        self.assertIsNone(execution.rowcount)
+        self.assertIsNone(execution.error)
+        self.assertGreaterEqual(execution.elapsed, execution.execute_time)
+        self.assertGreaterEqual(execution.fetch_time, 0)
+
+    def test_rowcount(self):
+        self.m.insert_user(username="oscar")
+        self.m.update_username(user_id=1, username="dottie")
+        execution = self.recorder.after[-1]
+        self.assertEqual(1, execution.rowcount)
+        self.assertIsNone(execution.rows)
+
+    def test_error(self):
+        with pytest.raises(Exception):
+            self.m.find_date(id=1)
+        execution = self.recorder.after[0]
+        self.assertIsNotNone(execution.error)
+        self.assertIsNone(execution.execute_time)
+        self.assertIsNone(execution.fetch_time)
+
+    def test_stream(self):
+        self.m.insert_user.bulk({"username": u} for u in ["a", "b", "c"])
+        self.assertEqual(3, self.recorder.after[0].rowcount)
+
+        stream = self.m.stream_users(max_id=10)
+        next(stream)
+        self.assertEqual(1, len(self.recorder.after))
+        stream.close()
+        execution = self.recorder.after[1]
+        self.assertEqual(1, execution.rows)
+        self.assertIsNone(execution.error)
+
+    def test_remove_listener(self):
+        self.m.remove_listener(self.recorder)
+        self.m.insert_user(username="oscar")
+        self.assertEqual([], self.recorder.after)
+
+    def test_metrics(self):
+        self.assertEqual({}, self.m.stats())
+        registry = self.m.enable_metrics()
+        self.assertIs(registry, self.m.enable_metrics())
+
+        self.m.insert_user(username="oscar")
+        self.m.insert_user(username="dottie")
+        self.assertEqual(2, len(list(self.m.user_tuples(max_id=10))))
+        with pytest.raises(Exception):
+            self.m.find_date(id=1)
+
+        stats = self.m.stats()
+        self.assertEqual(
+            {"insert_user", "user_tuples", "find_date"}, set(stats)
+        )
+        self.assertEqual(2, stats["insert_user"].calls)
+        self.assertEqual(2, stats["insert_user"].rowcount)
+        self.assertEqual(2, stats["user_tuples"].rows)
+        self.assertEqual(1, stats["find_date"].errors)
+        self.assertEqual(2, stats["insert_user"].histogram[-1][1])
+
+    def test_log_slow_queries(self):
+        self.m.log_slow_queries(threshold=0)
+        with self.assertLogs("pugsql.slow") as logs:
+            self.m.find_by_usernames(usernames=["oscar", "dottie"])
+        self.assertIn(
+            "slow query find_by_usernames "
+            "(tests/sql/fixtures/find_by_usernames.sql:1)",
+            logs.output[0],
+        )
+        self.assertIn("params {usernames=tuple[2]}", logs.output[0])
+
+        # calling it again replaces the listener
+        self.m.log_slow_queries(threshold=10)
+        self.assertEqual(2, len(self.m._listeners))
+
+    def test_profiling(self):
+        profiler = self.m.enable_profiling(sample_rate=1)
+        self.assertIs(profiler, self.m.enable_profiling(sample_rate=0.5))
+        self.assertEqual(0.5, profiler.sample_rate)
+        profiler.sample_rate = 1
+
+        self.m.insert_user(username="oscar")
+        with self.m.transaction():
+            self.m.user_for_id(user_id=1)
+
+        stats = profiler.stats()
+        insert = stats["insert_user"].phases
+        for phase in ["checkout", "compile", "execute", "commit"]:
+            self.assertGreater(insert[phase], 0)
+        # connections in a transaction are returned when it ends
+        self.assertEqual(0, stats["user_for_id"].phases["commit"])
+
+        out = io.StringIO()
+        profiler.report(file=out)
+        self.assertIn("insert_user", out.getvalue())
+
+
+class ExplainTest(TestCase):
+    def setUp(self):
+        self.m = pugsql.module("tests/sql/fixtures")
+        self.m.connect("sqlite://")
+        with self.m.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "create table users (user_id integer primary key "
+                "autoincrement, username text)"
+            )
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_explain(self):
+        plan = self.m.user_for_id.explain(user_id=1)
+        self.assertEqual(
+            ["SEARCH users USING INTEGER PRIMARY KEY (rowid=?)"],
+            plan.lines(),
+        )
+        self.assertEqual([], plan.scans())
+
+    def test_explain_in_list(self):
+        plan = self.m.find_by_usernames.explain(usernames=["oscar", "dottie"])
+        self.assertEqual(["users"], plan.scans())
+        self.assertEqual(1, len(self.m.find_by_usernames._explains))
+
+    def test_explain_does_not_execute(self):
+        self.m.insert_user.explain(username="oscar")
+        self.assertEqual(0, len(list(self.m.user_tuples(max_id=10))))
+
+    def test_capture_plans(self):
+        capture = self.m.capture_plans(threshold=0)
+        with self.assertLogs("pugsql.plans") as logs:
+            self.m.user_for_id(user_id=1)
+        self.assertIn("plan for user_for_id", logs.output[0])
+        self.assertIn("SEARCH users", logs.output[0])
+        captured = capture.captured[0]
+        self.assertIs(self.m.user_for_id, captured.statement)
+        self.assertEqual({"user_id": 1}, captured.params)
+
+        # calling it again replaces the listener
+        capture = self.m.capture_plans(threshold=10)
+        self.m.user_for_id(user_id=1)
+        self.assertEqual(1, len(self.m._listeners))
+        self.assertEqual(0, len(capture.captured))
+
+    def test_capture_plans_failure_in_transaction(self):
+        def explain(**params):
+            self.m._executor().execute(text("select * from missing"))
+
+        savepoints = []
+        for name in ("savepoint", "rollback_savepoint"):
+            event.listen(
+                self.m.engine,
+                name,
+                lambda conn, sp, *a, name=name: savepoints.append(name),
+            )
+
+        self.m.capture_plans(threshold=0)
+        with mock.patch.object(self.m.insert_user, "explain", explain):
+            with self.assertLogs("pugsql.plans", "ERROR"):
+                with self.m.transaction():
+                    self.m.insert_user(username="oscar")
+                    self.m.insert_user(username="dottie")
+
+        self.assertEqual(
+            ["savepoint", "rollback_savepoint"] * 2, savepoints
+        )
+        self.assertEqual("dottie", self.m.username_for_id(user_id=2))
+
+    def test_check(self):
+        path = self.tmp.name + "/plans.json"
+        params = {"find_by_usernames": {"usernames": ["oscar"]}}
+        self.assertEqual([], pugsql.explain.check(self.m, path, params))
+        self.assertEqual([], pugsql.explain.check(self.m, path, params))
+
+        with self.m.engine.begin() as conn:
+            conn.exec_driver_sql("create index ix on users (username)")
+        differences = pugsql.explain.check(self.m, path, params)
+        self.assertIn("--- a/find_by_usernames", differences)
+        self.assertIn("-SCAN users", differences)
+
+        pugsql.explain.check(self.m, path, params, update=True)
+        self.assertEqual([], pugsql.explain.check(self.m, path, params))
+
+    def test_snapshot_errors(self):
+        plans = pugsql.explain.snapshot(self.m)
+        self.assertTrue(plans["find_by_usernames"][0].startswith("error: "))
+
+
+class ReplicaTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.urls = {}
+        for name in ["primary", "replica"]:
+            url = "sqlite:///%s/%s.db" % (self.tmp.name, name)
+            engine = create_engine(url)
+            with engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "create table users (user_id integer primary key "
+                    "autoincrement, username text)"
+                )
+                conn.exec_driver_sql(
+                    "insert into users (username) values ('%s')" % name
+                )
+            engine.dispose()
+            self.urls[name] = url
+
+        self.m = pugsql.module("tests/sql/fixtures")
+        self.m.connect(self.urls["primary"], replicas=[self.urls["replica"]])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual("replica", self.m.username_for_id(user_id=1))
+        self.assertEqual(
+            ["replica"],
+            [r["username"] for r in self.m.stream_users(max_id=10)],
+        )
+
+    def test_writes_go_to_primary(self):
+        self.m.update_username(user_id=1, username="updated")
+        with self.m.transaction():
+            self.assertEqual("updated", self.m.username_for_id(user_id=1))
+        self.assertEqual("replica", self.m.username_for_id(user_id=1))
+
+    def test_pinned_connection_uses_primary(self):
+        with self.m.connection():
+            self.assertEqual("primary", self.m.username_for_id(user_id=1))
+
+    def test_failed_replica(self):
+        self.m.connect(
+            self.urls["primary"],
+            replicas=["sqlite:///%s/missing/replica.db" % self.tmp.name],
+        )
+        with self.assertLogs("pugsql.replicas"):
+            self.assertEqual("primary", self.m.username_for_id(user_id=1))
+        self.assertFalse(self.m.replicas.health()[0].healthy)
+        self.assertEqual("primary", self.m.username_for_id(user_id=1))
+
+    def test_failed_replica_stream(self):
+        self.m.connect(
+            self.urls["primary"],
+            replicas=["sqlite:///%s/missing/replica.db" % self.tmp.name],
+        )
+        with self.assertLogs("pugsql.replicas"):
+            rows = self.m.stream_users(max_id=10)
+            self.assertEqual(["primary"], [r["username"] for r in rows])
+        self.assertFalse(self.m.replicas.health()[0].healthy)
+        self.assertEqual(0, self.m.replicas.health()[0].in_use)
+        self.assertEqual(
+            ["primary"], list(self.m.user_columns(max_id=10)["username"])
+        )
+
+    def test_query_error_on_replica(self):
+        with self.m.engine.begin() as conn:
+            conn.exec_driver_sql("drop table users")
+        self.m.connect(self.urls["replica"], replicas=[self.urls["primary"]])
+        with pytest.raises(exc.OperationalError, match="no such table"):
+            self.m.username_for_id(user_id=1)
+        self.assertTrue(self.m.replicas.health()[0].healthy)
+
+    def test_least_connections(self):
+        self.m.connect(
+            self.urls["primary"],
+            replicas=[self.urls["replica"]],
+            balance="least_connections",
+        )
+        self.assertEqual("least_connections", self.m.replicas.balance)
+        self.assertEqual("replica", self.m.username_for_id(user_id=1))
+
+    def test_no_replicas(self):
+        self.m.connect(self.urls["primary"])
+        self.assertIsNone(self.m.replicas)
+        self.assertEqual("primary", self.m.username_for_id(user_id=1))
+
+        self.m.connect(self.urls["primary"], replicas=[self.urls["replica"]])
+        self.m.disconnect()
+        self.assertIsNone(self.m.replicas)
+
+
+class ShardTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.m = pugsql.module("tests/sql/shards")
+        self.m.connect_shards(
+            ["sqlite:///%s/shard%d.db" % (self.tmp.name, i) for i in range(2)]
+        )
+        for engine in self.m.shards.engines:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "create table orders (order_id integer primary key, "
+                    "customer_id integer, item text)"
+                )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def shard_items(self, i):
+        with self.m.shards.engines[i].connect() as conn:
+            return [
+                r[0]
+                for r in conn.exec_driver_sql(
+                    "select item from orders order by order_id"
+                )
+            ]
+
+    def test_routes_by_key(self):
+        self.m.add_order(customer_id=1, item="a")
+        self.m.add_order(customer_id=2, item="b")
+        self.m.add_order(customer_id=3, item="c")
+        self.assertEqual(["b"], self.shard_items(0))
+        self.assertEqual(["a", "c"], self.shard_items(1))
+
+        orders = self.m.orders_for_customer(customer_id=3)
+        self.assertEqual(["c"], [o["item"] for o in orders])
+        self.assertEqual(
+            ["b"], [o["item"] for o in self.m.stream_orders(customer_id=2)]
+        )
+
+    def test_shared_compiled_sql(self):
+        self.m.orders_for_customer(customer_id=1)
+        self.m.orders_for_customer(customer_id=2)
+        self.assertEqual(1, len(self.m.orders_for_customer._shapes))
+
+    def test_shard_for(self):
+        self.m.setshards(self.m.shards.engines, lambda key, n: 0)
+        self.m.add_order(customer_id=1, item="a")
+        self.assertEqual(["a"], self.shard_items(0))
+
+    def test_missing_key(self):
+        with pytest.raises(exceptions.InvalidArgumentError, match="shard key"):
+            self.m.orders_for_customer(item="a")
+
+    def test_unsharded_statement(self):
+        with pytest.raises(exceptions.NoConnectionError):
+            self.m.all_orders()
+        self.m.connect("sqlite:///%s/shard0.db" % self.tmp.name)
+        self.m.add_order(customer_id=2, item="b")
+        self.assertEqual(["b"], [o["item"] for o in self.m.all_orders()])
+
+    def test_bulk(self):
+        rows = [{"customer_id": i, "item": str(i)} for i in range(5)]
+        self.assertEqual(5, self.m.add_order.bulk(rows, batch_size=4))
+        self.assertEqual(["0", "2", "4"], self.shard_items(0))
+        self.assertEqual(["1", "3"], self.shard_items(1))
+
+    def test_multiple_rows_for_different_shards(self):
+        with pytest.raises(exceptions.InvalidArgumentError, match="more than"):
+            self.m.add_order(
+                {"customer_id": 1, "item": "a"},
+                {"customer_id": 2, "item": "b"},
+            )
+
+    def test_transaction(self):
+        with pytest.raises(RuntimeError):
+            with self.m.transaction(shard=1):
+                self.m.add_order(customer_id=1, item="a")
+                self.m.add_order(customer_id=3, item="c")
+                orders = self.m.orders_for_customer(customer_id=3)
+                self.assertEqual(["c"], [o["item"] for o in orders])
+                raise RuntimeError()
+        self.assertEqual([], self.shard_items(1))
+
+        with self.m.transaction(shard=1):
+            with pytest.raises(ValueError, match="isn't on shard 0"):
+                self.m.add_order(customer_id=2, item="b")
+
+    def test_connection(self):
+        with self.m.connection(shard=2):
+            self.m.add_order(customer_id=2, item="b")
+            with pytest.raises(ValueError):
+                self.m.add_order(customer_id=1, item="a")
+        self.assertEqual(["b"], self.shard_items(0))
+
+    def test_scatter(self):
+        for i in range(6):
+            self.m.add_order(customer_id=i, item="item%d" % i)
+        rows = self.m.orders_since.scatter(since="item1")
+        self.assertEqual(
+            ["item%d" % i for i in range(1, 6)],
+            sorted(r["item"] for r in rows),
+        )
+        self.assertEqual({0: 2, 1: 3}, rows.counts)
+        self.assertEqual({}, rows.errors)
+
+    def test_scatter_order_by(self):
+        for i in range(6):
+            self.m.add_order(customer_id=i, item="item%d" % i)
+        rows = self.m.orders_since.scatter(order_by="item", since="item1")
+        self.assertEqual(
+            ["item%d" % i for i in range(1, 6)], [r["item"] for r in rows]
+        )
+
+    def test_scatter_errors(self):
+        self.m.add_order(customer_id=1, item="a")
+        engines = {
+            "good": self.m.shards.engines[1],
+            "bad": create_engine("sqlite:///%s/none/x.db" % self.tmp.name),
+        }
+        rows = self.m.orders_since.scatter(engines, since="")
+        self.assertEqual(["a"], [r["item"] for r in rows])
+        self.assertEqual(["bad"], list(rows.errors))
+        self.assertIsInstance(
+            rows.errors["bad"], exc.OperationalError
+        )
+
+    def test_scatter_unsharded_module(self):
+        m = pugsql.module("tests/sql/shards")
+        m.connect("sqlite:///%s/shard0.db" % self.tmp.name)
+        with pytest.raises(exceptions.NoConnectionError):
+            m.orders_since.scatter(since="")
+
+    def test_unsharded_module(self):
+        m = pugsql.module("tests/sql/shards")
+        m.connect("sqlite:///%s/shard0.db" % self.tmp.name)
+        m.add_order(customer_id=1, item="a")
+        self.assertEqual(["a"], self.shard_items(0))
+        with pytest.raises(exceptions.NoConnectionError):
+            with m.transaction(shard=1):
+                pass
+
+
+class PaginateTest(TestCase):
+    def setUp(self):
+        self.m = pugsql.module("tests/sql/fixtures")
+        self.m.connect("sqlite://")
+        with self.m.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "create table users (user_id integer primary key "
+                "autoincrement, username text)"
+            )
+        for name in ["oscar", "dottie", "mcfunley", "ruby", "ada"]:
+            self.m.insert_user(username=name)
+        self.recorder = Recorder()
+        self.m.add_listener(self.recorder)
+
+    def test_pages(self):
+        rows = self.m.stream_users.paginate("user_id", 2, max_id=10)
+        self.assertEqual([1, 2, 3, 4, 5], [r["user_id"] for r in rows])
+        self.assertEqual(3, len(self.recorder.after))
+        self.assertEqual(
+            [None, 2, 4],
+            [e.params.get("pugsql_after0") for e in self.recorder.after],
+        )
+        self.assertEqual([2, 2, 1], [e.rows for e in self.recorder.after])
+
+    def test_last_page_full(self):
+        rows = self.m.stream_users.paginate("user_id", page_size=1, max_id=4)
+        self.assertEqual([1, 2, 3], [r["user_id"] for r in rows])
+        self.assertEqual(4, len(self.recorder.after))
+
+    def test_lazy(self):
+        rows = self.m.stream_users.paginate("user_id", page_size=2, max_id=9)
+        self.assertEqual([], self.recorder.after)
+        next(rows)
+        self.assertEqual(1, len(self.recorder.after))
+
+    def test_tuples(self):
+        rows = list(self.m.user_tuples.paginate("user_id", 2, max_id=10))
+        self.assertEqual(("ada", 5), (rows[-1].username, rows[-1].user_id))
+
+    def test_in_list(self):
+        rows = self.m.find_by_usernames.paginate(
+            "user_id", 1, usernames=["ruby", "oscar", "nobody"]
+        )
+        self.assertEqual(["oscar", "ruby"], [r["username"] for r in rows])
+
+    def test_composite_key(self):
+        rows = self.m.stream_users.paginate(
+            ("username", "user_id"), 2, max_id=10
+        )
+        self.assertEqual(
+            ["ada", "dottie", "mcfunley", "oscar", "ruby"],
+            [r["username"] for r in rows],
+        )
+
+    def test_uses_index(self):
+        list(self.m.stream_users.paginate("user_id", 2, max_id=10))
+        shape = self.m.stream_users._keysets[
+            ("sqlite", ("user_id",), True, frozenset())
+        ]
+        with self.m.engine.connect() as conn:
+            plan = conn.exec_driver_sql(
+                "explain query plan %s" % shape.clause,
+                {"max_id": 10, "pugsql_after0": 2, "pugsql_page_size": 2},
+            ).fetchall()
+        self.assertNotIn("SCAN", " ".join(row[-1] for row in plan))
+
+    def test_trailing_comments(self):
+        self.m.add_queries("tests/sql/paginate")
+        rows = list(self.m.commented_users.paginate("user_id", 2, max_id=4))
+        self.assertEqual([1, 2, 3, 4], [r["user_id"] for r in rows])
+        self.assertEqual({"--"}, {r["dashes"] for r in rows})
+
+    def test_key_not_in_results(self):
+        with pytest.raises(exceptions.InvalidArgumentError, match="USER_ID"):
+            list(self.m.stream_users.paginate("USER_ID", 1, max_id=10))
+
+    def test_page_size(self):
+        with pytest.raises(ValueError):
+            self.m.stream_users.paginate(page_size=0, max_id=10)
@@ -0,0 +1,93 @@
+import threading
+import time
+from unittest import TestCase
+
+import pytest
+
+from pugsql import scatter
+
+
+def rows_of(engines):
+    # an "engine" is a list of rows, or an exception to raise after them.
+    def fetch(engine):
+        for row in engine:
+            if isinstance(row, Exception):
+                raise row
+            yield row
+
+    return fetch
+
+
+class ScatterTest(TestCase):
+    def test_unordered(self):
+        engines = [[{"id": 1}, {"id": 4}], [], [{"id": 2}]]
+        s = scatter.Scatter(engines, rows_of(engines))
+        self.assertEqual([1, 2, 4], sorted(r["id"] for r in s))
+        self.assertEqual({0: 2, 1: 0, 2: 1}, s.counts)
+        self.assertEqual({}, s.errors)
+
+    def test_order_by(self):
+        engines = [
+            [{"id": i} for i in range(0, 3000, 3)],
+            [{"id": i} for i in range(1, 3000, 3)],
+            [{"id": i} for i in range(2, 3000, 3)],
+        ]
+        for workers in (1, 2, 8):
+            s = scatter.Scatter(
+                engines, rows_of(engines), workers, order_by="id"
+            )
+            self.assertEqual(list(range(3000)), [r["id"] for r in s])
+
+    def test_order_by_function(self):
+        engines = [[3, 1], [2, 0]]
+        s = scatter.Scatter(engines, rows_of(engines), order_by=lambda r: -r)
+        self.assertEqual([3, 2, 1, 0], list(s))
+
+    def test_errors_keep_rows(self):
+        error = ValueError("down")
+        engines = {"a": [1, 2, error], "b": [3]}
+        s = scatter.Scatter(engines, rows_of(engines))
+        self.assertEqual([1, 2, 3], sorted(s))
+        self.assertEqual({"a": error}, s.errors)
+        self.assertEqual({"a": 2, "b": 1}, s.counts)
+
+    def test_stops_workers(self):
+        closed = threading.Event()
+
+        def fetch(engine):
+            try:
+                while True:
+                    yield 1
+            finally:
+                closed.set()
+
+        s = scatter.Scatter([None], fetch)
+        for row in s:
+            break
+        self.assertTrue(closed.wait(5))
+
+    def test_bounded(self):
+        read = [0]
+
+        def fetch(engine):
+            while True:
+                read[0] += 1
+                yield 1
+
+        rows = iter(scatter.Scatter([None], fetch))
+        next(rows)
+        time.sleep(0.2)
+        rows.close()
+        # the chunk being read, the queued chunks, and one waiting to be queued
+        bound = scatter._chunk_size * (scatter._chunks_per_engine + 2)
+        self.assertLessEqual(read[0], bound)
+
+    def test_iterate_once(self):
+        s = scatter.Scatter([], rows_of([]))
+        self.assertEqual([], list(s))
+        with pytest.raises(RuntimeError):
+            iter(s)
+
+    def test_workers(self):
+        with pytest.raises(ValueError):
+            scatter.Scatter([], rows_of([]), workers=0)
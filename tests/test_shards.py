@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+import pytest
+
+from pugsql import shards
+
+
+class HashKeyTest(TestCase):
+    def test_integers(self):
+        keys = [shards.hash_key(k, 3) for k in range(4)]
+        self.assertEqual([0, 1, 2, 0], keys)
+        self.assertEqual(2, shards.hash_key(-1, 3))
+
+    def test_strings_are_stable(self):
+        # CRC-32, unlike hash(), doesn't change between processes.
+        self.assertEqual(14, shards.hash_key("acme", 16))
+
+
+class ShardSetTest(TestCase):
+    def test_index(self):
+        s = shards.ShardSet(["a", "b"])
+        self.assertEqual(1, s.index(3))
+        self.assertEqual(2, len(s))
+
+    def test_shard_for(self):
+        s = shards.ShardSet(["a", "b"], lambda key, n: 0 if key < 100 else 1)
+        self.assertEqual([0, 1], [s.index(99), s.index(100)])
+
+    def test_invalid_index(self):
+        s = shards.ShardSet(["a", "b"], lambda key, n: n)
+        with pytest.raises(ValueError, match="returned 2 for key 1"):
+            s.index(1)
+
+    def test_none(self):
+        with pytest.raises(ValueError, match="can't be None"):
+            shards.ShardSet(["a"]).index(None)
+
+    def test_no_engines(self):
+        with pytest.raises(ValueError):
+            shards.ShardSet([])
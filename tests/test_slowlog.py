@@ -0,0 +1,90 @@
+import logging
+from types import SimpleNamespace
+from unittest import TestCase
+
+from pugsql import slowlog
+
+
+def execution(**kwargs):
+    args = dict(
+        statement=SimpleNamespace(
+            name="find_users", filename="sql/users.sql", line=12
+        ),
+        multiparams=[],
+        params={"ids": (1, 2, 3), "name": "oscar", "since": None},
+        elapsed=2.5,
+        execute_time=2.0,
+        fetch_time=0.5,
+        rows=20,
+        rowcount=None,
+        error=None,
+    )
+    args.update(kwargs)
+    return SimpleNamespace(**args)
+
+
+class ShapeTest(TestCase):
+    def test_shape(self):
+        self.assertEqual("int", slowlog.shape(1))
+        self.assertEqual("None", slowlog.shape(None))
+        self.assertEqual("tuple[3]", slowlog.shape((1, 2, 3)))
+        self.assertEqual("list[0]", slowlog.shape([]))
+
+
+class SlowQueryLogTest(TestCase):
+    def setUp(self):
+        self.log = slowlog.SlowQueryLog(1.0)
+
+    def test_format(self):
+        self.assertEqual(
+            "slow query find_users (sql/users.sql:12) took 2.500s (execute "
+            "2.000s, fetch 0.500s), 20 rows, params {ids=tuple[3], name=str, "
+            "since=None}",
+            self.log.format(execution()),
+        )
+
+    def test_format_params(self):
+        log = slowlog.SlowQueryLog(1.0, params=True)
+        self.assertIn(
+            "params {ids=(1, 2, 3), name='oscar', since=None}",
+            log.format(execution()),
+        )
+
+    def test_format_error(self):
+        self.assertEqual(
+            "slow query find_users took 2.500s and failed with "
+            "OperationalError, params {}",
+            self.log.format(
+                execution(
+                    statement=SimpleNamespace(
+                        name="find_users", filename=None, line=None
+                    ),
+                    params={},
+                    execute_time=None,
+                    rows=None,
+                    error=type("OperationalError", (Exception,), {})(),
+                )
+            ),
+        )
+
+    def test_format_multiparams(self):
+        self.assertEqual(
+            "slow query find_users (sql/users.sql:12) took 2.500s (execute "
+            "2.000s, fetch 0.500s), 2 rows affected, 2 sets of params like "
+            "{username=str}",
+            self.log.format(
+                execution(
+                    multiparams=[{"username": "a"}, {"username": "b"}],
+                    params={},
+                    rows=None,
+                    rowcount=2,
+                )
+            ),
+        )
+
+    def test_threshold(self):
+        with self.assertLogs("pugsql.slow", logging.WARNING) as logs:
+            self.log.after_execute(execution(elapsed=0.5))
+            self.log.after_execute(execution(elapsed=1.0))
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual(1.0, logs.records[0].execution.elapsed)
@@ -1,10 +1,11 @@
 from unittest import TestCase
-from unittest.mock import Mock
+from unittest.mock import MagicMock, Mock
 
 import pytest
+import sqlalchemy
 
-from pugsql import parser
-from pugsql.statement import Raw, Statement
+from pugsql import exceptions, parser
+from pugsql.statement import Affected, Raw, Statement, _ColumnBuilder
 
 
 def test_raw():
@@ -59,6 +60,111 @@ class StatementTest(TestCase):
         self.assertEqual("path/foobar.sql", s.filename)
 
 
+class BulkTest(TestCase):
+    def setUp(self):
+        self.executed = []
+        self.consumed = 0
+        self.module = Mock(
+            is_async=False, transaction=MagicMock(), _listeners=()
+        )
+        self.module._execute.side_effect = self.execute
+        self.stmt = Statement(
+            "foo", "insert into t values (:x)", "", Affected()
+        )
+        self.stmt.set_module(self.module)
+
+    def execute(self, clause, multiparams, params, options, shard=None):
+        self.executed.append((self.consumed, multiparams[0]))
+        return Mock(rowcount=len(multiparams[0]))
+
+    def rows(self, n):
+        for i in range(n):
+            self.consumed += 1
+            yield {"x": i}
+
+    def test_batches(self):
+        self.assertEqual(5, self.stmt.bulk(self.rows(5), batch_size=2))
+        self.assertEqual(
+            [
+                (2, [{"x": 0}, {"x": 1}]),
+                (4, [{"x": 2}, {"x": 3}]),
+                (5, [{"x": 4}]),
+            ],
+            self.executed,
+        )
+
+    def test_empty(self):
+        self.assertEqual(0, self.stmt.bulk(iter([])))
+        self.assertEqual([], self.executed)
+
+    def test_transaction(self):
+        self.stmt.bulk(self.rows(1), transaction=True)
+        self.module.transaction.assert_called_once_with()
+
+    def test_unknown_rowcount(self):
+        self.module._execute.side_effect = None
+        self.module._execute.return_value = Mock(rowcount=-1)
+        self.assertEqual(-1, self.stmt.bulk(self.rows(3), batch_size=2))
+
+    def test_positional_rows(self):
+        with pytest.raises(exceptions.InvalidArgumentError):
+            self.stmt.bulk([1, 2])
+
+
+class ExpandingParamTest(TestCase):
+    def test_shape_binds_expanding_copy(self):
+        s = parser.parse("-- :name foo\nselect * from t where x in :xs")
+        shape = s._shape({"xs": (1, 2)})
+        self.assertTrue(shape.clause._bindparams["xs"].expanding)
+        self.assertFalse(s._text._bindparams["xs"].expanding)
+
+    def test_shape_reused(self):
+        s = parser.parse("-- :name foo\nselect * from t where x in :xs")
+        self.assertIs(s._shape({"xs": (1,)}), s._shape({"xs": (1, 2)}))
+        self.assertIsNot(s._shape({"xs": (1,)}), s._shape({"xs": 1}))
+
+    def test_other_bindparams_unaffected(self):
+        s = parser.parse("-- :name foo\nselect * from t where x in :xs")
+        s._shape({"xs": (1, 2)})
+        clause = sqlalchemy.text("select * from t where x in :xs")
+        self.assertNotIn("POSTCOMPILE", str(clause.compile()))
+
+
+class ColumnBuilderTest(TestCase):
+    def setUp(self):
+        self.np = pytest.importorskip("numpy")
+
+    def test_grows(self):
+        b = _ColumnBuilder(["x"], 2)
+        b.append([(1,), (2,)])
+        b.append([(3,), (4,), (5,)])
+        cols = b.finish()
+        self.assertEqual([1, 2, 3, 4, 5], cols["x"].tolist())
+        self.assertEqual(self.np.int64, cols["x"].dtype)
+
+    def test_promotes_numeric(self):
+        b = _ColumnBuilder(["x"], 2)
+        b.append([(1,)])
+        b.append([(1.5,)])
+        cols = b.finish()
+        self.assertEqual([1.0, 1.5], cols["x"].tolist())
+        self.assertEqual(self.np.float64, cols["x"].dtype)
+
+    def test_null_falls_back_to_object(self):
+        b = _ColumnBuilder(["x"], 2)
+        b.append([(1,)])
+        b.append([(None,)])
+        cols = b.finish()
+        self.assertEqual([1, None], cols["x"].tolist())
+        self.assertEqual(object, cols["x"].dtype)
+
+    def test_sequence_values(self):
+        b = _ColumnBuilder(["x"], 2)
+        b.append([([1, 2],), ([3],)])
+        cols = b.finish()
+        self.assertEqual([[1, 2], [3]], cols["x"].tolist())
+
+
 class StrTest(TestCase):
     def test_no_params(self):
         s = parser.parse("-- :name foo\nselect * from users")